@@ -7,6 +7,96 @@ async function canvasToPngBlob(canvas) {
   return await new Promise((resolve) => canvas.toBlob(resolve, "image/png"));
 }
 
+// Layers are saved as a grid of TILE_SIZE x TILE_SIZE tiles; only tiles
+// whose pixels changed since the last successful save are uploaded.
+const TILE_SIZE = 256;
+
+/** Two 32-bit FNV-1a style hashes over the pixel words (collisions ~ 2^-64). */
+function hashPixels(words) {
+  let h1 = 0x811c9dc5, h2 = 0x01000193;
+  for (let i = 0; i < words.length; i++) {
+    const v = words[i];
+    h1 = Math.imul(h1 ^ v, 16777619);
+    h2 = Math.imul(h2 ^ v, 2246822519) ^ (h2 >>> 15);
+  }
+  return `${h1 >>> 0}:${h2 >>> 0}`;
+}
+
+/** Hash of every tile of a layer canvas: Map<"col,row", hash>, "" for blank tiles. */
+function tileHashes(canvas, ctx, visit) {
+  const hashes = new Map();
+  for (let y = 0, row = 0; y < canvas.height; y += TILE_SIZE, row++) {
+    for (let x = 0, col = 0; x < canvas.width; x += TILE_SIZE, col++) {
+      const img = ctx.getImageData(x, y, Math.min(TILE_SIZE, canvas.width - x), Math.min(TILE_SIZE, canvas.height - y));
+      const words = new Uint32Array(img.data.buffer);
+      const hash = words.every((v) => v === 0) ? "" : hashPixels(words);
+      hashes.set(`${col},${row}`, hash);
+      visit?.(col, row, img, hash);
+    }
+  }
+  return hashes;
+}
+
+function gridKey(canvas) {
+  return `${TILE_SIZE}:${canvas.width}x${canvas.height}`;
+}
+
+async function imageDataToPngBlob(img) {
+  const c = document.createElement("canvas");
+  c.width = img.width;
+  c.height = img.height;
+  c.getContext("2d").putImageData(img, 0, 0);
+  return await canvasToPngBlob(c);
+}
+
+/**
+ * Record what the server holds for a layer (call after drawing a loaded
+ * layer), so the next save only sends tiles that change from here.
+ */
+export function rememberSavedTiles(layer, layerIndex, savedTiles) {
+  const { canvas, ctx } = layer;
+  const sameGrid = savedTiles && savedTiles.size === TILE_SIZE
+    && savedTiles.width === canvas.width && savedTiles.height === canvas.height;
+  layer.savedTiles = sameGrid
+    ? { index: layerIndex, grid: gridKey(canvas), hashes: tileHashes(canvas, ctx) }
+    : null;
+}
+
+/**
+ * Dirty tiles of one layer. With reset (or nothing saved at this index with
+ * this grid yet) every non-blank tile is sent and the server starts over.
+ */
+async function diffLayerTiles(layer, layerIndex, reset) {
+  const { canvas, ctx } = layer;
+  const saved = layer.savedTiles;
+  const prev = !reset && saved && saved.index === layerIndex && saved.grid === gridKey(canvas)
+    ? saved.hashes
+    : null;
+
+  const changed = [];
+  const clear = [];
+  const hashes = tileHashes(canvas, ctx, (col, row, img, hash) => {
+    if (prev && prev.get(`${col},${row}`) === hash) return;
+    if (!hash) {
+      if (prev) clear.push(`${col},${row}`);
+      return;
+    }
+    changed.push({ col, row, img });
+  });
+
+  const files = [];
+  for (const { col, row, img } of changed) {
+    const blob = await imageDataToPngBlob(img);
+    if (!blob) throw new Error("Failed to export a layer tile to PNG (canvas may be tainted).");
+    files.push({ col, row, blob });
+  }
+  return {
+    spec: { size: TILE_SIZE, width: canvas.width, height: canvas.height, reset: !prev, clear },
+    files,
+    snapshot: { index: layerIndex, grid: gridKey(canvas), hashes },
+  };
+}
+
 async function fetchJSON(url, opts = {}) {
   const res = await fetch(url, {
     headers: { "Accept": "application/json", ...(opts.headers || {}) },
@@ -52,40 +142,65 @@ export async function deleteDesign(id) {
 
 /**
  * Save everything:
- * - upload layer PNGs (via Flask -> Supabase Storage using service key)
+ * - upload changed layer tiles (via Flask -> Supabase Storage using service key)
  * - upsert layers rows (via Flask -> Supabase PostgREST using service key)
  * - update stamps_json + updated_at
  */
 export async function saveDesign(designId, layers, stampObjects, opts = {}) {
+  const res = await postSave(designId, layers, stampObjects, !!opts.forceFull).catch((err) => {
+    // The stored tile grid changed under us (resize, another tab): resend everything
+    if (/^HTTP 409/.test(err.message) && !opts.forceFull) return postSave(designId, layers, stampObjects, true);
+    throw err;
+  });
+
+  // The server moved embedded custom-stamp images into assets; swap the
+  // data: URLs for the short asset URLs so later autosaves stay small.
+  const srcs = res?.stamp_srcs || {};
+  for (const obj of stampObjects || []) {
+    if (obj?.uid && srcs[obj.uid] && obj.customSrc?.startsWith("data:")) {
+      obj.customSrc = srcs[obj.uid];
+    }
+  }
+  return res;
+}
+
+async function postSave(designId, layers, stampObjects, forceFull) {
   const form = new FormData();
 
-  const forceFull = !!opts.forceFull;
+  // dirty tiles (ONLY dirty layers, unless forceFull)
+  const diffs = [];
+  for (let i = 0; i < layers.length; i++) {
+    const isDirty = !!layers[i].dirty;
+    diffs.push(!forceFull && !isDirty ? null : await diffLayerTiles(layers[i], i, forceFull));
+  }
 
-  // meta JSON (always send meta)
+  // meta JSON (always send meta, and first so the server can start uploading)
   const meta = {
     layers: layers.map((l, i) => ({
       layer_index: i,
       name: l.name,
       visible: l.visible,
+      ...(diffs[i] ? { tiles: diffs[i].spec } : {}),
     })),
     stamps: stampObjects || [],
   };
   form.append("meta", JSON.stringify(meta));
 
-  // layer files (ONLY dirty, unless forceFull)
-  for (let i = 0; i < layers.length; i++) {
-    const isDirty = !!layers[i].dirty;
-    if (!forceFull && !isDirty) continue;
-
-    const blob = await canvasToPngBlob(layers[i].canvas);
-    if (!blob) throw new Error("Failed to export a layer canvas to PNG (canvas may be tainted).");
-    form.append(`layer_${i}`, blob, `layer_${i}.png`);
-  }
+  diffs.forEach((diff, i) => {
+    for (const { col, row, blob } of diff?.files || []) {
+      form.append(`tile_${i}_${col}_${row}`, blob, `tile_${i}_${col}_${row}.png`);
+    }
+  });
 
-  await fetchJSON(`/api/designs/${encodeURIComponent(designId)}/save`, {
+  const res = await fetchJSON(`/api/designs/${encodeURIComponent(designId)}/save`, {
     method: "POST",
     body: form,
   });
+
+  diffs.forEach((diff, i) => {
+    if (diff) layers[i].savedTiles = diff.snapshot;
+  });
+  return res;
 }
 
 
@@ -95,9 +210,17 @@ export async function saveDesign(designId, layers, stampObjects, opts = {}) {
  *  {
  *    id, name, updated,
  *    stamps: [],
- *    layers: [{layer_index,name,visible,png_url}]
+ *    layers: [{layer_index,name,visible,png_url,trimmed_url,offset_x,offset_y,tiles}]
  *  }
  *
+ * png_url is the whole layer, drawn at 0,0. Layers optimized on save are
+ * stored trimmed to their drawn area; for those trimmed_url is the stored
+ * PNG (smaller), drawn at (offset_x, offset_y), and so are the bundle's
+ * bytes.
+ *
+ * tiles (tiled layers only): {size,width,height,tiles:[{col,row,hash,url}]};
+ * missing tiles are transparent. png_url always works too (stitched).
+ *
  * NOTE: png_url is SAME-ORIGIN (served by Flask), so it will NOT taint canvas.
  */
 export async function loadDesign(designId) {
@@ -105,6 +228,43 @@ export async function loadDesign(designId) {
 }
 
 
+/**
+ * Load a design AND its layer PNGs in a single request.
+ * Returns the same object as loadDesign() plus:
+ *   layerBlobs: Map<layer_index, Blob>
+ *   tileBlobs:  Map<layer_index, Map<"col,row", Blob>>   (tiled layers)
+ *
+ * The server streams multipart/form-data, so the browser parses it for us.
+ * Layers missing from the bundle (fetch failed server-side) aren't in the
+ * map; callers should fall back to png_url for those.
+ */
+export async function loadDesignBundle(designId, { allLayers = true } = {}) {
+  const qs = allLayers ? "?all=1" : "";
+  const res = await fetch(`/api/designs/${encodeURIComponent(designId)}/bundle${qs}`);
+  if (!res.ok) {
+    const t = await res.text().catch(() => "");
+    throw new Error(`loadDesignBundle failed: ${res.status} ${t}`);
+  }
+
+  const form = await res.formData();
+  const d = JSON.parse(form.get("design"));
+  const layerBlobs = new Map();
+  const tileBlobs = new Map();
+  for (const [name, value] of form.entries()) {
+    if (!(value instanceof Blob)) continue;
+    const m = /^layer_(\d+)$/.exec(name);
+    if (m) layerBlobs.set(Number(m[1]), value);
+    const t = /^tile_(\d+)_(\d+)_(\d+)$/.exec(name);
+    if (t) {
+      const idx = Number(t[1]);
+      if (!tileBlobs.has(idx)) tileBlobs.set(idx, new Map());
+      tileBlobs.get(idx).set(`${t[2]},${t[3]}`, value);
+    }
+  }
+  return { ...d, layerBlobs, tileBlobs };
+}
+
+
 /** Rename a design (updates updated_at server-side) */
 export async function renameDesign(designId, name) {
   return await fetchJSON(`/api/designs/${encodeURIComponent(designId)}`, {
@@ -2,7 +2,7 @@
 // Shield Designer — appController.js
 // ============================================================
 
-import { listDesigns, createDesign, saveDesign, loadDesign, deleteDesign, renameDesign } from "../Storage/repo.js";
+import { listDesigns, createDesign, saveDesign, loadDesign, loadDesignBundle, rememberSavedTiles, deleteDesign, renameDesign } from "../Storage/repo.js";
 import { createRenderScheduler } from "./core/renderScheduler.js";
 import { loadUIState, saveUIState as saveUIStateMod, applyUIState as applyUIStateMod, wireSidebarButtons } from "./ui/uiState.js";
 import { createShieldMask } from "./canvas/shieldMask.js";
@@ -580,7 +580,7 @@ const designsCtrl = createDesignsController({
   setActiveDesignId:  (id) => { activeDesignId = id; },
   setStampObjects:    (arr) => { stamps.setStampObjects(arr); },
   clearSelectedStamp: () => { stamps.clearSelection(); },
-  storage: { listDesigns, createDesign, loadDesign, deleteDesign, renameDesign },
+  storage: { listDesigns, createDesign, loadDesign, loadDesignBundle, rememberSavedTiles, deleteDesign, renameDesign },
   saveDebounced: () => saveActiveToDesignsDebounced(),
   cancelSave:    () => saveMgr.cancel(),
 });
@@ -657,7 +657,7 @@ export async function boot() {
 
   if (activeDesignId) {
     await loadDesignIntoCanvas(activeDesignId, {
-      storage: { loadDesign },
+      storage: { loadDesign, loadDesignBundle, rememberSavedTiles },
       layersSys,
       setActiveDesignId:  (id) => { activeDesignId = id; },
       setStampObjects:    (arr) => { stamps.setStampObjects(arr); },
@@ -46,8 +46,10 @@ export function createDesignsController({
         el.className = "design-card" + (d.id === activeId ? " active" : "");
         el.dataset.designId = d.id;
 
-        // Restore thumbnail from sessionStorage if available
-        const thumbUrl = (() => { try { return sessionStorage.getItem(`thumb_${d.id}`); } catch { return null; } })();
+        // Thumbnail drawn by this tab (with background + stamps) if there is one,
+        // else the server's flattened layers
+        const thumbUrl = (() => { try { return sessionStorage.getItem(`thumb_${d.id}`); } catch { return null; } })()
+          || `/api/designs/${encodeURIComponent(d.id)}/thumbnail.png?v=${normalizeUpdated(d)}`;
 
         el.innerHTML = `
           ${thumbUrl ? `<div class="design-thumb" style="background-image:url(${thumbUrl})"></div>` : `<div class="design-thumb design-thumb--empty"></div>`}
@@ -71,7 +73,7 @@ export function createDesignsController({
           render();
 
           await loadDesignIntoCanvas(d.id, {
-            storage: { loadDesign: storage.loadDesign },
+            storage: { loadDesign: storage.loadDesign, loadDesignBundle: storage.loadDesignBundle, rememberSavedTiles: storage.rememberSavedTiles },
             layersSys,
             setActiveDesignId,
             setStampObjects,
@@ -109,7 +111,7 @@ export function createDesignsController({
               cancelSave?.(); // FIX: also cancel before auto-loading next design after delete
               setActiveDesignId(designs[0].id);
               await loadDesignIntoCanvas(designs[0].id, {
-                storage: { loadDesign: storage.loadDesign },
+                storage: { loadDesign: storage.loadDesign, loadDesignBundle: storage.loadDesignBundle, rememberSavedTiles: storage.rememberSavedTiles },
                 layersSys,
                 setActiveDesignId,
                 setStampObjects,
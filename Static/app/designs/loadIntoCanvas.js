@@ -6,7 +6,7 @@
  * Dependencies are injected to avoid globals.
  */
 export async function loadDesignIntoCanvas(designId, {
-  storage,            // { loadDesign }
+  storage,            // { loadDesign, loadDesignBundle?, rememberSavedTiles? }
   layersSys,
   setActiveDesignId,  // (id) => void
   setStampObjects,    // (arr) => void
@@ -15,7 +15,10 @@ export async function loadDesignIntoCanvas(designId, {
   resetHistory,       // () => void
   displayCanvas,      // for sizing
 } = {}) {
-  const d = await storage.loadDesign(designId);
+  // One round trip (meta + PNGs) when the bundle endpoint is available
+  const d = storage.loadDesignBundle
+    ? await storage.loadDesignBundle(designId)
+    : await storage.loadDesign(designId);
   if (!d) return null;
 
   setActiveDesignId?.(d.id);
@@ -50,15 +53,38 @@ export async function loadDesignIntoCanvas(designId, {
     img.src = url;
   });
 
+  // Tiled layers: draw each stored tile in its grid cell
+  const drawTiles = async (layer, l) => {
+    const blobs = d.tileBlobs?.get(l.layer_index);
+    const imgs = await Promise.all(l.tiles.tiles.map(async (t) => {
+      const blob = blobs?.get(`${t.col},${t.row}`);
+      return [t, blob ? await createImageBitmap(blob) : await loadImage(t.url)];
+    }));
+    layer.ctx.clearRect(0, 0, displayCanvas.width, displayCanvas.height);
+    for (const [t, img] of imgs) {
+      layer.ctx.drawImage(img, t.col * l.tiles.size, t.row * l.tiles.size);
+    }
+  };
+
   await Promise.all(
     d.layers.map(async (l, i) => {
       if (!l.png_url) return;
       try {
-        const img = await loadImage(l.png_url);
         const layer = layersSys.layers[i];
         if (!layer?.ctx) return;
-        layer.ctx.clearRect(0, 0, displayCanvas.width, displayCanvas.height);
-        layer.ctx.drawImage(img, 0, 0);
+        if (l.tiles) {
+          await drawTiles(layer, l);
+        } else {
+          const blob = d.layerBlobs?.get(l.layer_index);
+          const img = blob ? await createImageBitmap(blob) : await loadImage(l.trimmed_url || l.png_url);
+          layer.ctx.clearRect(0, 0, displayCanvas.width, displayCanvas.height);
+          // Layers optimized on save are stored trimmed to their drawn area
+          // (the bundle's bytes and trimmed_url); png_url is the whole layer
+          const at = blob || l.trimmed_url ? [l.offset_x || 0, l.offset_y || 0] : [0, 0];
+          layer.ctx.drawImage(img, ...at);
+        }
+        // Next save only sends the tiles that change from here
+        storage.rememberSavedTiles?.(layer, i, l.tiles);
       } catch (err) {
         console.warn(err);
       }
@@ -14,7 +14,9 @@
 //     needs to be in the registry. We solve this by embedding the
 //     dataURL in the stampObject as `customSrc`, which loadIntoCanvas
 //     passes back through setStampObjects → we re-register it.
-//   - No backend changes needed: everything rides in stamps_json.
+//   - The server pulls data: URLs out of stamps_json into content-addressed
+//     assets on save and hands back /api/assets/<hash>.<ext> URLs, which
+//     work the same way as customSrc (same-origin, so no canvas taint).
 
 import { STAMPS } from "./stampsData.js";
 import { DEFAULT_STAMP_SIZE } from "../../core/constants.js";
@@ -61,6 +63,24 @@ function findStampMeta(stampId) {
   return STAMPS.find(s => s.id === stampId) || null;
 }
 
+// ── Palette thumbnails ────────────────────────────────────────
+// The server's asset build (assets.py) makes small thumbnails of the built-in
+// stamps, and with STAMP_ATLAS=1 packs them into one sprite sheet; the page
+// passes their URLs in window.__STAMP_THUMBS__, keyed by stamp src. Cells are
+// drawn at half size: thumbnails are 2x the 44px .stamp-thumb box.
+function stampThumbHtml(src) {
+  const thumbs = window.__STAMP_THUMBS__ || {};
+  const cell = thumbs.atlas?.cells?.[src];
+  if (cell) {
+    const [x, y, w, h] = cell;
+    const a = thumbs.atlas;
+    return `<span class="stamp-sprite" style="width:${w / 2}px;height:${h / 2}px;`
+      + `background-image:url('${a.url}');background-size:${a.width / 2}px ${a.height / 2}px;`
+      + `background-position:${-x / 2}px ${-y / 2}px"></span>`;
+  }
+  return `<img src="${thumbs.thumbs?.[src] || src}" alt="" draggable="false" loading="lazy" />`;
+}
+
 // Init on module load
 loadCustomStampsFromStorage();
 
@@ -526,7 +546,7 @@ export function createStampSystem({
 
     const thumbHtml = `
       <div class="stamp-thumb">
-        <img src="${s.src}" alt="" draggable="false" loading="lazy" />
+        ${stampThumbHtml(s.src)}
       </div>
     `;
 
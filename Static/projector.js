@@ -1,6 +1,7 @@
 // ============================================================
 // Projector Export Page (Integrated)
-// - Loads last shield export from localStorage (roman_shield_last_export)
+// - Loads the design's flattened layers from the server (/projector?design=<id>),
+//   or else the last shield export from localStorage (roman_shield_last_export)
 // - Applies cylindrical curvature pre-warp (using widthIn + curveIn from UI_KEY)
 // - 4-corner keystone mapping (interactive)
 // - Drag inside quad to move, wheel to scale, Shift+drag to rotate (optional)
@@ -9,7 +10,7 @@
 //    * Projector px/in
 //    * Auto-fit 31×40×8 (sizes the quad to real inches in projector pixels)
 // - Persists mapping in localStorage
-// - Exports final projector-ready PNG
+// - Exports final projector-ready PNG (rendered exactly on the server when it can)
 // ============================================================
 
 const EXPORT_KEY = "roman_shield_last_export";
@@ -38,8 +39,12 @@ backBtn.addEventListener("click", () => {
   else window.location.href = "/";
 });
 
-// --- Load the design image from localStorage (saved by designer export)
-const imgDataUrl = localStorage.getItem(EXPORT_KEY);
+// --- Load the design image: server composite (same-origin, so the canvas
+// isn't tainted) or localStorage (saved by designer export)
+const designParam = new URLSearchParams(window.location.search).get("design");
+const imgDataUrl = designParam
+  ? `/api/designs/${encodeURIComponent(designParam)}/composite.png`
+  : localStorage.getItem(EXPORT_KEY);
 const designImg = new Image();
 let designReady = false;
 
@@ -750,11 +755,39 @@ resetBtn.addEventListener("click", () => {
   resetMapping();
 });
 
-downloadBtn.addEventListener("click", () => {
+// Exact warp + keystone rendered by the server (no triangle seams, no
+// overlays); falls back to this canvas if the server can't (e.g. no NumPy)
+async function renderOnServer(){
+  if (!designReady || !baseSrcCanvas || !quad) return null;
+  const params = new URLSearchParams({
+    quad: quad.map((p) => `${p.x},${p.y}`).join(","),
+    w: canvas.width,
+    h: canvas.height,
+    bg: "0f0b08",
+  });
+  if (warpToggle.checked){
+    const { widthIn, curveIn } = loadScaleModel();
+    params.set("width_in", widthIn);
+    params.set("curve_in", curveIn);
+  }
+  let res;
+  if (designParam){
+    res = await fetch(`/api/designs/${encodeURIComponent(designParam)}/projector.png?${params}`);
+  } else {
+    const body = await new Promise((resolve) => baseSrcCanvas.toBlob(resolve, "image/png"));
+    if (!body) return null;
+    res = await fetch(`/api/projector.png?${params}`, { method: "POST", body, headers: { "Content-Type": "image/png" } });
+  }
+  return res.ok ? await res.blob() : null;
+}
+
+downloadBtn.addEventListener("click", async () => {
   const a = document.createElement("a");
   a.download = "projector-ready.png";
-  a.href = canvas.toDataURL("image/png");
+  const blob = await renderOnServer().catch(() => null);
+  a.href = blob ? URL.createObjectURL(blob) : canvas.toDataURL("image/png");
   a.click();
+  if (blob) setTimeout(() => URL.revokeObjectURL(a.href), 5000);
 });
 
 // ============================================================
@@ -1,13 +1,80 @@
 import os
+import re
 import json
+import base64
+import gzip
 from datetime import datetime, timezone
 import hashlib
-from typing import Dict, Tuple, Optional
+import math
+import mimetypes
+import tempfile
+from typing import Dict, List, Tuple, Optional
 import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed, CancelledError
 import requests
-from flask import Flask, render_template, Response, request, jsonify, g
+from requests.adapters import HTTPAdapter
+from flask import Blueprint, Flask, render_template, Response, request, jsonify, g, send_file, send_from_directory
+from werkzeug.security import safe_join
 from dotenv import load_dotenv
 
+try:
+    import brotli
+except ImportError:  # optional; gzip covers every browser
+    brotli = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: no serve.py workers there, so nothing to lock against
+    fcntl = None
+
+from caches import LayerDiskCache, LayerKey, LayerPngCache, SharedGenerations, SingleFlight, TTLCache
+from ingest import IngestError, SpooledPart, iter_multipart
+from savequeue import PendingSave, SaveQueue
+from pngopt import optimize_png, pad_png
+from assets import (
+    MANIFEST as ASSET_MANIFEST,
+    AssetError,
+    current_manifest,
+    encoded_path,
+    load_or_build,
+    source_files,
+)
+from composite import composite
+from warp import (
+    MAX_OUTPUT_PX as WARP_MAX_PX,
+    WarpError,
+    available as warp_available,
+    render as render_warp,
+)
+from tiles import (
+    MAX_LAYER_PX,
+    PNG_SIGNATURE,
+    TileError,
+    decode_rgba,
+    grid_size,
+    is_blank,
+    manifest_digest,
+    parse_grid,
+    parse_key,
+    parse_manifest,
+    png_header,
+    same_grid,
+    stitch,
+    tile_key,
+)
+from backends import (
+    Backend,
+    BackendError,
+    CircuitBreaker,
+    CircuitOpen,
+    LocalBackend,
+    RetryPolicy,
+    SupabaseBackend,
+)
+from metrics import Registry, merge as merge_metrics, render_families
+
 # ============================================================
 # LOGIN IMPORTS (kept, but login is disabled below)
 # ============================================================
@@ -18,64 +85,412 @@ import secrets
 
 
 load_dotenv()
-app = Flask(__name__)
+# Every route, hook and template global below is registered on this
+# blueprint; create_app() (see "Run") builds the Flask app around it.
+bp = Blueprint("designer", __name__)
 
 # --- LOGIN DISABLED (optional prints) ---
 # print("Login configured:", bool(os.getenv("ADMIN_USER")) and bool(os.getenv("ADMIN_PASS_HASH")))
 # from werkzeug.security import generate_password_hash
 # print(generate_password_hash("PerseusAndromeda"))
 
-# IMPORTANT: set this in .env as a long random string
-app.secret_key = os.getenv("FLASK_SECRET_KEY", "") or secrets.token_hex(32)
+# ============================================================
+# Env config helpers
+# ============================================================
+def _env_int(name: str, default: int) -> int:
+    raw = os.getenv(name, "").strip()
+    try:
+        return int(raw) if raw else default
+    except ValueError:
+        return default
+
+def _env_float(name: str, default: float) -> float:
+    raw = os.getenv(name, "").strip()
+    try:
+        return float(raw) if raw else default
+    except ValueError:
+        return default
+
+# ============================================================
+# Process state
+#   Anything that holds threads, connections, files or a memory budget
+#   (upstream session, backend, pools, caches, save queue, background
+#   threads) is built by create_app(), not on import, so a server can
+#   import this module and fork workers afterwards. Sections register a
+#   builder with @_builds_state; they run once per process, in file order,
+#   and the names they set don't exist until then. Plain bookkeeping
+#   (locks, dicts, metric objects) is still set up on import.
+# ============================================================
+_state_builders: list = []
+_state_pid: Optional[int] = None  # the process create_app() built the state in
+_state_lock = threading.Lock()
 
-# Harden cookies
-app.config.update(
-    SESSION_COOKIE_HTTPONLY=True,
-    SESSION_COOKIE_SAMESITE="Lax",   # "Strict" is safer but can annoy some flows
-    SESSION_COOKIE_SECURE=False,     # set True when behind HTTPS / reverse proxy
+def _builds_state(fn):
+    _state_builders.append(fn)
+    return fn
+
+# ============================================================
+# Worker processes
+#   serve.py forks SERVER_WORKERS copies of this app onto one listening
+#   socket, so request work isn't bound to a single interpreter's GIL. Each
+#   worker calls create_app() after the fork and so has its own upstream
+#   session and pools. What they share:
+#     - the layer PNGs: the disk tier (one content-addressed directory, read
+#       through the OS page cache) is the only copy, see "Server RAM cache
+#       for layer PNGs";
+#     - change stamps in SHARED_STATE_DIR, so a save or delete in one
+#       worker invalidates the design list/meta and layer PNGs in all of
+#       them, and metrics (see /metrics).
+#   The other RAM budgets (TILE_CACHE_MAX_MB, COMPOSITE_CACHE_MAX_MB, ...)
+#   are for the whole server and get split between the workers, so memory
+#   doesn't grow with the worker count. /api/cache/stats is per worker.
+#   SERVER_WORKERS     set by serve.py (default 1)
+#   SHARED_STATE_DIR   where the stamps live (default ./.cache/workers)
+# ============================================================
+SERVER_WORKERS = max(1, _env_int("SERVER_WORKERS", 1))
+_SHARED_DIR = os.getenv("SHARED_STATE_DIR", "").strip() or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), ".cache", "workers"
 )
+_shared_meta: Optional[SharedGenerations] = None
+_shared_layers: Optional[SharedGenerations] = None
+
+@_builds_state
+def _build_shared_state():
+    global _shared_meta, _shared_layers
+    if SERVER_WORKERS == 1:
+        return
+    if os.getenv("SAVE_WRITE_BEHIND", "").strip() == "1":
+        raise RuntimeError("SAVE_WRITE_BEHIND=1 needs a single worker (the save queue is per process)")
+    _shared_meta = SharedGenerations(os.path.join(_SHARED_DIR, "meta.gen"))
+    _shared_layers = SharedGenerations(os.path.join(_SHARED_DIR, "layers.gen"))
+
+def _worker_budget_mb(name: str, default: int) -> int:
+    """This worker's share of a server-wide RAM budget (in MB, for name in .env)."""
+    return _env_int(name, default) * 1024 * 1024 // SERVER_WORKERS
 
 # ============================================================
 # Global HTTP Session (connection reuse)
+#   urllib3 keeps 10 connections per host by default; past that every
+#   extra concurrent call opens (and then throws away) a new one. Size the
+#   pool for everything that can talk to Supabase at once: request threads
+#   plus the bundle fetch, layer prefetch, save upload and save flush pools.
+#   SERVER_THREADS       waitress worker threads (default 4)
+#   UPSTREAM_POOL_SIZE   connections kept per host (default: the sum above)
 # ============================================================
-SESSION = requests.Session()
+SERVER_THREADS = max(1, _env_int("SERVER_THREADS", 4))
+_UPSTREAM_POOL_SIZE = _env_int("UPSTREAM_POOL_SIZE", 0) or (
+    SERVER_THREADS
+    + _env_int("LAYER_FETCH_WORKERS", 8)
+    + _env_int("LAYER_PREFETCH_WORKERS", 4)
+    + _env_int("SAVE_UPLOAD_WORKERS", 6)
+    + _env_int("SAVE_FLUSH_WORKERS", 2)
+)
+SESSION: requests.Session
+
+@_builds_state
+def _build_session():
+    global SESSION
+    SESSION = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(1, _UPSTREAM_POOL_SIZE))
+    SESSION.mount("https://", adapter)
+    SESSION.mount("http://", adapter)
 
 # ============================================================
 # Server RAM cache for layer PNGs
 #   key: (design_id, layer_index)
 #   value: (png_bytes, etag)
+#
+# Bounded LRU so RSS stays flat no matter how many designs get opened.
+# Tune in .env:
+#   LAYER_CACHE_MAX_MB       total byte budget (default 256)
+#   LAYER_CACHE_MAX_ENTRIES  entry cap (default 2048)
+#   LAYER_CACHE_TTL_S        optional max age in seconds (default: none)
+#   LAYER_CACHE_MAX_ENTRY_MB largest single PNG kept in RAM (default 32);
+#                            bigger layers are only cached on disk
+#
+# With several workers (serve.py) and the disk tier on, this RAM tier is
+# off: a copy per worker would hold every hot layer N times. The disk tier
+# is the layer cache the workers share instead. Its blobs are read through
+# the OS page cache, which keeps one copy of a hot layer in RAM for all of
+# them, and hits are sent with sendfile, so a layer is never copied into a
+# worker to be served. Put LAYER_DISK_CACHE_DIR on a tmpfs (e.g. /dev/shm)
+# to keep the whole tier in memory. Without a disk tier each worker keeps
+# its share of LAYER_CACHE_MAX_MB.
 # ============================================================
-LayerKey = Tuple[str, int]
-_layer_png_cache: Dict[LayerKey, Tuple[bytes, str]] = {}
+_layer_png_cache: LayerPngCache
+
+def _layer_ram_budget() -> int:
+    if SERVER_WORKERS > 1 and _layer_disk_cache is not None:
+        return 0
+    return _worker_budget_mb("LAYER_CACHE_MAX_MB", 256)
+
+# ============================================================
+# Disk cache for layer PNGs (second tier under the RAM cache)
+#   Survives restarts, so a fresh process doesn't re-download every layer.
+#   LAYER_DISK_CACHE_DIR     where to keep it (default ./.cache/layer_png)
+#   LAYER_DISK_CACHE_MAX_MB  size cap, 0 disables the disk tier (default 1024)
+#   USE_X_SENDFILE           set to 1 behind nginx/apache to offload file sends
+# ============================================================
+_layer_disk_cache: Optional[LayerDiskCache] = None
+
+@_builds_state
+def _build_layer_caches():
+    global _layer_png_cache, _layer_disk_cache
+    if _env_int("LAYER_DISK_CACHE_MAX_MB", 1024) > 0:
+        _layer_disk_cache = LayerDiskCache(
+            os.getenv("LAYER_DISK_CACHE_DIR", "").strip()
+            or os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "layer_png"),
+            max_bytes=_env_int("LAYER_DISK_CACHE_MAX_MB", 1024) * 1024 * 1024,
+            # Every worker writes here; recount now and then so the cap holds for all of them
+            rescan_s=60.0 if SERVER_WORKERS > 1 else 0.0,
+        )
+    ram = _layer_ram_budget()
+    _layer_png_cache = LayerPngCache(
+        max_bytes=ram,
+        max_entries=_env_int("LAYER_CACHE_MAX_ENTRIES", 2048),
+        ttl_s=_env_float("LAYER_CACHE_TTL_S", 0.0) or None,
+        max_entry_bytes=min(ram, _env_int("LAYER_CACHE_MAX_ENTRY_MB", 32) * 1024 * 1024),
+        # Kept even with the RAM tier off: its change stamps guard the disk refs too
+        shared=_shared_layers,
+    )
+
+def _invalidate_layer_cache(design_id: str, layer_index: int):
+    key: LayerKey = (design_id, int(layer_index))
+    _layer_png_cache.pop(key, None)
+    if _layer_disk_cache is not None:
+        _layer_disk_cache.invalidate(key)
+
+def _purge_design_cache(design_id: str):
+    _purge_designs_cache([design_id])
+
+def _purge_designs_cache(design_ids):
+    _layer_png_cache.purge_designs(design_ids)
+    _tile_cache.purge_designs(design_ids)
+    _composite_cache.purge_designs(design_ids)
+    _projector_cache.purge_designs(design_ids)
+    if _layer_disk_cache is not None:
+        _layer_disk_cache.purge_designs(design_ids)
+
+# ============================================================
+# Metadata caches (design list + per-design rows)
+#   Our own write routes update/invalidate these immediately; the TTL only
+#   bounds how long edits made elsewhere (Supabase dashboard, another
+#   instance) can stay invisible.
+#   DESIGN_LIST_CACHE_TTL_S   default 15   (0 disables)
+#   DESIGN_META_CACHE_TTL_S   default 60   (0 disables)
+# ============================================================
+_DESIGN_LIST_KEY = "all"
+_design_list_cache: TTLCache
+# key: design_id -> (design_row, layer_rows)
+_design_meta_cache: TTLCache
+
+@_builds_state
+def _build_meta_caches():
+    global _design_list_cache, _design_meta_cache
+    _design_list_cache = TTLCache(
+        ttl_s=_env_float("DESIGN_LIST_CACHE_TTL_S", 15.0), max_entries=1, shared=_shared_meta,
+    )
+    _design_meta_cache = TTLCache(
+        ttl_s=_env_float("DESIGN_META_CACHE_TTL_S", 60.0),
+        max_entries=_env_int("DESIGN_META_CACHE_MAX_ENTRIES", 256),
+        shared=_shared_meta,
+    )
+
+# Sort key shared by the cached list and keyset pagination (newest first)
+def _list_sort_key(x: dict):
+    return x["updated"], x["id"] or ""
+
+def _list_upsert_entry(entry: dict):
+    """Write-through one {id,name,updated} entry into the cached design list."""
+    def _apply(items):
+        out = [x for x in items if x["id"] != entry["id"]]
+        out.append(entry)
+        out.sort(key=_list_sort_key, reverse=True)
+        return out
+    _design_list_cache.update(_DESIGN_LIST_KEY, _apply)
+
+def _list_touch_entry(design_id: str, updated_ms: int, name: Optional[str] = None):
+    def _apply(items):
+        out = []
+        for x in items:
+            if x["id"] == design_id:
+                x = dict(x, updated=updated_ms, **({"name": name} if name is not None else {}))
+            out.append(x)
+        out.sort(key=_list_sort_key, reverse=True)
+        return out
+    _design_list_cache.update(_DESIGN_LIST_KEY, _apply)
+
+# Deletes don't move any row's updated_at, so Last-Modified also has to
+# account for the last time we removed something from the list.
+_list_last_delete_ms = 0
+
+def _note_list_delete():
+    global _list_last_delete_ms
+    _list_last_delete_ms = int(time.time() * 1000)
+
+def _list_remove_entries(design_ids):
+    _note_list_delete()
+    gone = set(design_ids)
+    _design_list_cache.update(_DESIGN_LIST_KEY, lambda items: [x for x in items if x["id"] not in gone])
 
 def _make_etag(data: bytes) -> str:
     # Strong ETag (content hash). Browser sends it back as If-None-Match.
     return '"' + hashlib.sha1(data).hexdigest() + '"'
 
 # ============================================================
-# Timing helpers
+# Metrics (Prometheus text at GET /metrics) + request timing
+#   Per-route and per-upstream-call latency histograms, in-flight and
+#   error counters; cache and save queue numbers are read at scrape time.
+#   LOG_REQUESTS=1 also prints one line per request and per upstream
+#   call to stdout (off by default: it costs real time under load).
 # ============================================================
-def timed(label: str, fn):
-    t0 = time.perf_counter()
-    out = fn()
-    dt = (time.perf_counter() - t0) * 1000
-    print(f"  {label}: {dt:.1f}ms")
-    return out
+_LOG_REQUESTS = os.getenv("LOG_REQUESTS", "").strip() == "1"
+
+_metrics = Registry()
+_http_seconds = _metrics.histogram(
+    "shield_http_request_duration_seconds",
+    "Time to produce a response, by route (streamed bodies not included)",
+    ("route", "method", "status"),
+)
+_http_in_flight = _metrics.gauge("shield_http_requests_in_flight", "Requests being handled right now")
+_http_errors = _metrics.counter(
+    "shield_http_request_errors_total", "Responses with a 5xx status", ("route", "method", "status"),
+)
+_upstream_seconds = _metrics.histogram(
+    "shield_upstream_duration_seconds", "Storage backend calls (REST, Storage, SQLite)", ("backend", "op"),
+)
+_upstream_errors = _metrics.counter(
+    "shield_upstream_errors_total", "Storage backend calls that raised", ("backend", "op"),
+)
 
-@app.before_request
+def _log(*args):
+    if _LOG_REQUESTS:
+        print(*args)
+
+def _upstream_timer(backend_name: str):
+    """The timed(op, fn) hook handed to a storage backend."""
+    def timed(op: str, fn):
+        t0 = time.perf_counter()
+        try:
+            return fn()
+        except Exception:
+            _upstream_errors.inc(backend_name, op)
+            raise
+        finally:
+            dt = time.perf_counter() - t0
+            _upstream_seconds.observe(dt, backend_name, op)
+            if _LOG_REQUESTS:
+                print(f"  {op}: {dt * 1000:.1f}ms")
+    return timed
+
+@bp.before_app_request
 def _t0():
     g._t0 = time.perf_counter()
+    _http_in_flight.inc()
 
-@app.after_request
+@bp.after_app_request
 def _t1(resp):
-    dt = (time.perf_counter() - g._t0) * 1000
-    print(f"{request.method} {request.path} -> {resp.status_code} in {dt:.1f}ms")
+    dt = time.perf_counter() - g._t0
+    route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+    status = str(resp.status_code)
+    _http_seconds.observe(dt, route, request.method, status)
+    if resp.status_code >= 500:
+        _http_errors.inc(route, request.method, status)
+    if _LOG_REQUESTS:
+        print(f"{request.method} {request.path} -> {resp.status_code} in {dt * 1000:.1f}ms")
+    return resp
+
+@bp.teardown_app_request
+def _t2(exc):
+    if "_t0" in g:
+        _http_in_flight.dec()
+
+# ============================================================
+# JSON response compression
+#   JSON bodies of COMPRESS_MIN_BYTES or more go out gzip- or brotli-
+#   encoded, whichever Accept-Encoding prefers (brotli needs the brotli
+#   package). PNGs, streamed and already-encoded responses are left alone.
+#   An encoded response's ETag is made weak (W/"..."); If-None-Match is
+#   compared weakly, so revalidation still gets its 304. /metrics has body
+#   sizes, ratios and CPU time per route, to tune the threshold with.
+#   COMPRESS_JSON            0 disables (default 1)
+#   COMPRESS_MIN_BYTES       smaller bodies are sent as-is (default 1024)
+#   COMPRESS_LEVEL           gzip level, 1-9 (default 6)
+#   COMPRESS_BROTLI_QUALITY  brotli quality, 0-11 (default 5)
+# ============================================================
+_COMPRESS_JSON = os.getenv("COMPRESS_JSON", "").strip() != "0"
+_COMPRESS_MIN_BYTES = _env_int("COMPRESS_MIN_BYTES", 1024)
+_COMPRESS_LEVEL = min(9, max(1, _env_int("COMPRESS_LEVEL", 6)))
+_COMPRESS_BROTLI_QUALITY = min(11, max(0, _env_int("COMPRESS_BROTLI_QUALITY", 5)))
+_COMPRESS_ENCODINGS = ["br", "gzip"] if brotli is not None else ["gzip"]
+
+_json_bytes = _metrics.histogram(
+    "shield_http_json_response_bytes", "Size of JSON response bodies before compression", ("route",),
+    buckets=(256, 512, 1024, 2048, 4096, 8192, 16384, 65536, 262144, 1048576, 4194304),
+)
+_compress_seconds = _metrics.histogram(
+    "shield_http_compress_cpu_seconds", "CPU time spent compressing a JSON response", ("route", "encoding"),
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25),
+)
+_compress_ratio = _metrics.histogram(
+    "shield_http_compress_ratio", "Compressed / original size of JSON responses", ("route", "encoding"),
+    buckets=(0.05, 0.1, 0.15, 0.2, 0.3, 0.4, 0.5, 0.7, 0.9, 1.0),
+)
+_compress_in = _metrics.counter(
+    "shield_http_compress_input_bytes_total", "JSON bytes compressed", ("route", "encoding"),
+)
+_compress_out = _metrics.counter(
+    "shield_http_compress_output_bytes_total", "Bytes sent for them", ("route", "encoding"),
+)
+
+@bp.after_app_request
+def _compress_json(resp):
+    # Registered after _t1, so it runs first and its time counts toward the route
+    if resp.status_code == 304:
+        # Echo the weak tag of the encoded copy the client is revalidating
+        etag, weak = resp.get_etag()
+        if etag and not weak and f'W/"{etag}"' in request.headers.get("If-None-Match", ""):
+            resp.set_etag(etag, weak=True)
+            resp.vary.add("Accept-Encoding")
+        return resp
+    if (not _COMPRESS_JSON or resp.direct_passthrough or resp.is_streamed
+            or not 200 <= resp.status_code < 300 or resp.status_code in (204, 206)
+            or "Content-Encoding" in resp.headers
+            or not (resp.mimetype == "application/json" or resp.mimetype.endswith("+json"))):
+        return resp
+    route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+    data = resp.get_data()
+    _json_bytes.observe(len(data), route)
+    if len(data) < _COMPRESS_MIN_BYTES:
+        return resp
+    resp.vary.add("Accept-Encoding")
+    encoding = request.accept_encodings.best_match(_COMPRESS_ENCODINGS)
+    if encoding is None:
+        return resp
+
+    t0 = time.thread_time()
+    if encoding == "br":
+        body = brotli.compress(data, quality=_COMPRESS_BROTLI_QUALITY)
+    else:
+        body = gzip.compress(data, _COMPRESS_LEVEL, mtime=0)
+    _compress_seconds.observe(time.thread_time() - t0, route, encoding)
+    _compress_ratio.observe(len(body) / len(data), route, encoding)
+    if len(body) >= len(data):
+        return resp
+    _compress_in.inc(route, encoding, amount=len(data))
+    _compress_out.inc(route, encoding, amount=len(body))
+
+    resp.set_data(body)
+    resp.headers["Content-Encoding"] = encoding
+    etag, weak = resp.get_etag()
+    if etag and not weak:
+        resp.set_etag(etag, weak=True)
     return resp
 
 # ============================================================
 # Config exposed to browser (SAFE)
 # ============================================================
-@app.get("/config.js")
+@bp.get("/config.js")
 def config_js():
     supabase_url = os.getenv("SUPABASE_URL", "").strip()
     supabase_anon = os.getenv("SUPABASE_ANON_KEY", "").strip()
@@ -89,164 +504,81 @@ def config_js():
     return Response(js, mimetype="application/javascript")
 
 # ============================================================
-# Internal Supabase helpers (SERVER ONLY)
+# Storage backend (SERVER ONLY)
+#   STORAGE_BACKEND=supabase  PostgREST + Storage (default; needs SUPABASE_*)
+#   STORAGE_BACKEND=local     SQLite + files under LOCAL_DATA_DIR (default
+#                             ./data); no network, for LAN installs and benchmarks
+#
+# Supabase calls are bounded so a sick upstream can't hold every worker:
+#   UPSTREAM_CONNECT_TIMEOUT_S  / UPSTREAM_READ_TIMEOUT_S   (default 3 / 10)
+#   UPSTREAM_RETRIES            extra attempts for idempotent calls, with
+#                               jittered backoff (default 2)
+#   UPSTREAM_DEADLINE_S         budget for one call including its retries and
+#                               backoff; 0 for none (default 20)
+#   UPSTREAM_BREAKER_FAILURES   consecutive failures that open the circuit
+#                               breaker (default 5)
+#   UPSTREAM_BREAKER_RESET_S    how long it fails fast before letting one
+#                               trial call through (default 15)
+# While the breaker is open, cached design metadata and lists are served
+# even if expired, cached layer PNGs keep working, and everything else gets
+# a 503 with Retry-After right away.
 # ============================================================
-_SB_JSON_HEADERS: Optional[dict] = None
-_SB_STORAGE_HEADERS: Dict[str, dict] = {}
-
-def _sb_url() -> str:
-    url = os.getenv("SUPABASE_URL", "").strip()
-    if not url.startswith("http"):
-        raise RuntimeError("SUPABASE_URL missing/invalid in .env")
-    return url
-
-def _service_key() -> str:
-    key = os.getenv("SUPABASE_SERVICE_ROLE_KEY", "").strip()
-    if not key:
-        raise RuntimeError("SUPABASE_SERVICE_ROLE_KEY missing in .env (server-only key)")
-    return key
-
-def _bucket() -> str:
-    return os.getenv("SUPABASE_BUCKET", "ShieldBucket").strip()
-
 def _now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
-def sb_headers_json_cached():
-    global _SB_JSON_HEADERS
-    if _SB_JSON_HEADERS is None:
-        key = _service_key()
-        _SB_JSON_HEADERS = {
-            "apikey": key,
-            "Authorization": f"Bearer {key}",
-            "Content-Type": "application/json",
-        }
-    return _SB_JSON_HEADERS
-
-def sb_headers_storage_cached(content_type: str = "application/octet-stream"):
-    # Cache per content_type
-    if content_type in _SB_STORAGE_HEADERS:
-        return _SB_STORAGE_HEADERS[content_type]
-    key = _service_key()
-    h = {
-        "apikey": key,
-        "Authorization": f"Bearer {key}",
-        "Content-Type": content_type,
-        "x-upsert": "true",
-    }
-    _SB_STORAGE_HEADERS[content_type] = h
-    return h
-
-def sb_headers_storage_delete_cached():
-    # Deletes don't need x-upsert or content-type
-    if "__delete__" in _SB_STORAGE_HEADERS:
-        return _SB_STORAGE_HEADERS["__delete__"]
-    key = _service_key()
-    h = {"apikey": key, "Authorization": f"Bearer {key}"}
-    _SB_STORAGE_HEADERS["__delete__"] = h
-    return h
-
-def rest_url(path: str) -> str:
-    return f"{_sb_url()}/rest/v1/{path.lstrip('/')}"
-
-def storage_object_url(bucket: str, object_path: str) -> str:
-    return f"{_sb_url()}/storage/v1/object/{bucket}/{object_path}"
-
-def rest_get(path: str, params=None):
-    def _do():
-        r = SESSION.get(
-            rest_url(path),
-            headers=sb_headers_json_cached(),
-            params=params,
-            timeout=(5, 25),
-        )
-        if not r.ok:
-            raise RuntimeError(f"Supabase REST GET failed: {r.status_code} {r.text}")
-        return r.json()
-    return timed(f"REST GET {path}", _do)
-
-def rest_post(path: str, payload, params=None, prefer_return="representation"):
-    def _do():
-        headers = dict(sb_headers_json_cached())
-        headers["Prefer"] = f"return={prefer_return}"
-        r = SESSION.post(
-            rest_url(path),
-            headers=headers,
-            params=params,
-            data=json.dumps(payload),
-            timeout=(5, 25),
-        )
-        if not r.ok:
-            raise RuntimeError(f"Supabase REST POST failed: {r.status_code} {r.text}")
-        return r.json() if prefer_return == "representation" else None
-    return timed(f"REST POST {path}", _do)
-
-def rest_patch(path: str, payload, params=None):
-    def _do():
-        headers = dict(sb_headers_json_cached())
-        headers["Prefer"] = "return=minimal"
-        r = SESSION.patch(
-            rest_url(path),
-            headers=headers,
-            params=params,
-            data=json.dumps(payload),
-            timeout=(5, 25),
+def _iso_to_ms(value: Optional[str]) -> int:
+    if not value:
+        return 0
+    dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return int(dt.timestamp() * 1000)
+
+def _make_backend() -> Backend:
+    kind = os.getenv("STORAGE_BACKEND", "supabase").strip().lower()
+    if kind == "local":
+        return LocalBackend(
+            os.getenv("LOCAL_DATA_DIR", "").strip()
+            or os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"),
+            timed=_upstream_timer("local"),
         )
-        if not r.ok:
-            raise RuntimeError(f"Supabase REST PATCH failed: {r.status_code} {r.text}")
-        return None
-    return timed(f"REST PATCH {path}", _do)
-
-def rest_delete(path: str, params=None):
-    def _do():
-        headers = dict(sb_headers_json_cached())
-        headers["Prefer"] = "return=minimal"
-        r = SESSION.delete(
-            rest_url(path),
-            headers=headers,
-            params=params,
-            timeout=(5, 25),
-        )
-        if not r.ok:
-            raise RuntimeError(f"Supabase REST DELETE failed: {r.status_code} {r.text}")
-        return None
-    return timed(f"REST DELETE {path}", _do)
-
-def storage_get_object(bucket: str, object_path: str, content_type="application/octet-stream"):
-    def _do():
-        r = SESSION.get(
-            storage_object_url(bucket, object_path),
-            headers=sb_headers_storage_cached(content_type),
-            timeout=(5, 25),
-        )
-        return r
-    return timed("STORAGE GET object", _do)
-
-def storage_put_object(bucket: str, object_path: str, data: bytes, content_type: str):
-    def _do():
-        r = SESSION.put(
-            storage_object_url(bucket, object_path),
-            headers=sb_headers_storage_cached(content_type),
-            data=data,
-            timeout=(5, 25),
-        )
-        return r
-    return timed("STORAGE PUT object", _do)
-
-def storage_delete_object(bucket: str, object_path: str):
-    def _do():
-        r = SESSION.delete(
-            storage_object_url(bucket, object_path),
-            headers=sb_headers_storage_delete_cached(),
-            timeout=(5, 25),
-        )
-        return r
-    r = timed("STORAGE DELETE object", _do)
-    # Treat missing objects as success (idempotent delete)
-    if r.status_code in (200, 204, 404):
-        return
-    raise RuntimeError(f"Supabase Storage DELETE failed: {r.status_code} {r.text}")
+    if kind != "supabase":
+        raise RuntimeError(f"STORAGE_BACKEND must be 'supabase' or 'local', not {kind!r}")
+    return SupabaseBackend(
+        os.getenv("SUPABASE_URL", ""),
+        os.getenv("SUPABASE_SERVICE_ROLE_KEY", ""),
+        os.getenv("SUPABASE_BUCKET", "ShieldBucket"),
+        session=SESSION,
+        timed=_upstream_timer("supabase"),
+        timeout=(_env_float("UPSTREAM_CONNECT_TIMEOUT_S", 3.0), _env_float("UPSTREAM_READ_TIMEOUT_S", 10.0)),
+        retry=RetryPolicy(
+            attempts=1 + max(0, _env_int("UPSTREAM_RETRIES", 2)),
+            deadline_s=_env_float("UPSTREAM_DEADLINE_S", 20.0),
+        ),
+        breaker=CircuitBreaker(
+            failures=_env_int("UPSTREAM_BREAKER_FAILURES", 5),
+            reset_s=_env_float("UPSTREAM_BREAKER_RESET_S", 15.0),
+        ),
+    )
+
+backend: Backend
+
+@_builds_state
+def _build_backend():
+    global backend
+    backend = _make_backend()
+
+_stale_served = _metrics.counter(
+    "shield_stale_responses_total", "Expired cache entries served because the backend failed", ("what",),
+)
 
+@bp.app_errorhandler(BackendError)
+def _backend_error(e: BackendError):
+    """Uncaught backend failures: 503 (+ Retry-After) while the breaker is open, else 502."""
+    if isinstance(e, CircuitOpen):
+        resp = jsonify({"error": "storage backend unavailable", "details": e.details})
+        resp.status_code = 503
+        resp.headers["Retry-After"] = str(max(1, int(e.retry_after_s + 0.999)))
+        return resp
+    return jsonify({"error": "storage backend error", "status": e.status, "details": e.details}), 502
 
 # ============================================================
 # -------- Auth + CSRF (DISABLED FOR NOW) --------
@@ -302,109 +634,336 @@ def storage_delete_object(bucket: str, object_path: str):
 #     return wrapper
 
 
-@app.get("/favicon.ico")
+@bp.get("/favicon.ico")
 def favicon():
     return ("", 204)
 
+# ============================================================
+# Static assets (see assets.py)
+#   Static/ is built into ASSET_DIR with content-hashed file names,
+#   recompressed stamps plus palette thumbnails, and .gz/.br copies of the
+#   JS and CSS. Built files are served with immutable cache headers; the
+#   templates get their URLs from the manifest (static_url, stamp_thumbs).
+#   The build runs in the background at startup, only when Static/ changed
+#   since the last one; until it's done pages point at Static/ as-is.
+#   ASSET_BUILD   0 skips the build and always serves Static/ (default 1)
+#   ASSET_DIR     where builds go (default ./.cache/assets)
+#   STAMP_ATLAS   1 also packs the palette thumbnails into one sprite sheet
+# ============================================================
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Static")
+_ASSET_DIR = (os.getenv("ASSET_DIR", "").strip()
+              or os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "assets"))
+_STAMP_ATLAS = os.getenv("STAMP_ATLAS", "").strip() == "1"
+_IMMUTABLE = "public, max-age=31536000, immutable"
+_asset_manifest: Optional[dict] = None  # swapped in whole once a build is ready
+
+def _build_assets():
+    global _asset_manifest
+    t0 = time.perf_counter()
+    try:
+        _asset_manifest = load_or_build(STATIC_DIR, _ASSET_DIR, _STAMP_ATLAS)
+    except (AssetError, OSError, UnicodeDecodeError) as e:
+        print("asset build failed, serving Static/ as-is:", e)
+        return
+    print(f"assets built in {time.perf_counter() - t0:.1f}s ({len(_asset_manifest['files'])} files)")
+
+@_builds_state
+def _start_asset_build():
+    global _asset_manifest
+    if os.getenv("ASSET_BUILD", "").strip() == "0":
+        return
+    # A current build is just a manifest read; anything else goes to the background
+    _asset_manifest = current_manifest(STATIC_DIR, _ASSET_DIR, _STAMP_ATLAS)
+    if _asset_manifest is None:
+        threading.Thread(target=_build_assets, name="asset-build", daemon=True).start()
+
+def _static_source(filename: str) -> str:
+    """filename as it is spelled under Static/ (URLs say /static/stamps/, the folder is Stamps/)."""
+    path = safe_join(STATIC_DIR, filename)
+    if path is None or os.path.isfile(path):
+        return filename
+    wanted = filename.lower()
+    return next((rel for rel in source_files(STATIC_DIR) if rel.lower() == wanted), filename)
+
+@bp.get("/static/<path:filename>")
+def static_file(filename):
+    """A built (hashed, immutable) file if there is one by that name, else Static/ itself."""
+    path = safe_join(_ASSET_DIR, filename)
+    if path is None or filename == ASSET_MANIFEST or not os.path.isfile(path):
+        return send_from_directory(STATIC_DIR, _static_source(filename))
+
+    # Hashed names are never rebuilt with other bytes, so any build (this one or the
+    # previous, which pages rendered before a rebuild still use) can be served forever
+    encoding = None
+    for enc in ("br", "gzip"):
+        if request.accept_encodings[enc] and os.path.isfile(encoded_path(path, enc)):
+            encoding = enc
+            break
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    resp = send_from_directory(_ASSET_DIR, encoded_path(filename, encoding) if encoding else filename,
+                               mimetype=mimetype)
+    if encoding:
+        resp.headers["Content-Encoding"] = encoding
+    if os.path.isfile(encoded_path(path, "gzip")) or os.path.isfile(encoded_path(path, "br")):
+        resp.vary.add("Accept-Encoding")
+    resp.headers["Cache-Control"] = _IMMUTABLE
+    return resp
+
+@bp.app_template_global()
+def static_url(rel: str) -> str:
+    """URL of Static/<rel>: the hashed copy once built."""
+    manifest = _asset_manifest
+    return "/static/" + ((manifest or {}).get("files", {}).get(rel) or rel)
+
+@bp.app_template_global()
+def stamp_thumbs() -> dict:
+    """Palette thumbnails (and the sprite sheet, with STAMP_ATLAS=1) keyed by stamp URL, for stampSystem.js."""
+    manifest = _asset_manifest
+    if not manifest:
+        return {}
+    files = manifest["files"]
+    out = {"thumbs": {"/static/" + files[rel]: "/static/" + thumb for rel, thumb in manifest["thumbs"].items()}}
+    atlas = manifest.get("atlas")
+    if atlas:
+        out["atlas"] = {
+            "url": "/static/" + atlas["file"],
+            "width": atlas["width"],
+            "height": atlas["height"],
+            "cells": {"/static/" + files[rel]: cell for rel, cell in atlas["cells"].items()},
+        }
+    return out
+
 # ============================================================
 # Pages
 # ============================================================
-@app.route("/")
+@bp.route("/")
 def home():
     return render_template("index.html")
 
-@app.route("/projector")
+@bp.route("/projector")
 def projector():
     return render_template("projector.html")
 
 # ============================================================
 # API: Designs
 # ============================================================
-@app.get("/api/designs")
+def list_designs_cached() -> List[dict]:
+    """Full design list as [{id,name,updated}], newest first (cached)."""
+    out = _design_list_cache.get(_DESIGN_LIST_KEY)
+    if out is None:
+        gen = _design_list_cache.generation()
+        try:
+            designs = backend.list_designs()
+        except BackendError:
+            out = _design_list_cache.get_stale(_DESIGN_LIST_KEY)
+            if out is None:
+                raise
+            _stale_served.inc("design_list")
+            return out
+        out = [
+            {"id": d.get("id"), "name": d.get("name"), "updated": _iso_to_ms(d.get("updated_at"))}
+            for d in designs
+        ]
+        out.sort(key=_list_sort_key, reverse=True)
+        _design_list_cache.put(_DESIGN_LIST_KEY, out, generation=gen)
+    return out
+
+# Serialized body + ETag of the last full list we sent. Holding the list
+# object itself keeps the identity check safe (ids can't be reused).
+_list_body_memo: Tuple[Optional[list], bytes, str] = (None, b"", "")
+_list_body_lock = threading.Lock()
+
+def _list_body(items: list, memoize: bool) -> Tuple[bytes, str]:
+    global _list_body_memo
+    if memoize:
+        with _list_body_lock:
+            if _list_body_memo[0] is items:
+                return _list_body_memo[1], _list_body_memo[2]
+    body = json.dumps(items, separators=(",", ":")).encode("utf-8")
+    etag = hashlib.sha1(body).hexdigest()
+    if memoize:
+        with _list_body_lock:
+            _list_body_memo = (items, body, etag)
+    return body, etag
+
+def _parse_list_cursor(raw: str) -> Tuple[int, str]:
+    ms, sep, design_id = raw.partition("_")
+    if not sep or not design_id:
+        raise ValueError("bad cursor")
+    return int(ms), design_id
+
+@bp.get("/api/designs")
 def api_list_designs():
-    designs = rest_get(
-        "designs",
-        params={"select": "id,name,updated_at", "order": "updated_at.desc"},
-    )
-    out = []
-    for d in designs:
-        updated = d.get("updated_at")
-        ms = 0
-        if updated:
-            dt = datetime.fromisoformat(updated.replace("Z", "+00:00"))
-            ms = int(dt.timestamp() * 1000)
-        out.append({"id": d.get("id"), "name": d.get("name"), "updated": ms})
-    return jsonify(out)
-
-@app.post("/api/designs")
+    """
+    List designs, newest first: [{id, name, updated}, ...]
+
+    Optional query params:
+      since=<ms>      only designs with updated > since
+      limit=<n>       page size (1..1000); X-Next-Cursor is set when more remain
+      cursor=<token>  value of X-Next-Cursor from the previous page
+
+    Pages are keyset on (updated, id) over the cached list, so they stay
+    stable while designs are edited. Responses carry ETag/Last-Modified;
+    If-None-Match / If-Modified-Since get a 304 when nothing changed.
+    """
+    try:
+        since = request.args.get("since", type=int)
+        limit = request.args.get("limit", type=int)
+        cursor = request.args.get("cursor", "").strip()
+        after = _parse_list_cursor(cursor) if cursor else None
+    except ValueError:
+        return jsonify({"error": "invalid since/limit/cursor"}), 400
+    if ("since" in request.args and since is None) or ("limit" in request.args and limit is None):
+        return jsonify({"error": "invalid since/limit/cursor"}), 400
+    if limit is not None and not 1 <= limit <= 1000:
+        return jsonify({"error": "limit must be between 1 and 1000"}), 400
+
+    items = list_designs_cached()
+    full = since is None and limit is None and after is None
+    next_cursor = None
+
+    if not full:
+        page = items
+        if since is not None:
+            page = [x for x in page if x["updated"] > since]
+        if after is not None:
+            page = [x for x in page if _list_sort_key(x) < after]
+        if limit is not None and len(page) > limit:
+            page = page[:limit]
+            next_cursor = f"{page[-1]['updated']}_{page[-1]['id']}"
+        items = page
+
+    body, etag = _list_body(items, memoize=full)
+    if full and _PREFETCH and _PREFETCH_RECENT:
+        prefetch_designs([x["id"] for x in items[:_PREFETCH_RECENT]])
+
+    resp = Response(body, mimetype="application/json")
+    resp.set_etag(etag)
+    newest = max((x["updated"] for x in items), default=0)
+    resp.last_modified = datetime.fromtimestamp(max(newest, _list_last_delete_ms) / 1000, tz=timezone.utc)
+    # Always revalidate; the browser then gets a cheap 304 when nothing changed
+    resp.headers["Cache-Control"] = "no-cache"
+    if next_cursor:
+        resp.headers["X-Next-Cursor"] = next_cursor
+    return resp.make_conditional(request)
+
+@bp.post("/api/designs")
 def api_create_design():
     body = request.get_json(force=True, silent=False) or {}
+    if not isinstance(body, dict):
+        return jsonify({"error": "expected a JSON object"}), 400
     name = (body.get("name") or "Untitled").strip()
 
-    rows = rest_post(
-        "designs",
-        payload={"name": name, "stamps_json": [], "updated_at": _now_iso()},
-        prefer_return="representation",
+    try:
+        d = backend.create_design(name, _now_iso())
+    except BackendError as e:
+        return jsonify({"error": "failed to create design", "details": e.details}), 500
+
+    entry = {"id": d.get("id"), "name": d.get("name"), "updated": _iso_to_ms(d["updated_at"])}
+    _list_upsert_entry(entry)
+    _design_meta_cache.put(
+        d.get("id"),
+        ({"id": d.get("id"), "name": d.get("name"), "updated_at": d["updated_at"], "stamps_json": []}, []),
     )
-    if not rows:
-        return jsonify({"error": "failed to create design"}), 500
+    return jsonify(entry)
 
-    d = rows[0]
-    dt = datetime.fromisoformat(d["updated_at"].replace("Z", "+00:00"))
-    return jsonify(
-        {"id": d.get("id"), "name": d.get("name"), "updated": int(dt.timestamp() * 1000)}
+def load_design_meta(design_id: str) -> Optional[Tuple[dict, list]]:
+    """(design_row, layer_rows) from the metadata cache or the backend; None if missing."""
+    cached = _design_meta_cache.get(design_id)
+    if cached is not None:
+        return cached
+
+    gen = _design_meta_cache.generation()
+    try:
+        d = backend.get_design(design_id)
+        if d is None:
+            return None
+        meta = (d, backend.get_layers(design_id))
+    except BackendError:
+        stale = _design_meta_cache.get_stale(design_id)
+        if stale is None:
+            raise
+        _stale_served.inc("design_meta")
+        return stale
+
+    _design_meta_cache.put(design_id, meta, generation=gen)
+    return meta
+
+def design_meta_view(design_id: str) -> Optional[Tuple[dict, list]]:
+    """load_design_meta() with saves still in the write-behind queue applied on top."""
+    meta = load_design_meta(design_id)
+    pending = _save_queue.pending(design_id) if _save_queue is not None else None
+    if meta is None or pending is None:
+        return meta
+    design, rows = meta
+    by_index = {r.get("layer_index"): r for r in rows}
+    by_index.update(pending.rows)
+    return (
+        dict(design, stamps_json=pending.stamps, updated_at=pending.updated_at),
+        [by_index[k] for k in sorted(by_index)],
     )
 
-@app.get("/api/designs/<design_id>")
+@bp.get("/api/designs/<design_id>")
 def api_load_design(design_id):
-    d = rest_get(
-        "designs",
-        params={"select": "id,name,updated_at,stamps_json", "id": f"eq.{design_id}"},
-    )
-    if not d:
+    meta = design_meta_view(design_id)
+    if meta is None:
         return jsonify({"error": "design not found"}), 404
-    design = d[0]
-
-    layers = rest_get(
-        "layers",
-        params={
-            "select": "layer_index,name,visible,png_path",
-            "design_id": f"eq.{design_id}",
-            "order": "layer_index.asc",
-        },
-    )
+    if _PREFETCH:
+        prefetch_layers(design_id, meta[1])
+    return jsonify(design_payload(design_id, *meta))
 
-    updated = design.get("updated_at")
-    ms = 0
-    if updated:
-        dt = datetime.fromisoformat(updated.replace("Z", "+00:00"))
-        ms = int(dt.timestamp() * 1000)
+def design_payload(design_id: str, design: dict, layers: list) -> dict:
+    """The JSON shape api_load_design returns (also the first bundle part)."""
+    ms = _iso_to_ms(design.get("updated_at"))
 
     out_layers = []
     for l in layers:
         png_path = l.get("png_path")
+        png_hash = l.get("png_hash")
         idx = l.get("layer_index")
+        manifest = _row_manifest(l)
+        if manifest is not None:
+            # Tiled: the layer URL serves the tiles stitched into one PNG
+            png_url = f"/api/designs/{design_id}/layers/{idx}.png?h={png_hash}"
+        elif not png_path:
+            png_url = None
+        elif png_hash:
+            # Content-addressed: immutable, never needs revalidation
+            png_url = f"/api/designs/{design_id}/layers/{idx}.png?h={png_hash}"
+        else:
+            # Same-origin proxy + version token for cache busting
+            png_url = f"/api/designs/{design_id}/layers/{idx}.png?v={ms}"
+        # Trimmed on ingest: png_url is padded back to the whole layer for
+        # clients that ignore offsets; trimmed_url is the stored PNG, which
+        # goes at offset_x/offset_y
+        trimmed_url = None
+        if png_url and manifest is None and (_row_canvas(l) is not None or _row_offset(l) != (0, 0)):
+            trimmed_url = png_url
+            if png_hash and _row_canvas(l) is not None:
+                png_url = f"{png_url}&full=1"
         out_layers.append(
             {
                 "layer_index": idx,
                 "name": l.get("name"),
                 "visible": l.get("visible"),
-                # Same-origin proxy + version token for cache busting
-                "png_url": (f"/api/designs/{design_id}/layers/{idx}.png?v={ms}" if png_path else None),
+                "png_hash": png_hash,
+                "png_url": png_url,
+                "trimmed_url": trimmed_url,
+                "offset_x": _row_offset(l)[0],
+                "offset_y": _row_offset(l)[1],
+                "tiles": _tiles_payload(design_id, manifest) if manifest is not None else None,
             }
         )
 
-    return jsonify(
-        {
-            "id": design.get("id"),
-            "name": design.get("name"),
-            "updated": ms,
-            "stamps": design.get("stamps_json") or [],
-            "layers": out_layers,
-        }
-    )
+    return {
+        "id": design.get("id"),
+        "name": design.get("name"),
+        "updated": ms,
+        "stamps": rehydrate_stamps(design.get("stamps_json") or []),
+        "layers": out_layers,
+    }
 
-@app.patch("/api/designs/<design_id>")
+@bp.patch("/api/designs/<design_id>")
 def api_rename_design(design_id):
     """Rename a design.
 
@@ -412,6 +971,8 @@ def api_rename_design(design_id):
     Returns: { id, name, updated }
     """
     body = request.get_json(force=True, silent=False) or {}
+    if not isinstance(body, dict):
+        return jsonify({"error": "expected a JSON object"}), 400
     name = (body.get("name") or "").strip()
     if not name:
         return jsonify({"error": "name is required"}), 400
@@ -419,25 +980,28 @@ def api_rename_design(design_id):
         return jsonify({"error": "name too long"}), 400
 
     now = _now_iso()
-    rest_patch(
-        "designs",
-        params={"id": f"eq.{design_id}"},
-        payload={"name": name, "updated_at": now},
-    )
+    try:
+        backend.update_design(design_id, {"name": name, "updated_at": now})
+    except Exception:
+        _design_meta_cache.pop(design_id)
+        _design_list_cache.pop(_DESIGN_LIST_KEY)
+        raise
 
-    dt = datetime.fromisoformat(now.replace("Z", "+00:00"))
-    return jsonify({"id": design_id, "name": name, "updated": int(dt.timestamp() * 1000)})
+    ms = _iso_to_ms(now)
+    _design_meta_cache.update(design_id, lambda m: (dict(m[0], name=name, updated_at=now), m[1]))
+    _list_touch_entry(design_id, ms, name=name)
+    return jsonify({"id": design_id, "name": name, "updated": ms})
 
 # ============================================================
 # LOGIN ROUTES (DISABLED FOR NOW)
 # ============================================================
-# @app.get("/login")
+# @bp.get("/login")
 # def login():
 #     if is_logged_in():
 #         return redirect(url_for("home"))
 #     return render_template("login.html", csrf_token=_get_csrf(), next=request.args.get("next", "/"))
 #
-# @app.post("/login")
+# @bp.post("/login")
 # def login_post():
 #     ok, wait_s = _rate_limit_login()
 #     if not ok:
@@ -480,43 +1044,510 @@ def api_rename_design(design_id):
 #         error="Invalid username or password."
 #     ), 401
 #
-# @app.post("/logout")
+# @bp.post("/logout")
 # def logout():
 #     if not _check_csrf(request.form.get("csrf_token", "")):
 #         return "CSRF failed", 400
 #     session.clear()
 #     return redirect(url_for("login"))
 
-@app.get("/api/designs/<design_id>/layers/<int:layer_index>.png")
-def api_layer_png(design_id, layer_index: int):
-    key: LayerKey = (design_id, int(layer_index))
+# ============================================================
+# Layer PNG upstream fetch (coalesced)
+#   A burst of requests for the same uncached layer (projector + several
+#   designer tabs) turns into exactly one backend GET; everyone else waits
+#   for that result. Failures are handed to every waiter and not cached.
+# ============================================================
+_layer_fetches = SingleFlight()
+
+class LayerFetchError(RuntimeError):
+    def __init__(self, status: int, details: str, retry_after_s: Optional[float] = None):
+        super().__init__(f"layer fetch failed: {status}")
+        self.status = status
+        self.details = details
+        self.retry_after_s = retry_after_s  # set when the circuit breaker refused the fetch
+
+# Background fetches (bundle endpoint) run here, not on request threads.
+# LAYER_FETCH_WORKERS in .env (default 8).
+_FETCH_POOL: ThreadPoolExecutor
+
+@_builds_state
+def _build_fetch_pool():
+    global _FETCH_POOL
+    _FETCH_POOL = ThreadPoolExecutor(
+        max_workers=max(1, _env_int("LAYER_FETCH_WORKERS", 8)),
+        thread_name_prefix="layer-fetch",
+    )
+
+# ============================================================
+# Content-addressed layer objects
+#   New saves store layers at layers/<design_id>/<sha1>.png and record the
+#   sha1 in layers.png_hash. The sha1 is also the ETag, so a URL carrying
+#   ?h=<sha1> names exactly one set of bytes and can be cached forever.
+#   Rows saved before this still point at layers/<design_id>/layer_<i>.png.
+# ============================================================
+_PNG_HASH_RE = re.compile(r"^[0-9a-f]{40}$")
+
+def layer_object_path(design_id: str, layer_index: int, png_hash: Optional[str] = None) -> str:
+    if png_hash:
+        return f"layers/{design_id}/{png_hash}.png"
+    return f"layers/{design_id}/layer_{int(layer_index)}.png"
+
+# ============================================================
+# Tiled layers (see tiles.py)
+#   A save can send a layer as a grid of tiles instead of one PNG: only the
+#   dirty tiles are uploaded, each to layers/<design_id>/tiles/<sha1>.png,
+#   and blank tiles are dropped. The row keeps the manifest in tiles_json
+#   and png_hash is the manifest's digest, so ?h= URLs still name exactly
+#   one picture; the layer PNG route stitches the tiles for clients that
+#   want the whole layer.
+# ============================================================
+def tile_object_path(design_id: str, digest: str) -> str:
+    return f"layers/{design_id}/tiles/{digest}.png"
+
+def tile_url(design_id: str, digest: str) -> str:
+    return f"/api/designs/{design_id}/tiles/{digest}.png"
+
+def _row_offset(row: dict) -> Tuple[int, int]:
+    """Where a layer row's PNG goes on the canvas (non-zero once it was trimmed on ingest)."""
+    return int(row.get("offset_x") or 0), int(row.get("offset_y") or 0)
+
+def _row_canvas(row: dict) -> Optional[Tuple[int, int]]:
+    """The whole layer's size if its PNG was trimmed on ingest (None: the PNG is the whole layer)."""
+    if row.get("canvas_width") and row.get("canvas_height"):
+        return int(row["canvas_width"]), int(row["canvas_height"])
+    return None
+
+def _row_manifest(row: dict) -> Optional[dict]:
+    return parse_manifest(row["tiles_json"]) if row.get("tiles_json") else None
+
+def _tiles_payload(design_id: str, manifest: dict) -> dict:
+    tiles = []
+    for key, digest in sorted(manifest["tiles"].items(), key=lambda kv: parse_key(kv[0])[::-1]):
+        col, row = parse_key(key)
+        tiles.append({"col": col, "row": row, "hash": digest, "url": tile_url(design_id, digest)})
+    return {"size": manifest["size"], "width": manifest["width"], "height": manifest["height"], "tiles": tiles}
+
+def _row_blob_paths(design_id: str, row: dict) -> set:
+    """Every storage object a layer row points at (its PNG, or its tiles)."""
+    manifest = _row_manifest(row)
+    if manifest is not None:
+        return {tile_object_path(design_id, d) for d in manifest["tiles"].values()}
+    return {row["png_path"]} if row.get("png_path") else set()
+
+def _stored_tiles(rows) -> set:
+    """Tile digests the given layer rows reference (already in storage for the design)."""
+    out = set()
+    for row in rows:
+        manifest = _row_manifest(row)
+        if manifest is not None:
+            out.update(manifest["tiles"].values())
+    return out
+
+def _tiled_layer(design_id: str, layer_index: int, png_hash: Optional[str]) -> Optional[dict]:
+    """The current manifest of a tiled layer (matching png_hash when given), else None."""
+    meta = design_meta_view(design_id)
+    for row in (meta[1] if meta else []):
+        if row.get("layer_index") == layer_index:
+            if png_hash and row.get("png_hash") != png_hash:
+                return None
+            return _row_manifest(row)
+    return None
+
+def _current_layer_path(design_id: str, layer_index: int) -> str:
+    """Storage path of a layer's current bytes, from the (cached) layer rows."""
+    meta = design_meta_view(design_id)
+    for row in (meta[1] if meta else []):
+        if row.get("layer_index") == layer_index and row.get("png_path"):
+            return row["png_path"]
+    return layer_object_path(design_id, layer_index)
+
+def _cached_layer_png(key: LayerKey, want_etag: Optional[str]) -> Optional[Tuple[bytes, str]]:
+    """RAM-cache lookup that ignores entries for a different content hash."""
     cached = _layer_png_cache.get(key)
+    if cached and want_etag and cached[1] != want_etag:
+        return None
+    return cached
+
+def _fresh_layer(key: LayerKey, gen: int):
+    """For LayerDiskCache puts: whether bytes fetched since gen may still be cached for key."""
+    return lambda: not _layer_png_cache.changed_since(key, gen)
+
+def fetch_layer_png(design_id: str, layer_index: int, png_hash: Optional[str] = None) -> Tuple[bytes, str]:
+    """
+    Return (png_bytes, etag) from cache or the backend, filling the caches on a miss.
+
+    With png_hash the result is guaranteed to be those exact bytes; without
+    it, whatever the layer row currently points at.
+    """
+    key: LayerKey = (design_id, int(layer_index))
+    want_etag = f'"{png_hash}"' if png_hash else None
+
+    def _fetch():
+        # Taken before anything is read, so an invalidation that lands while
+        # we fetch keeps these bytes out of both tiers (see _fresh_layer)
+        gen = _layer_png_cache.generation()
+        # Another flight may have filled the cache between our miss and now
+        cached = _cached_layer_png(key, want_etag)
+        if cached:
+            return cached
+
+        on_disk = _pending_layer_file(design_id, layer_index, png_hash)
+        if on_disk is None and _layer_disk_cache is not None:
+            on_disk = _layer_disk_cache.get(key)
+        if on_disk and (not want_etag or on_disk[1] == want_etag):
+            path, etag = on_disk[0], on_disk[1]
+            try:
+                with open(path, "rb") as fh:
+                    data = fh.read()
+                _layer_png_cache.put(key, data, etag, generation=gen)
+                return data, etag
+            except OSError:
+                pass  # evicted between get() and open(); fall through to upstream
+
+        manifest = _tiled_layer(design_id, int(layer_index), png_hash)
+        if manifest is not None:
+            data = stitch(manifest, lambda digest: fetch_tile_png(design_id, digest))
+            etag = f'"{manifest_digest(manifest)}"'
+            _layer_png_cache.put(key, data, etag, generation=gen)
+            if _layer_disk_cache is not None:
+                _layer_disk_cache.put(key, data, etag.strip('"'), current=_fresh_layer(key, gen))
+            return data, etag
+
+        if png_hash:
+            png_path = layer_object_path(design_id, layer_index, png_hash)
+        else:
+            png_path = _current_layer_path(design_id, int(layer_index))
+        try:
+            data = backend.get_blob(png_path)
+        except BackendError as e:
+            raise LayerFetchError(e.status, e.details, getattr(e, "retry_after_s", None)) from None
+
+        etag = _make_etag(data)
+        _layer_png_cache.put(key, data, etag, generation=gen)
+        if _layer_disk_cache is not None:
+            _layer_disk_cache.put(key, data, etag.strip('"'), current=_fresh_layer(key, gen))
+        return data, etag
 
+    # None means the flight was a streamed response that couldn't keep the
+    # bytes in RAM (too big, or nobody read it); by now they're on disk.
+    return _layer_fetches.do((design_id, int(layer_index), png_hash), _fetch) or _fetch()
+
+# ============================================================
+# Streamed layer PNG misses
+#   The first request for an uncached layer gets upstream chunks as they
+#   arrive instead of waiting for the whole download. The same chunks are
+#   teed into the RAM cache (up to LAYER_CACHE_MAX_ENTRY_MB) and the disk
+#   tier, and the sha1 is computed on the way through. That request is the
+#   single-flight leader, so concurrent requests for the layer wait for
+#   this download rather than starting their own.
+# ============================================================
+class _LayerTee:
+    """Collects a streamed layer for the caches while it goes to the client."""
+
+    def __init__(self, key: LayerKey, want_etag: Optional[str], gen: int):
+        self.key = key
+        self.want_etag = want_etag
+        self.gen = gen  # _layer_png_cache.generation() from before the upstream request
+        self.size = 0
+        self._sha1 = hashlib.sha1()
+        self._buf: Optional[bytearray] = bytearray()
+        self._disk = _layer_disk_cache.writer(key, _fresh_layer(key, gen)) if _layer_disk_cache is not None else None
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        self._sha1.update(chunk)
+        if self._buf is not None:
+            if self.size <= _layer_png_cache.max_entry_bytes:
+                self._buf.extend(chunk)
+            else:
+                self._buf = None  # too big for RAM; disk tier only
+        if self._disk is not None:
+            self._disk.write(chunk)
+
+    def finish(self) -> Optional[Tuple[bytes, str]]:
+        """Publish to the caches. Returns (data, etag) if it fit in RAM."""
+        etag = '"' + self._sha1.hexdigest() + '"'
+        if self.want_etag and etag != self.want_etag:
+            self.abort()
+            raise LayerFetchError(502, "layer bytes do not match their hash")
+        if self._disk is not None:
+            self._disk.commit(etag.strip('"'))
+        if self._buf is None:
+            return None
+        data = bytes(self._buf)
+        self._buf = None
+        _layer_png_cache.put(self.key, data, etag, generation=self.gen)
+        return data, etag
+
+    def abort(self):
+        self._buf = None
+        if self._disk is not None:
+            self._disk.abort()
+
+def stream_layer_png(design_id: str, layer_index: int, png_hash: Optional[str] = None) -> Optional[Response]:
+    """
+    Response that streams a layer from the backend while filling the caches.
+
+    Returns None when another request is already fetching this layer (join
+    it with fetch_layer_png), it landed in the RAM cache meanwhile, or it
+    is tiled (fetch_layer_png stitches those).
+    Raises LayerFetchError if the backend answers with an error.
+    """
+    key: LayerKey = (design_id, int(layer_index))
+    flight_key = (design_id, int(layer_index), png_hash)
+    want_etag = f'"{png_hash}"' if png_hash else None
+    gen = _layer_png_cache.generation()
+
+    if _tiled_layer(design_id, int(layer_index), png_hash) is not None:
+        return None
+
+    flight = _layer_fetches.claim(flight_key)
+    if flight is None:
+        return None
+    cached = _cached_layer_png(key, want_etag)
     if cached:
-        data, etag = cached
-        print("LAYER PNG cache HIT", design_id, layer_index)
+        _layer_fetches.settle(flight_key, flight, result=cached)
+        return None
+
+    try:
+        if png_hash:
+            png_path = layer_object_path(design_id, layer_index, png_hash)
+        else:
+            png_path = _current_layer_path(design_id, int(layer_index))
+        try:
+            blob = backend.open_blob(png_path)
+        except BackendError as e:
+            raise LayerFetchError(e.status, e.details, getattr(e, "retry_after_s", None)) from None
+    except BaseException as e:
+        _layer_fetches.settle(flight_key, flight, error=e)
+        raise
+
+    tee = _LayerTee(key, want_etag, gen)
+
+    def _generate():
+        chunks = iter(blob)
+        result, error = None, None
+        try:
+            try:
+                for chunk in chunks:
+                    tee.write(chunk)
+                    yield chunk
+            except GeneratorExit:
+                # Client went away mid-body; finish the download anyway so
+                # the waiters and the caches still get the layer.
+                for chunk in chunks:
+                    tee.write(chunk)
+            result = tee.finish()
+        except Exception as e:
+            tee.abort()
+            error = e if isinstance(e, LayerFetchError) else LayerFetchError(502, str(e))
+        finally:
+            blob.close()
+            _layer_fetches.settle(flight_key, flight, result=result, error=error)
+
+    def _on_close():
+        # HEAD requests never start the generator; don't leave waiters hanging
+        if not flight.done.is_set():
+            blob.close()
+            tee.abort()
+            _layer_fetches.settle(flight_key, flight)
+
+    resp = Response(_generate(), mimetype="image/png", direct_passthrough=True)
+    resp.call_on_close(_on_close)
+    if blob.length is not None:
+        resp.headers["Content-Length"] = str(blob.length)
+    if want_etag:
+        resp.headers["ETag"] = want_etag
+    resp.headers["Accept-Ranges"] = "bytes"
+    resp.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return resp
+
+def _pending_layer_file(design_id: str, layer_index: int, png_hash: Optional[str]) -> Optional[Tuple[str, str]]:
+    """(path, etag) of a layer that is saved but still waiting in the write-behind queue."""
+    if _save_queue is None:
+        return None
+    return _save_queue.pending_blob(design_id, int(layer_index), png_hash)
+
+def _send_layer_file(path: str, etag: str) -> Response:
+    # send_file hands the open file to the WSGI server (wsgi.file_wrapper /
+    # X-Sendfile), so the bytes never get copied through Python.
+    # conditional=True also answers Range / If-Range.
+    resp = send_file(path, mimetype="image/png", conditional=True, etag=etag.strip('"'))
+    resp.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return resp
+
+def _layer_not_modified(etag: str) -> Response:
+    resp = Response(status=304)
+    resp.headers["ETag"] = etag
+    resp.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return resp
+
+def _layer_fetch_failed(e: LayerFetchError) -> Response:
+    resp = jsonify({"error": "layer fetch failed", "status": e.status, "details": e.details})
+    resp.status_code = 404
+    if e.retry_after_s is not None:
+        resp.status_code = 503
+        resp.headers["Retry-After"] = str(max(1, int(e.retry_after_s + 0.999)))
+    return resp
+
+def _full_layer_response(design_id: str, row: dict, inm: Optional[str]) -> Response:
+    """
+    A trimmed layer padded back to its whole canvas (png_url's &full=1).
+    Rendered on demand and kept with the composites; offset and canvas are
+    part of the ETag, so it revalidates like a composite.
+    """
+    idx, png_hash = row["layer_index"], row["png_hash"]
+    offset, canvas = _row_offset(row), _row_canvas(row)
+    etag = '"' + hashlib.sha1(f"full|{png_hash}|{offset}|{canvas}".encode("utf-8")).hexdigest() + '"'
+    if inm == etag:
+        resp = Response(status=304)
     else:
-        print("LAYER PNG cache MISS", design_id, layer_index)
-        bucket = _bucket()
-        png_path = f"layers/{design_id}/layer_{layer_index}.png"
+        key = (design_id, f"layer:{idx}")
+
+        def _render():
+            cached = _composite_cache.get(key)
+            if cached and cached[1] == etag:
+                return cached
+            data = pad_png(fetch_layer_png(design_id, idx, png_hash)[0], offset, canvas)
+            _composite_cache.put(key, data, etag)
+            return data, etag
+
+        try:
+            data = _layer_fetches.do(("full", design_id, idx, etag), _render)[0]
+        except LayerFetchError as e:
+            return _layer_fetch_failed(e)
+        except TileError as e:
+            return jsonify({"error": "the layer PNG can't be padded", "details": str(e)}), 422
+        resp = Response(data, mimetype="image/png")
+    resp.headers["ETag"] = etag
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
 
-        r = storage_get_object(bucket, png_path, content_type="image/png")
-        if not r.ok:
-            return jsonify(
-                {"error": "layer fetch failed", "status": r.status_code, "details": r.text}
-            ), 404
+@bp.get("/api/designs/<design_id>/layers/<int:layer_index>.png")
+def api_layer_png(design_id, layer_index: int):
+    key: LayerKey = (design_id, int(layer_index))
+    inm = request.headers.get("If-None-Match")
 
-        data = r.content
-        etag = _make_etag(data)
-        _layer_png_cache[key] = (data, etag)
+    png_hash = (request.args.get("h") or "").strip().lower() or None
+    if png_hash and not _PNG_HASH_RE.match(png_hash):
+        return jsonify({"error": "invalid layer hash"}), 400
+    want_etag = f'"{png_hash}"' if png_hash else None
+
+    if png_hash and request.args.get("full") == "1":
+        # Only a row still pointing at this hash knows the canvas; otherwise
+        # serve the stored PNG as it is
+        meta = design_meta_view(design_id)
+        row = next((l for l in meta[1] if l.get("layer_index") == int(layer_index)), None) if meta else None
+        if row is not None and row.get("png_hash") == png_hash and _row_canvas(row) is not None:
+            return _full_layer_response(design_id, row, inm)
+
+    # Hash-addressed URL: the browser's copy is right by definition
+    if want_etag and inm == want_etag:
+        return _layer_not_modified(want_etag)
+
+    _prefetch_requested(("layer", design_id, int(layer_index)))
+    cached = _cached_layer_png(key, want_etag)
+    if cached:
+        data, etag = cached
+        _log("LAYER PNG cache HIT", design_id, layer_index)
+    else:
+        on_disk = _layer_disk_cache.get(key) if _layer_disk_cache is not None else None
+        if on_disk and want_etag and on_disk[1] != want_etag:
+            on_disk = None
+        if on_disk:
+            path, etag, _size = on_disk
+            _log("LAYER PNG disk HIT", design_id, layer_index)
+            if inm and inm == etag:
+                return _layer_not_modified(etag)
+            return _send_layer_file(path, etag)
+
+        pending = _pending_layer_file(design_id, layer_index, png_hash)
+        if pending:
+            path, etag = pending
+            try:
+                return _send_layer_file(path, etag)
+            except OSError:
+                pass  # flushed and removed just now; the backend has it
+
+        _log("LAYER PNG cache MISS", design_id, layer_index)
+        try:
+            # Range requests on a miss take the buffered path; the part is cut
+            # from the cached copy below.
+            if request.range is None:
+                streamed = stream_layer_png(design_id, layer_index, png_hash)
+                if streamed is not None:
+                    return streamed
+            data, etag = fetch_layer_png(design_id, layer_index, png_hash)
+        except LayerFetchError as e:
+            return _layer_fetch_failed(e)
 
     # Conditional GET (browser cache validation)
-    inm = request.headers.get("If-None-Match")
     if inm and inm == etag:
-        resp = Response(status=304)
-        resp.headers["ETag"] = etag
-        resp.headers["Cache-Control"] = "public, max-age=31536000, immutable"
-        return resp
+        return _layer_not_modified(etag)
+
+    resp = Response(data, mimetype="image/png")
+    resp.headers["ETag"] = etag
+    resp.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return resp.make_conditional(request, accept_ranges=True, complete_length=len(data))
+
+# ============================================================
+# Layer tiles
+#   Immutable (content-addressed), so they get the same treatment as ?h=
+#   layer URLs. TILE_CACHE_MAX_MB in .env (default 128).
+#   key: (design_id, sha1)
+# ============================================================
+_tile_cache: LayerPngCache
+
+@_builds_state
+def _build_tile_cache():
+    global _tile_cache
+    _tile_cache = LayerPngCache(
+        max_bytes=_worker_budget_mb("TILE_CACHE_MAX_MB", 128),
+        max_entries=16384,
+    )
+
+def fetch_tile_png(design_id: str, digest: str) -> bytes:
+    """A tile's bytes from the cache, the write-behind queue or the backend."""
+    key = (design_id, digest)
+    cached = _tile_cache.get(key)
+    if cached:
+        return cached[0]
+
+    def _fetch():
+        cached = _tile_cache.get(key)
+        if cached:
+            return cached
+        staged = _save_queue.staged_blob(digest) if _save_queue is not None else None
+        data = None
+        if staged:
+            try:
+                with open(staged, "rb") as fh:
+                    data = fh.read()
+            except OSError:
+                pass  # flushed and removed just now; the backend has it
+        if data is None:
+            try:
+                data = backend.get_blob(tile_object_path(design_id, digest))
+            except BackendError as e:
+                raise LayerFetchError(e.status, e.details, getattr(e, "retry_after_s", None)) from None
+        etag = f'"{digest}"'
+        _tile_cache.put(key, data, etag)
+        return data, etag
+
+    return _layer_fetches.do(("tile", design_id, digest), _fetch)[0]
+
+@bp.get("/api/designs/<design_id>/tiles/<digest>.png")
+def api_layer_tile(design_id, digest):
+    if not _PNG_HASH_RE.match(digest):
+        return jsonify({"error": "invalid tile hash"}), 400
+    etag = f'"{digest}"'
+    if request.headers.get("If-None-Match") == etag:
+        return _layer_not_modified(etag)
+    _prefetch_requested(("tile", design_id, digest))
+    try:
+        data = fetch_tile_png(design_id, digest)
+    except LayerFetchError as e:
+        return _layer_fetch_failed(e)
 
     resp = Response(data, mimetype="image/png")
     resp.headers["ETag"] = etag
@@ -524,139 +1555,1656 @@ def api_layer_png(design_id, layer_index: int):
     return resp
 
 # ============================================================
-# API: Delete Design (design row + layers rows + storage pngs + cache)
+# Layer prefetch
+#   Queues a design's layer PNGs (a tiled layer's tiles) for download into
+#   the caches, so the layer requests the browser sends next are usually
+#   hits, or join a download that is already under way (single-flight)
+#   instead of paying for their own round trip. Triggered by:
+#     GET /api/designs             the newest LAYER_PREFETCH_RECENT designs:
+#                                  the designer lists, then opens the last
+#                                  active (usually newest) design
+#     GET /api/designs/<id>        every layer
+#     GET /api/designs/<id>/bundle only the layers it leaves out (hidden
+#                                  ones without ?all=1); the bundle
+#                                  downloads the rest itself right away
+#   Thumbnails and composites aren't triggers: the list asks for one per
+#   design, and they fetch the layers they draw anyway.
+#   Layers already cached are skipped; past LAYER_PREFETCH_MAX_QUEUED
+#   waiting downloads new ones are dropped rather than queued.
+#   LAYER_PREFETCH               0 disables (default 1)
+#   LAYER_PREFETCH_VISIBLE_ONLY  1 leaves hidden layers alone
+#   LAYER_PREFETCH_WORKERS       downloads at once (default 4)
+#   LAYER_PREFETCH_MAX_QUEUED    default 256
+#   LAYER_PREFETCH_RECENT        designs warmed per list request (default 1, 0 = none)
+#   key: ("layer", design_id, layer_index) / ("tile", design_id, sha1)
 # ============================================================
-@app.route("/api/designs/<design_id>", methods=["DELETE"])
-def api_delete_design(design_id):
+_PREFETCH = os.getenv("LAYER_PREFETCH", "").strip() != "0"
+_PREFETCH_VISIBLE_ONLY = os.getenv("LAYER_PREFETCH_VISIBLE_ONLY", "").strip() == "1"
+_PREFETCH_MAX_QUEUED = max(1, _env_int("LAYER_PREFETCH_MAX_QUEUED", 256))
+_PREFETCH_RECENT = max(0, _env_int("LAYER_PREFETCH_RECENT", 1))
+_PREFETCH_TRACKED = 4096  # prefetched-but-unrequested keys remembered for the used counter
+_PREFETCH_POOL: ThreadPoolExecutor
+
+@_builds_state
+def _build_prefetch_pool():
+    global _PREFETCH_POOL
+    _PREFETCH_POOL = ThreadPoolExecutor(
+        max_workers=max(1, _env_int("LAYER_PREFETCH_WORKERS", 4)),
+        thread_name_prefix="layer-prefetch",
+    )
+
+# key -> "queued" (waiting or downloading) / "ready" (in RAM, not requested yet)
+_prefetch_state: "OrderedDict[tuple, str]" = OrderedDict()
+_prefetch_queued = 0
+_prefetch_lock = threading.Lock()
+
+_prefetch_total = _metrics.counter(
+    "shield_layer_prefetch_total",
+    "Layer/tile prefetches by outcome (fetched, cached, failed, duplicate, dropped)",
+    ("kind", "result"),
+)
+_prefetch_used = _metrics.counter(
+    "shield_layer_prefetch_used_total",
+    "Layer/tile requests for a prefetched key (ready = already in RAM, pending = still downloading)",
+    ("kind", "how"),
+)
+
+def _layer_cached(key: LayerKey) -> bool:
+    """In RAM, or on disk when that's the only tier (several workers): nothing to prefetch."""
+    if key in _layer_png_cache:
+        return True
+    return _layer_png_cache.max_bytes == 0 and _layer_disk_cache is not None and key in _layer_disk_cache
+
+def prefetch_layers(design_id: str, layers: list):
+    """Queue background downloads of a design's layer rows into the caches."""
+    for row in layers:
+        if _PREFETCH_VISIBLE_ONLY and not row.get("visible", True):
+            continue
+        manifest = _row_manifest(row)
+        if manifest is not None:
+            for digest in set(manifest["tiles"].values()):
+                if (design_id, digest) not in _tile_cache:
+                    _queue_prefetch(("tile", design_id, digest), fetch_tile_png, design_id, digest)
+        elif row.get("png_path"):
+            idx = int(row["layer_index"])
+            if not _layer_cached((design_id, idx)):
+                _queue_prefetch(("layer", design_id, idx), fetch_layer_png, design_id, idx, row.get("png_hash"))
+
+def prefetch_designs(design_ids: list):
+    """prefetch_layers() for designs whose rows may not be loaded yet (loads them in the background)."""
+    for design_id in design_ids:
+        _PREFETCH_POOL.submit(_prefetch_design, design_id)
+
+def _prefetch_design(design_id: str):
     try:
-        layer_rows = rest_get(
-            "layers",
-            params={"select": "layer_index,png_path", "design_id": f"eq.{design_id}"},
-        )
+        meta = design_meta_view(design_id)
     except Exception as e:
-        return jsonify({"error": "failed reading layers", "details": str(e)}), 500
+        _log("design prefetch failed:", design_id, e)
+        return
+    if meta is not None:
+        prefetch_layers(design_id, meta[1])
+
+def _queue_prefetch(key: tuple, fetch, *args):
+    global _prefetch_queued
+    with _prefetch_lock:
+        if _prefetch_state.get(key) == "queued":
+            _prefetch_total.inc(key[0], "duplicate")
+            return
+        if _prefetch_queued >= _PREFETCH_MAX_QUEUED:
+            _prefetch_total.inc(key[0], "dropped")
+            return
+        _prefetch_state[key] = "queued"
+        _prefetch_state.move_to_end(key)
+        _prefetch_queued += 1
+    _PREFETCH_POOL.submit(_run_prefetch, key, fetch, args)
+
+def _run_prefetch(key: tuple, fetch, args):
+    global _prefetch_queued
+    result = "fetched"
+    try:
+        if key[0] == "layer" and _layer_cached((key[1], key[2])):
+            result = "cached"  # a request (or another prefetch) beat us to it
+        elif key[0] == "tile" and (key[1], key[2]) in _tile_cache:
+            result = "cached"
+        else:
+            fetch(*args)
+    except Exception as e:
+        result = "failed"
+        _log("layer prefetch failed:", key, e)
+    _prefetch_total.inc(key[0], result)
+    with _prefetch_lock:
+        _prefetch_queued -= 1
+        if _prefetch_state.get(key) != "queued":
+            return  # already requested while it was downloading
+        if result == "fetched":
+            _prefetch_state[key] = "ready"
+        else:
+            del _prefetch_state[key]
+        while len(_prefetch_state) > _PREFETCH_TRACKED:
+            oldest = next(iter(_prefetch_state))
+            if _prefetch_state[oldest] == "queued":
+                break
+            del _prefetch_state[oldest]
+
+def prefetch_stats() -> dict:
+    with _prefetch_lock:
+        queued = _prefetch_queued
+        unused = sum(1 for state in _prefetch_state.values() if state == "ready")
+    kinds = ("layer", "tile")
+    return {
+        "enabled": _PREFETCH,
+        "queued": queued,
+        "fetched": int(sum(_prefetch_total.value(k, "fetched") for k in kinds)),
+        "used": int(sum(_prefetch_used.value(k, how) for k in kinds for how in ("ready", "pending"))),
+        "unused": unused,
+    }
 
-    bucket = _bucket()
+def _prefetch_requested(key: tuple):
+    """Count a client request for a key a prefetch fetched (or is fetching)."""
+    with _prefetch_lock:
+        state = _prefetch_state.pop(key, None)
+    if state is not None:
+        _prefetch_used.inc(key[0], "ready" if state == "ready" else "pending")
 
-    # Delete storage objects first
-    for row in (layer_rows or []):
-        png_path = row.get("png_path")
-        if png_path:
+# ============================================================
+# Flattened previews (composite.py)
+#   GET /api/designs/<id>/composite.png?size=<px>  visible layers flattened,
+#       longest side at most size (default: full size)
+#   GET /api/designs/<id>/thumbnail.png            the same at THUMBNAIL_PX
+#   Layer pixels only: the background, shield clip and stamps are drawn
+#   client-side. The ETag is derived from the layer hashes, so a render is
+#   reused until a layer changes. COMPOSITE_CACHE_MAX_MB in .env (default 64).
+#   key: (design_id, "composite:<size>")
+# ============================================================
+THUMBNAIL_PX = 128
+_COMPOSITE_VERSION = "1"  # bump when composite.py's output changes
+
+_composite_cache: LayerPngCache
+
+@_builds_state
+def _build_composite_cache():
+    global _composite_cache
+    _composite_cache = LayerPngCache(
+        max_bytes=_worker_budget_mb("COMPOSITE_CACHE_MAX_MB", 64),
+        max_entries=4096,
+    )
+_composite_seconds = _metrics.histogram(
+    "shield_composite_render_seconds", "Time to render one flattened preview (cache misses only)",
+)
+
+def _composite_rows(layers: list) -> list:
+    """Layer rows that show in a composite (visible, with pixels stored), bottom to top."""
+    return sorted(
+        (l for l in layers if l.get("visible", True) and (l.get("png_path") or _row_manifest(l))),
+        key=lambda l: l["layer_index"],
+    )
+
+def composite_etag(design: dict, rows: list, size: Optional[int]) -> str:
+    # Legacy layers without png_hash only change along with updated_at
+    ms = _iso_to_ms(design.get("updated_at"))
+    parts = [_COMPOSITE_VERSION, str(size or 0)]
+    for l in rows:
+        parts.append(f'{l["layer_index"]}:{l.get("png_hash") or ms}:{_row_offset(l)}:{_row_canvas(l)}')
+    return '"' + hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest() + '"'
+
+def render_composite(design_id: str, rows: list, etag: str, size: Optional[int]) -> bytes:
+    """The flattened PNG for composite_etag(...) == etag, from the cache or rendered now."""
+    key = (design_id, f"composite:{size or 0}")
+    cached = _composite_cache.get(key)
+    if cached and cached[1] == etag:
+        return cached[0]
+
+    def _render():
+        cached = _composite_cache.get(key)
+        if cached and cached[1] == etag:
+            return cached
+        plain = {
+            l["layer_index"]: fetch_layer_png(design_id, l["layer_index"], l.get("png_hash"))[0]
+            for l in rows if _row_manifest(l) is None
+        }
+        # The canvas is the biggest layer: a tiled layer's manifest and a
+        # trimmed layer's row keep the size it was drawn at
+        width = height = 0
+        for l in rows:
+            manifest = _row_manifest(l)
+            if manifest is not None:
+                w, h = manifest["width"], manifest["height"]
+            elif _row_canvas(l) is not None:
+                w, h = _row_canvas(l)
+            else:
+                # The PNG is the whole layer (or was trimmed before rows kept
+                # its size: then as far as it reaches)
+                ox, oy = _row_offset(l)
+                w, h, _bpp = png_header(plain[l["layer_index"]])
+                w, h = w + ox, h + oy
+            width, height = max(width, w), max(height, h)
+
+        def _layers():
+            for l in rows:
+                manifest = _row_manifest(l)
+                if manifest is None:
+                    yield [(*_row_offset(l), plain[l["layer_index"]])]
+                    continue
+                pieces = []
+                for cell, digest in sorted(manifest["tiles"].items()):
+                    col, row = parse_key(cell)
+                    pieces.append((col * manifest["size"], row * manifest["size"], fetch_tile_png(design_id, digest)))
+                yield pieces
+
+        t0 = time.perf_counter()
+        data = composite(width, height, _layers(), size)
+        _composite_seconds.observe(time.perf_counter() - t0)
+        _composite_cache.put(key, data, etag)
+        return data, etag
+
+    return _layer_fetches.do(("composite", design_id, size or 0, etag), _render)[0]
+
+def _composite_response(design_id: str, size: Optional[int]):
+    meta = design_meta_view(design_id)
+    if meta is None:
+        return jsonify({"error": "design not found"}), 404
+    rows = _composite_rows(meta[1])
+    if not rows:
+        return jsonify({"error": "design has no visible layers"}), 404
+
+    etag = composite_etag(meta[0], rows, size)
+    if request.headers.get("If-None-Match") == etag:
+        resp = Response(status=304)
+    else:
+        try:
+            data = render_composite(design_id, rows, etag, size)
+        except LayerFetchError as e:
+            return _layer_fetch_failed(e)
+        except TileError as e:
+            return jsonify({"error": "a layer PNG can't be composited", "details": str(e)}), 422
+        resp = Response(data, mimetype="image/png")
+    resp.headers["ETag"] = etag
+    resp.headers["Cache-Control"] = "no-cache"  # revalidate: the design can change under this URL
+    return resp
+
+@bp.get("/api/designs/<design_id>/composite.png")
+def api_design_composite(design_id):
+    raw = (request.args.get("size") or "").strip()
+    if raw and not (raw.isdigit() and 0 < int(raw) <= MAX_LAYER_PX):
+        return jsonify({"error": f"size must be 1..{MAX_LAYER_PX}"}), 400
+    return _composite_response(design_id, int(raw) if raw else None)
+
+@bp.get("/api/designs/<design_id>/thumbnail.png")
+def api_design_thumbnail(design_id):
+    return _composite_response(design_id, THUMBNAIL_PX)
+
+# ============================================================
+# Projector renders (warp.py)
+#   GET  /api/designs/<id>/projector.png?<calibration>  the design's composite
+#        (see above), pre-warped and keystoned
+#   POST /api/projector.png?<calibration>               body: the PNG to warp
+#        (e.g. the browser's export, which has the background and stamps)
+#   calibration:
+#     quad=x,y,x,y,x,y,x,y   TL, TR, BR, BL corners in output pixels
+#     w, h                   output size
+#     width_in, curve_in     shield width and curve depth in inches; the
+#                            cylindrical pre-warp is off without curve_in
+#     bg                     rrggbb[aa] behind the design, or "none" (default 000000)
+#   Needs NumPy (501 without). Cached by a hash of the source and the
+#   calibration. PROJECTOR_CACHE_MAX_MB in .env (default 64).
+#   key: (design_id or "upload", sha1)
+# ============================================================
+_PROJECTOR_VERSION = "1"  # bump when warp.py's output changes
+_HEX_COLOR_RE = re.compile(r"^[0-9a-fA-F]{6}([0-9a-fA-F]{2})?$")
+
+_projector_cache: LayerPngCache
+
+@_builds_state
+def _build_projector_cache():
+    global _projector_cache
+    _projector_cache = LayerPngCache(
+        max_bytes=_worker_budget_mb("PROJECTOR_CACHE_MAX_MB", 64),
+        max_entries=256,
+    )
+_projector_seconds = _metrics.histogram(
+    "shield_projector_render_seconds", "Time to render one projector PNG (cache misses only)",
+)
+
+def _projector_params() -> dict:
+    """The calibration from the query string, normalized (raises WarpError)."""
+    args = request.args
+    try:
+        quad = [float(v) for v in (args.get("quad") or "").split(",")]
+        out_w, out_h = int(args["w"]), int(args["h"])
+        width_in = float(args.get("width_in") or 31)
+        curve_in = float(args.get("curve_in") or 0)
+    except (KeyError, ValueError):
+        raise WarpError("need quad=x,y,x,y,x,y,x,y and integer w, h") from None
+    if len(quad) != 8 or not all(math.isfinite(v) for v in quad + [width_in, curve_in]):
+        raise WarpError("quad needs 8 finite numbers")
+    if not (0 < out_w <= WARP_MAX_PX and 0 < out_h <= WARP_MAX_PX):
+        raise WarpError(f"w and h must be 1..{WARP_MAX_PX}")
+
+    bg = (args.get("bg") or "000000").strip()
+    if bg == "none":
+        background = [0, 0, 0, 0]
+    elif _HEX_COLOR_RE.match(bg):
+        background = list(bytes.fromhex(bg.ljust(8, "f")))
+    else:
+        raise WarpError("bg must be rrggbb, rrggbbaa or none")
+    return {"quad": quad, "w": out_w, "h": out_h, "width_in": width_in, "curve_in": curve_in, "bg": background}
+
+def _projector_response(scope: str, source_tag: str, get_source):
+    """Render (or reuse) the projector PNG of get_source()'s image; source_tag names that image."""
+    if not warp_available():
+        return jsonify({"error": "projector renders need NumPy on the server"}), 501
+    try:
+        params = _projector_params()
+    except WarpError as e:
+        return jsonify({"error": str(e)}), 400
+
+    digest = hashlib.sha1(
+        json.dumps([_PROJECTOR_VERSION, source_tag, params], sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    etag = f'"{digest}"'
+    key = (scope, digest)
+
+    def _render():
+        cached = _projector_cache.get(key)
+        if cached:
+            return cached
+        width, height, rows = decode_rgba(get_source())
+        quad = list(zip(params["quad"][0::2], params["quad"][1::2]))
+        t0 = time.perf_counter()
+        data = render_warp(width, height, rows, quad, params["w"], params["h"],
+                           params["width_in"], params["curve_in"], tuple(params["bg"]))
+        _projector_seconds.observe(time.perf_counter() - t0)
+        _projector_cache.put(key, data, etag)
+        return data, etag
+
+    if request.headers.get("If-None-Match") == etag:
+        resp = Response(status=304)
+    else:
+        try:
+            cached = _projector_cache.get(key)
+            data = cached[0] if cached else _layer_fetches.do(("projector",) + key, _render)[0]
+        except LayerFetchError as e:
+            return _layer_fetch_failed(e)
+        except TileError as e:
+            return jsonify({"error": "source image can't be decoded", "details": str(e)}), 422
+        except WarpError as e:
+            return jsonify({"error": str(e)}), 400
+        resp = Response(data, mimetype="image/png")
+    resp.headers["ETag"] = etag
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+@bp.get("/api/designs/<design_id>/projector.png")
+def api_design_projector(design_id):
+    meta = design_meta_view(design_id)
+    if meta is None:
+        return jsonify({"error": "design not found"}), 404
+    rows = _composite_rows(meta[1])
+    if not rows:
+        return jsonify({"error": "design has no visible layers"}), 404
+    source = composite_etag(meta[0], rows, None)
+    return _projector_response(design_id, source, lambda: render_composite(design_id, rows, source, None))
+
+@bp.post("/api/projector.png")
+def api_projector_upload():
+    if request.content_length is not None and request.content_length > _SAVE_MAX_PART_BYTES:
+        return jsonify({"error": "image too large", "max_bytes": _SAVE_MAX_PART_BYTES}), 413
+    body = request.stream.read(_SAVE_MAX_PART_BYTES + 1)
+    if len(body) > _SAVE_MAX_PART_BYTES:
+        return jsonify({"error": "image too large", "max_bytes": _SAVE_MAX_PART_BYTES}), 413
+    if not body.startswith(PNG_SIGNATURE):
+        return jsonify({"error": "body must be a PNG"}), 400
+    return _projector_response("upload", hashlib.sha1(body).hexdigest(), lambda: body)
+
+# ============================================================
+# API: Design bundle (metadata + layer PNGs in one response)
+# ============================================================
+def _bundle_part(boundary: str, name: str, content_type: str, body: bytes,
+                 filename: Optional[str] = None, extra: Optional[dict] = None) -> bytes:
+    disp = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename else "")
+    head = [f"--{boundary}", f"Content-Disposition: {disp}", f"Content-Type: {content_type}"]
+    for k, v in (extra or {}).items():
+        head.append(f"{k}: {v}")
+    return ("\r\n".join(head) + "\r\n\r\n").encode("utf-8") + body + b"\r\n"
+
+@bp.get("/api/designs/<design_id>/bundle")
+def api_design_bundle(design_id):
+    """
+    Design JSON + layer PNGs in one streamed response.
+
+    Framing is plain multipart/form-data (RFC 7578), so browsers can read it
+    with `await res.formData()`:
+      part "design"              application/json, same body as GET /api/designs/<id>
+      part "layer_<index>"       image/png (filename layer_<index>.png, ETag header),
+                                 in completion order, not index order
+      part "tile_<index>_<col>_<row>"
+                                 image/png, one per tile of a tiled layer
+                                 (instead of a layer_<index> part)
+      part "errors" (optional)   application/json [{layer_index, tile?, status, details}]
+
+    Only visible layers are included unless ?all=1. Cached layers are sent
+    first; missing ones are fetched from storage concurrently.
+    """
+    meta = design_meta_view(design_id)
+    if meta is None:
+        return jsonify({"error": "design not found"}), 404
+
+    payload = design_payload(design_id, *meta)
+    include_hidden = request.args.get("all") == "1"
+    shown = [l for l in payload["layers"] if l["png_url"] and (include_hidden or l["visible"])]
+    wanted = [(l["layer_index"], l["png_hash"]) for l in shown if l["tiles"] is None]
+    wanted_tiles = [
+        (l["layer_index"], tile_key(t["col"], t["row"]), t["hash"])
+        for l in shown if l["tiles"] is not None for t in l["tiles"]["tiles"]
+    ]
+    boundary = "bundle-" + secrets.token_hex(12)
+    for idx, _png_hash in wanted:
+        _prefetch_requested(("layer", design_id, idx))
+    for _idx, _key, digest in wanted_tiles:
+        _prefetch_requested(("tile", design_id, digest))
+    if _PREFETCH and not include_hidden:
+        sent = {l["layer_index"] for l in shown}
+        prefetch_layers(design_id, [r for r in meta[1] if r.get("layer_index") not in sent])
+
+    def _generate():
+        yield _bundle_part(boundary, "design", "application/json",
+                           json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+
+        def _layer_part(idx: int, data: bytes, etag: str) -> bytes:
+            return _bundle_part(boundary, f"layer_{idx}", "image/png", data,
+                                filename=f"layer_{idx}.png", extra={"ETag": etag})
+
+        def _tile_part(idx: int, key: str, data: bytes, digest: str) -> bytes:
+            name = f"tile_{idx}_{key.replace(',', '_')}"
+            return _bundle_part(boundary, name, "image/png", data,
+                                filename=f"{name}.png", extra={"ETag": f'"{digest}"'})
+
+        missing = []
+        for idx, png_hash in wanted:
+            cached = _cached_layer_png((design_id, idx), f'"{png_hash}"' if png_hash else None)
+            if cached:
+                yield _layer_part(idx, *cached)
+            else:
+                missing.append((idx, png_hash))
+        missing_tiles = []
+        for idx, key, digest in wanted_tiles:
+            cached = _tile_cache.get((design_id, digest))
+            if cached:
+                yield _tile_part(idx, key, cached[0], digest)
+            else:
+                missing_tiles.append((idx, key, digest))
+
+        errors = []
+        futures = {
+            _FETCH_POOL.submit(fetch_layer_png, design_id, idx, png_hash): (idx, None, None)
+            for idx, png_hash in missing
+        }
+        futures.update({
+            _FETCH_POOL.submit(fetch_tile_png, design_id, digest): (idx, key, digest)
+            for idx, key, digest in missing_tiles
+        })
+        for fut in as_completed(futures):
+            idx, key, digest = futures[fut]
+            err = {"layer_index": idx, "tile": key} if key else {"layer_index": idx}
             try:
-                storage_delete_object(bucket, png_path)
+                result = fut.result()
+            except LayerFetchError as e:
+                errors.append(dict(err, status=e.status, details=e.details))
+                continue
             except Exception as e:
-                return jsonify(
-                    {
-                        "error": "failed deleting storage object",
-                        "png_path": png_path,
-                        "details": str(e),
-                    }
-                ), 500
-
-        idx = row.get("layer_index")
-        if idx is not None:
-            _layer_png_cache.pop((design_id, int(idx)), None)
+                errors.append(dict(err, status=None, details=str(e)))
+                continue
+            yield _tile_part(idx, key, result, digest) if key else _layer_part(idx, *result)
 
-    # Delete DB rows
+        if errors:
+            yield _bundle_part(boundary, "errors", "application/json", json.dumps(errors).encode("utf-8"))
+        yield f"--{boundary}--\r\n".encode("ascii")
+
+    resp = Response(_generate(), content_type=f"multipart/form-data; boundary={boundary}")
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
+
+# ============================================================
+# Stamp assets (custom stamp images pulled out of stamps_json)
+#   Imported stamps used to ride along as full data: URLs inside every
+#   stamps_json write. Saves now store each image once at
+#   assets/<sha1>.<ext> and keep only {"customAsset": "<sha1>.<ext>"} in the
+#   stamp object; loads put a same-origin customSrc URL back.
+# ============================================================
+_ASSET_MIME_EXT = {
+    "image/png": "png",
+    "image/jpeg": "jpg",
+    "image/webp": "webp",
+    "image/gif": "gif",
+    "image/svg+xml": "svg",
+}
+_ASSET_EXT_MIME = {v: k for k, v in _ASSET_MIME_EXT.items()}
+_ASSET_NAME_RE = re.compile(r"^[0-9a-f]{40}\.(png|jpg|webp|gif|svg)$")
+_DATA_URL_RE = re.compile(r"^data:([\w.+/-]+);base64,", re.IGNORECASE)
+_ASSET_MAX_BYTES = _env_int("STAMP_ASSET_MAX_MB", 10) * 1024 * 1024
+
+# Same budget/eviction as layer PNGs. key: (asset_name, 0)
+_asset_cache: LayerPngCache
+
+@_builds_state
+def _build_asset_cache():
+    global _asset_cache
+    _asset_cache = LayerPngCache(
+        max_bytes=_worker_budget_mb("STAMP_ASSET_CACHE_MAX_MB", 64),
+        max_entries=1024,
+    )
+
+# Asset names we know are already in storage (skip re-uploading them)
+_known_assets = TTLCache(ttl_s=24 * 3600, max_entries=4096)
+
+def asset_url(name: str) -> str:
+    return f"/api/assets/{name}"
+
+def _decode_data_url(src: str) -> Optional[Tuple[bytes, str]]:
+    m = _DATA_URL_RE.match(src)
+    if not m or m.group(1).lower() not in _ASSET_MIME_EXT:
+        return None
     try:
-        rest_delete("layers", params={"design_id": f"eq.{design_id}"})
-        rest_delete("designs", params={"id": f"eq.{design_id}"})
-    except Exception as e:
-        return jsonify({"error": "failed deleting db rows", "details": str(e)}), 500
+        data = base64.b64decode(src[m.end():], validate=False)
+    except (ValueError, TypeError):
+        return None
+    if not data or len(data) > _ASSET_MAX_BYTES:
+        return None
+    return data, m.group(1).lower()
+
+def extract_stamp_assets(stamps: list) -> Tuple[list, Dict[str, str]]:
+    """
+    Replace embedded data: URLs with asset references, uploading new assets.
+
+    Returns (stamps_for_db, {stamp uid: asset url}) where the map lists the
+    stamps whose customSrc the client can swap for the short URL.
+    Raises BackendError if an upload fails.
+    """
+    out = []
+    new_srcs: Dict[str, str] = {}
+    to_upload: Dict[str, Tuple[bytes, str]] = {}
+
+    for obj in stamps:
+        if not isinstance(obj, dict) or not isinstance(obj.get("customSrc"), str):
+            out.append(obj)
+            continue
+        src = obj["customSrc"]
+        if src.startswith("data:"):
+            decoded = _decode_data_url(src)
+            if decoded is None:
+                out.append(obj)  # unsupported/oversize: leave it embedded
+                continue
+            data, mime = decoded
+            name = f"{hashlib.sha1(data).hexdigest()}.{_ASSET_MIME_EXT[mime]}"
+            if _known_assets.get(name) is None:
+                to_upload[name] = (data, mime)
+        elif _ASSET_NAME_RE.match(str(obj.get("customAsset") or "")):
+            name = obj["customAsset"]  # already a reference (rehydrated URL)
+        else:
+            out.append(obj)
+            continue
+
+        ref = {k: v for k, v in obj.items() if k != "customSrc"}
+        ref["customAsset"] = name
+        out.append(ref)
+        if src.startswith("data:") and obj.get("uid"):
+            new_srcs[str(obj["uid"])] = asset_url(name)
+
+    for name, (data, mime) in to_upload.items():
+        backend.put_blob(f"assets/{name}", data, content_type=mime)
+        _known_assets.put(name, True)
+        _asset_cache.put((name, 0), data, f'"{name.split(".")[0]}"')
+
+    return out, new_srcs
+
+def rehydrate_stamps(stamps: list) -> list:
+    """Give referenced stamps a loadable customSrc again (inverse of extract)."""
+    out = []
+    for obj in stamps:
+        if isinstance(obj, dict) and obj.get("customAsset") and not obj.get("customSrc"):
+            obj = dict(obj, customSrc=asset_url(obj["customAsset"]))
+        out.append(obj)
+    return out
+
+@bp.get("/api/assets/<name>")
+def api_stamp_asset(name):
+    if not _ASSET_NAME_RE.match(name):
+        return jsonify({"error": "asset not found"}), 404
+    etag = f'"{name.split(".")[0]}"'
+    if request.headers.get("If-None-Match") == etag:
+        return _layer_not_modified(etag)
+
+    cached = _asset_cache.get((name, 0))
+    if cached:
+        data = cached[0]
+    else:
+        try:
+            data = backend.get_blob(f"assets/{name}")
+        except BackendError as e:
+            return jsonify({"error": "asset fetch failed", "status": e.status}), 404
+        _asset_cache.put((name, 0), data, etag)
+        _known_assets.put(name, True)
+
+    resp = Response(data, mimetype=_ASSET_EXT_MIME[name.rsplit(".", 1)[1]])
+    resp.headers["ETag"] = etag
+    resp.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    # User-supplied SVGs are served same-origin; never let them run script
+    resp.headers["Content-Security-Policy"] = "default-src 'none'; style-src 'unsafe-inline'"
+    resp.headers["X-Content-Type-Options"] = "nosniff"
+    return resp
 
-    # Extra cache purge safety
-    for k in list(_layer_png_cache.keys()):
-        if k[0] == design_id:
-            _layer_png_cache.pop(k, None)
+# ============================================================
+# API: Cache stats
+# ============================================================
+@bp.get("/api/cache/stats")
+def api_cache_stats():
+    return jsonify(
+        {
+            "layer_png": _layer_png_cache.stats(),
+            "layer_png_disk": _layer_disk_cache.stats() if _layer_disk_cache is not None else None,
+            "layer_png_fetches": _layer_fetches.stats(),
+            "layer_prefetch": prefetch_stats(),
+            "design_list": _design_list_cache.stats(),
+            "design_meta": _design_meta_cache.stats(),
+            "stamp_assets": _asset_cache.stats(),
+            "layer_tiles": _tile_cache.stats(),
+            "composites": _composite_cache.stats(),
+            "projector_renders": _projector_cache.stats(),
+            "backend": dict(backend.describe(), **backend.health()),
+            "worker": {"pid": os.getpid(), "workers": SERVER_WORKERS},
+        }
+    )
+
+# ============================================================
+# API: Prometheus metrics
+# ============================================================
+# stats() key -> (metric suffix, type, help)
+_CACHE_METRICS = {
+    "hits": ("hits_total", "counter", "Cache lookups that were served from the cache"),
+    "misses": ("misses_total", "counter", "Cache lookups that had to go upstream"),
+    "evictions": ("evictions_total", "counter", "Entries dropped to stay within the budget"),
+    "invalidations": ("invalidations_total", "counter", "Times the whole cache was invalidated"),
+    "stale_hits": ("stale_hits_total", "counter", "Expired entries served because the backend failed"),
+    "bytes": ("bytes", "gauge", "Bytes held by the cache"),
+    "max_bytes": ("max_bytes", "gauge", "Byte budget of the cache"),
+    "entries": ("entries", "gauge", "Entries held by the cache"),
+}
+
+@_metrics.collector
+def _cache_metrics():
+    stats = {
+        "layer_png": _layer_png_cache.stats(),
+        "layer_png_disk": _layer_disk_cache.stats() if _layer_disk_cache is not None else {},
+        "design_list": _design_list_cache.stats(),
+        "design_meta": _design_meta_cache.stats(),
+        "stamp_assets": _asset_cache.stats(),
+        "layer_tiles": _tile_cache.stats(),
+        "composites": _composite_cache.stats(),
+        "projector_renders": _projector_cache.stats(),
+    }
+    for key, (suffix, kind, help) in _CACHE_METRICS.items():
+        samples = [({"cache": name}, s[key]) for name, s in stats.items() if s.get(key) is not None]
+        if samples:
+            yield f"shield_cache_{suffix}", kind, help, samples
+
+    fetches = _layer_fetches.stats()
+    yield "shield_layer_fetches_in_flight", "gauge", "Layer PNG downloads in progress", [({}, fetches["in_flight"])]
+    yield "shield_layer_prefetch_queued", "gauge", "Layer/tile prefetches waiting or downloading", [
+        ({}, _prefetch_queued)
+    ]
+    yield "shield_layer_fetch_waiters_total", "counter", "Requests that joined a download already in progress", [
+        ({}, fetches["followers"])
+    ]
+
+    health = backend.health()
+    if health:
+        b = {"backend": backend.name}
+        yield "shield_upstream_circuit_state", "gauge", "Circuit breaker state (1 = current)", [
+            (dict(b, state=st), 1 if health["state"] == st else 0)
+            for st in (CircuitBreaker.CLOSED, CircuitBreaker.OPEN, CircuitBreaker.HALF_OPEN)
+        ]
+        yield "shield_upstream_circuit_opened_total", "counter", "Times the circuit breaker opened", [
+            (b, health["opened"])
+        ]
+        yield "shield_upstream_short_circuited_total", "counter", "Calls refused while the breaker was open", [
+            (b, health["short_circuited"])
+        ]
+        yield "shield_upstream_retries_total", "counter", "Upstream attempts that were retried", [(b, health["retries"])]
+
+    if _save_queue is not None:
+        q = _save_queue.stats()
+        yield "shield_save_queue_depth", "gauge", "Queued saves not yet written to the backend", [({}, q["depth"])]
+        yield "shield_save_queue_oldest_age_seconds", "gauge", "Age of the oldest unflushed save", [
+            ({}, q["oldest_pending_age_s"])
+        ]
+        yield "shield_save_queue_flushes_total", "counter", "Backend writes done by the save queue", [({}, q["flushes"])]
+        yield "shield_save_queue_failures_total", "counter", "Save queue flushes that failed", [({}, q["failures"])]
+
+# With several workers (serve.py) a scrape reaches any one of them, so each
+# also writes its numbers to SHARED_STATE_DIR/metrics/<pid>.json (every
+# METRICS_PUBLISH_S, default 5, and on each scrape) and /metrics adds up
+# every worker's. Counters and histograms of workers that have exited keep
+# counting, so totals don't go down when one is replaced; their gauges are
+# left out. Gauges are summed too (e.g. circuit state = workers in it).
+# serve.py clears the directory on start.
+_METRICS_DIR = os.path.join(_SHARED_DIR, "metrics") if SERVER_WORKERS > 1 else None
+_METRICS_PUBLISH_S = max(0.5, _env_float("METRICS_PUBLISH_S", 5.0))
+
+def _publish_metrics():
+    os.makedirs(_METRICS_DIR, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=_METRICS_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            json.dump(_metrics.snapshot(), fh)
+        os.replace(tmp, os.path.join(_METRICS_DIR, f"{os.getpid()}.json"))
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+def _metrics_publisher():
+    while True:
+        time.sleep(_METRICS_PUBLISH_S)
+        try:
+            _publish_metrics()
+        except Exception as e:  # keep publishing; the next scrape says what's wrong
+            print("metrics publish failed:", e)
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass  # exists, owned by someone else
+    return True
+
+def _all_workers_metrics() -> str:
+    _publish_metrics()
+    snapshots, live = [], []
+    for name in sorted(os.listdir(_METRICS_DIR)):
+        pid = name[:-len(".json")]
+        if not (name.endswith(".json") and pid.isdigit()):
+            continue
+        try:
+            with open(os.path.join(_METRICS_DIR, name), encoding="utf-8") as fh:
+                snapshots.append(json.load(fh))
+        except (OSError, ValueError):
+            continue
+        if _pid_alive(int(pid)):
+            live.append(len(snapshots) - 1)
+    return render_families(merge_metrics(snapshots, gauges_from=live))
+
+@_builds_state
+def _start_metrics_publisher():
+    if _METRICS_DIR is not None:
+        threading.Thread(target=_metrics_publisher, name="metrics-publish", daemon=True).start()
+
+@bp.get("/metrics")
+def metrics():
+    body = _metrics.render() if _METRICS_DIR is None else _all_workers_metrics()
+    return Response(body, mimetype="text/plain; version=0.0.4")
 
+# ============================================================
+# API: Delete Design(s) (design rows + layers rows + storage pngs + cache)
+# ============================================================
+_DELETE_ROW_BATCH = 100
+
+def delete_designs(design_ids: List[str]) -> Dict[str, dict]:
+    """
+    Delete many designs with a handful of backend calls:
+      1. one layers lookup per 100 designs
+      2. one bulk blob remove (Supabase: one request per 1000 objects)
+      3. one layers + designs row delete per 100 designs
+    Rows are only deleted for designs whose storage objects are gone, so a
+    failed design can simply be retried.
+
+    Returns { design_id: {"ok": bool, "objects": int, "error"?: str} }.
+    """
+    results: Dict[str, dict] = {d: {"ok": True, "objects": 0} for d in design_ids}
+    paths_by_design: Dict[str, set] = {d: set() for d in design_ids}
+
+    # Queued (write-behind) saves must not recreate layer rows afterwards
+    if _save_queue is not None:
+        _save_queue.discard(design_ids)
+
+    def _fail(ids, error: str, details: str):
+        for d in ids:
+            if results[d]["ok"]:
+                results[d] = {"ok": False, "objects": results[d]["objects"], "error": error, "details": details}
+
+    batches = [design_ids[i:i + _DELETE_ROW_BATCH] for i in range(0, len(design_ids), _DELETE_ROW_BATCH)]
+
+    for batch in batches:
+        try:
+            found = backend.layer_refs(batch)
+        except Exception as e:
+            _fail(batch, "failed reading layers", str(e))
+            continue
+        for row in found:
+            if row["design_id"] in paths_by_design:
+                paths_by_design[row["design_id"]] |= _row_blob_paths(row["design_id"], row)
+
+    # Delete storage objects first
+    pending = [d for d in design_ids if results[d]["ok"] and paths_by_design[d]]
+    all_paths = [p for d in pending for p in sorted(paths_by_design[d])]
+    if all_paths:
+        try:
+            backend.delete_blobs(all_paths)
+        except Exception as e:
+            _fail(pending, "failed deleting storage objects", str(e))
+    for d in pending:
+        if results[d]["ok"]:
+            results[d]["objects"] = len(paths_by_design[d])
+
+    # Delete DB rows
+    ready = [d for d in design_ids if results[d]["ok"]]
+    for batch in [ready[i:i + _DELETE_ROW_BATCH] for i in range(0, len(ready), _DELETE_ROW_BATCH)]:
+        try:
+            backend.delete_design_rows(batch)
+        except Exception as e:
+            _fail(batch, "failed deleting db rows", str(e))
+
+    # One pass over the caches for every requested design; purging a design
+    # that failed to delete only costs a re-fetch later.
+    _purge_designs_cache(design_ids)
+    for d in design_ids:
+        _design_meta_cache.pop(d)
+    if all(r["ok"] for r in results.values()):
+        _list_remove_entries(design_ids)
+    else:
+        _note_list_delete()
+        _design_list_cache.pop(_DESIGN_LIST_KEY)
+    return results
+
+@bp.route("/api/designs/<design_id>", methods=["DELETE"])
+def api_delete_design(design_id):
+    res = delete_designs([design_id])[design_id]
+    if not res["ok"]:
+        return jsonify({"error": res["error"], "details": res["details"]}), 500
     return jsonify({"ok": True})
 
+@bp.post("/api/designs/bulk-delete")
+def api_bulk_delete_designs():
+    """
+    Delete many designs at once.
+
+    Expects JSON: { "ids": ["<design_id>", ...] }   (max 1000)
+    Returns: { ok, results: { <design_id>: {ok, objects, error?, details?} } }
+    """
+    body = request.get_json(force=True, silent=False) or {}
+    if not isinstance(body, dict):
+        return jsonify({"error": "expected a JSON object"}), 400
+    ids = body.get("ids")
+    if not isinstance(ids, list) or not all(isinstance(x, str) and x for x in ids):
+        return jsonify({"error": "ids must be a list of design ids"}), 400
+    if len(ids) > 1000:
+        return jsonify({"error": "too many ids (max 1000)"}), 400
+
+    ids = list(dict.fromkeys(ids))  # dedupe, keep order
+    results = delete_designs(ids)
+    ok = all(r["ok"] for r in results.values())
+    return jsonify({"ok": ok, "results": results}), (200 if ok else 207)
+
+# ============================================================
+# Parallel layer uploads
+#   One shared, bounded pool so a burst of saves can't open unlimited
+#   connections to Supabase. SAVE_UPLOAD_WORKERS in .env (default 6).
+# ============================================================
+_UPLOAD_POOL: ThreadPoolExecutor
+
+@_builds_state
+def _build_upload_pool():
+    global _UPLOAD_POOL
+    _UPLOAD_POOL = ThreadPoolExecutor(
+        max_workers=max(1, _env_int("SAVE_UPLOAD_WORKERS", 6)),
+        thread_name_prefix="layer-upload",
+    )
+
+class LayerUploadBatch:
+    """
+    Layer PUTs for one save, running on _UPLOAD_POOL as they are submitted.
+
+    The first failure cancels every upload that hasn't started yet; ones
+    already on the wire are allowed to finish (requests can't abort a PUT
+    mid-body). Each blob is streamed from whatever open_blob() returns
+    (SpooledPart.open, or a write-behind spool file).
+    """
+
+    def __init__(self):
+        self._stop = threading.Event()
+        self._futures: Dict = {}
+
+    @property
+    def failed(self) -> bool:
+        return self._stop.is_set()
+
+    def submit(self, layer_index: int, png_path: str, open_blob):
+        def _one():
+            if self._stop.is_set():
+                raise CancelledError()
+            try:
+                with open_blob() as fh:
+                    backend.put_blob(png_path, fh, content_type="image/png")
+            except Exception:
+                self.cancel()
+                raise
+
+        self._futures[_UPLOAD_POOL.submit(_one)] = (layer_index, png_path)
+
+    def cancel(self):
+        self._stop.set()
+        for fut in self._futures:
+            fut.cancel()
+
+    def __len__(self) -> int:
+        return len(self._futures)
+
+    def wait(self) -> Tuple[bool, List[dict]]:
+        """Block until every upload settled. Returns (all_ok, per-layer results)."""
+        results: List[dict] = []
+        all_ok = True
+
+        for fut in as_completed(self._futures):
+            idx, path = self._futures[fut]
+            res = {"layer_index": idx, "png_path": path}
+            try:
+                fut.result()
+                res["ok"] = True
+            except BackendError as e:
+                res.update({"ok": False, "status": e.status, "details": e.details})
+            except CancelledError:
+                res.update({"ok": False, "cancelled": True})
+            except Exception as e:
+                res.update({"ok": False, "details": str(e)})
+            results.append(res)
+
+            if not res["ok"] and all_ok:
+                all_ok = False
+                self.cancel()
+
+        results.sort(key=lambda x: x["layer_index"])
+        return all_ok, results
+
+# ============================================================
+# Layer PNG optimization on ingest (opt-in)
+#   canvas.toBlob() sends the whole canvas at a fast zlib level, however
+#   little is drawn on it. With this on, every layer a save sends is
+#   trimmed to its non-transparent box and re-encoded losslessly (palette
+#   when it has <= 256 colors, zlib level 9; see pngopt.py) before it is
+#   stored; the box's position goes into the row's offset_x/offset_y and the
+#   layer's size into canvas_width/canvas_height (composites and png_url are
+#   still the whole layer).
+#   Tiles are re-encoded but not trimmed. Uploads start as each layer is
+#   done, but it is pure-Python CPU work on every save, hence off by default.
+#
+#   LAYER_OPTIMIZE           1 to enable (default off)
+#   LAYER_OPTIMIZE_WORKERS   layers optimized at once (default 2)
+# ============================================================
+_OPTIMIZE_POOL: Optional[ThreadPoolExecutor] = None
+
+@_builds_state
+def _build_optimize_pool():
+    global _OPTIMIZE_POOL
+    if os.getenv("LAYER_OPTIMIZE", "").strip() == "1":
+        _OPTIMIZE_POOL = ThreadPoolExecutor(
+            max_workers=max(1, _env_int("LAYER_OPTIMIZE_WORKERS", 2)),
+            thread_name_prefix="layer-optimize",
+        )
+
+# sha1 of a received PNG -> (sha1 it was stored as, offset, canvas), so an autosave
+# resending an unchanged layer is recognised without re-encoding it
+_optimized_as = TTLCache(ttl_s=24 * 3600, max_entries=4096)
+
+_optimize_seconds = _metrics.histogram(
+    "shield_layer_optimize_seconds", "Time to optimize one received layer PNG or tile",
+)
+_optimize_saved = _metrics.counter(
+    "shield_layer_optimize_saved_bytes_total", "Bytes cut from received layer PNGs before storing them",
+)
+
+def _optimize_part(part: SpooledPart, trim: bool) -> Tuple[SpooledPart, Tuple[int, int], Optional[Tuple[int, int]]]:
+    """
+    Runs on _OPTIMIZE_POOL: the part to store instead (or part itself if
+    that is smallest), its offset, and the size it had if it was trimmed.
+    """
+    t0 = time.perf_counter()
+    try:
+        result = optimize_png(part.read_bytes(), trim=trim)
+    except (TileError, OSError):
+        result = None  # not a PNG we can read: store it as sent
+    finally:
+        _optimize_seconds.observe(time.perf_counter() - t0)
+
+    if result is None:
+        _optimized_as.put(part.sha1, (part.sha1, (0, 0), None))
+        return part, (0, 0), None
+    out = SpooledPart(part.name, part.filename, _SAVE_SPOOL_BYTES,
+                      _save_queue.spool_dir if _save_queue is not None else None)
+    out.write(result.data)
+    out.finish()
+    canvas = result.canvas if result.size != result.canvas else None
+    _optimized_as.put(part.sha1, (out.sha1, result.offset, canvas))
+    _optimize_saved.inc(amount=max(0, part.size - out.size))
+    return out, result.offset, canvas
+
 # ============================================================
 # API: Save (layers + stamps)
 # ============================================================
-@app.post("/api/designs/<design_id>/save")
+# Streaming ingest limits (see ingest.py). Oversize saves are rejected with
+# 413 before (Content-Length) or while (chunked) the body is read.
+#   SAVE_MAX_PART_MB    one layer PNG (default 32)
+#   SAVE_MAX_TOTAL_MB   whole request body (default 256)
+#   SAVE_MAX_META_MB    the meta JSON field (default 16)
+#   SAVE_SPOOL_MB       parts above this go to a temp file instead of RAM (default 1)
+_SAVE_MAX_PART_BYTES = _env_int("SAVE_MAX_PART_MB", 32) * 1024 * 1024
+_SAVE_MAX_TOTAL_BYTES = _env_int("SAVE_MAX_TOTAL_MB", 256) * 1024 * 1024
+_SAVE_MAX_META_BYTES = _env_int("SAVE_MAX_META_MB", 16) * 1024 * 1024
+_SAVE_SPOOL_BYTES = _env_int("SAVE_SPOOL_MB", 1) * 1024 * 1024
+_LAYER_FIELD_RE = re.compile(r"^layer_(\d+)$")
+_TILE_FIELD_RE = re.compile(r"^tile_(\d+)_(\d+)_(\d+)$")
+
+# Cleanup of replaced objects. A concurrent save of the same design may have
+# read the old rows and kept pointing at an object (e.g. after an undo), so
+# deletes wait until no save of the design is in flight here, then drop
+# whatever the design's current rows still reference.
+# With several workers (serve.py) the save may be in flight in another
+# process, so every save also holds a shared flock on
+# SHARED_STATE_DIR/saves/<sha1 of design>.lock. The cleanup only runs while
+# it holds that lock exclusively and retries every _SUPERSEDED_RETRY_S
+# until it can get it. A save that starts meanwhile waits for the cleanup,
+# then reads rows that no longer point at the deleted objects.
+_saves_lock = threading.Lock()
+_saves_in_flight: Dict[str, int] = {}  # design_id -> saves being handled
+_superseded_pending: Dict[str, set] = {}  # design_id -> paths to delete once they're done
+_SAVE_LOCK_DIR = os.path.join(_SHARED_DIR, "saves") if SERVER_WORKERS > 1 and fcntl is not None else None
+_SUPERSEDED_RETRY_S = 2.0
+
+def _design_save_lock(design_id: str):
+    """The design's lock file across workers (open it per holder: flock is per open file)."""
+    os.makedirs(_SAVE_LOCK_DIR, exist_ok=True)
+    name = hashlib.sha1(design_id.encode("utf-8")).hexdigest() + ".lock"
+    return open(os.path.join(_SAVE_LOCK_DIR, name), "ab")
+
+def _tracks_save(fn):
+    @wraps(fn)
+    def wrapper(design_id, *args, **kwargs):
+        with _saves_lock:
+            _saves_in_flight[design_id] = _saves_in_flight.get(design_id, 0) + 1
+        lock = None
+        try:
+            if _SAVE_LOCK_DIR is not None:
+                lock = _design_save_lock(design_id)
+                fcntl.flock(lock, fcntl.LOCK_SH)  # waits out another worker's cleanup
+            return fn(design_id, *args, **kwargs)
+        finally:
+            if lock is not None:
+                lock.close()
+            with _saves_lock:
+                left = _saves_in_flight.pop(design_id) - 1
+                if left:
+                    _saves_in_flight[design_id] = left
+                    paths = None
+                else:
+                    paths = _superseded_pending.pop(design_id, None)
+            if paths:
+                _FETCH_POOL.submit(_delete_superseded_objects, design_id, paths)
+    return wrapper
+
+def _queue_superseded(design_id: str, paths: set):
+    with _saves_lock:
+        if design_id in _saves_in_flight:
+            _superseded_pending.setdefault(design_id, set()).update(paths)
+            return
+    _FETCH_POOL.submit(_delete_superseded_objects, design_id, paths)
+
+def _saved_rows_stored(design_id: str, prev_rows: Dict[int, dict], rows: List[dict],
+                       stamps: list, now: str):
+    """After a save reached the backend: write-through the caches, clean up replaced objects."""
+    new_rows = dict(prev_rows)
+    for row in rows:
+        new_rows[row["layer_index"]] = {
+            "layer_index": row["layer_index"],
+            "name": row["name"],
+            "visible": row["visible"],
+            "png_path": row["png_path"],
+            "png_hash": row["png_hash"],
+            "tiles_json": row.get("tiles_json"),
+            "offset_x": row.get("offset_x") or 0,
+            "offset_y": row.get("offset_y") or 0,
+            "canvas_width": row.get("canvas_width"),
+            "canvas_height": row.get("canvas_height"),
+        }
+    merged = [new_rows[k] for k in sorted(new_rows)]
+    _design_meta_cache.update(design_id, lambda m: (dict(m[0], stamps_json=stamps, updated_at=now), merged))
+    _list_touch_entry(design_id, _iso_to_ms(now))
+
+    # Objects no row points at any more (old hash, legacy layer_<i>.png,
+    # tiles that were redrawn or cleared) can go
+    live = set().union(*(_row_blob_paths(design_id, r) for r in merged))
+    superseded = set().union(*(_row_blob_paths(design_id, r) for r in prev_rows.values())) - live
+    if superseded:
+        _queue_superseded(design_id, superseded)
+
+@bp.post("/api/designs/<design_id>/save")
+@_tracks_save
 def api_save_design(design_id):
     """
     Expects multipart/form-data:
-      - meta: JSON string { layers: [{layer_index,name,visible}, ...], stamps: [...] }
+      - meta: JSON string { layers: [{layer_index,name,visible,tiles?}, ...], stamps: [...] }
       - layer files: one file per layer with field name: layer_<index>
+      - or, for layers whose meta has "tiles": tile_<index>_<col>_<row>
+        files, only for tiles that changed
+
+    A tiled layer's meta entry is
+      tiles: { size, width, height, clear: ["<col>,<row>", ...], reset: bool }
+    Sent tiles and cleared cells are applied on top of the stored grid
+    (an empty one with reset, e.g. after a resize). A sent tile that is
+    fully transparent counts as cleared. If the stored grid has a
+    different size and reset isn't set the save is refused with 409, so
+    the client can resend every tile.
+
+    The body is parsed as it streams in: each layer is hashed and spooled
+    while it arrives, and its upload starts as soon as the part is complete
+    (send meta first, as repo.js does, so uploads don't wait for the end).
+
+    With SAVE_WRITE_BEHIND=1 nothing is sent to Supabase here: the save is
+    written to the local queue and acknowledged with 202 (see below).
     """
+    if request.content_length is not None and request.content_length > _SAVE_MAX_TOTAL_BYTES:
+        return jsonify({"error": "save too large", "max_bytes": _SAVE_MAX_TOTAL_BYTES}), 413
+
+    # Current rows tell us which layers are already stored with the same bytes
+    current = design_meta_view(design_id)
+    prev_rows = {r.get("layer_index"): r for r in (current[1] if current else [])}
+    stored_tiles = _stored_tiles(prev_rows.values())
+
+    batch = LayerUploadBatch()
+    parts: Dict[int, SpooledPart] = {}
+    tile_parts: Dict[Tuple[int, str], SpooledPart] = {}
+    layer_refs: Dict[int, tuple] = {}  # layer_index -> (sha1, offset, canvas) the row points at
+    tile_refs: Dict[Tuple[int, str], str] = {}  # (layer_index, key) -> sha1 the manifest points at
+    optimizing: Dict = {}  # _OPTIMIZE_POOL future -> (layer_index, tile key or None)
+    optimized: Dict[int, List[int]] = {}  # layer_index -> [bytes received, bytes stored]
+    blank_tiles: set = set()  # (layer_index, key) sent fully transparent
+    tile_grids: Dict[int, dict] = {}  # layer_index -> manifest the sent tiles go on top of
+    staged: Dict[str, SpooledPart] = {}  # sha1 -> bytes for the write-behind queue
+    deferred: List[Tuple[str, SpooledPart]] = []  # file parts that arrived before meta
+    meta: Optional[dict] = None
+    wanted: Optional[set] = None
+    skipped = 0
+
+    def _unchanged(idx: int, sha1: str, offset: Tuple[int, int], canvas: Optional[Tuple[int, int]]) -> bool:
+        prev = prev_rows.get(idx) or {}
+        return (prev.get("png_hash") == sha1 and prev.get("png_path") == layer_object_path(design_id, idx, sha1)
+                and _row_offset(prev) == offset and _row_canvas(prev) == canvas)
+
+    def _take(idx: int, part: SpooledPart):
+        nonlocal skipped
+        if idx in parts:
+            part.close()  # duplicate field: first one wins, like request.files.get()
+            return
+        parts[idx] = part
+        if _OPTIMIZE_POOL is None:
+            return _store_layer(idx, part, (0, 0), None)
+        stored_as = _optimized_as.get(part.sha1)
+        if stored_as is not None and _unchanged(idx, *stored_as):
+            layer_refs[idx] = stored_as
+            skipped += 1
+        else:
+            optimizing[_OPTIMIZE_POOL.submit(_optimize_part, part, True)] = (idx, None)
+
+    def _store_layer(idx: int, part: SpooledPart, offset: Tuple[int, int], canvas: Optional[Tuple[int, int]]):
+        nonlocal skipped
+        layer_refs[idx] = (part.sha1, offset, canvas)
+        if _unchanged(idx, part.sha1, offset, canvas):
+            skipped += 1  # unchanged since last save: nothing to upload
+        elif _save_queue is not None:
+            staged[part.sha1] = part  # goes into the write-behind queue below
+        else:
+            batch.submit(idx, layer_object_path(design_id, idx, part.sha1), part.open)
+
+    def _take_tile(idx: int, col: int, row: int, part: SpooledPart):
+        nonlocal skipped
+        key = (idx, tile_key(col, row))
+        if key in tile_parts:
+            part.close()
+            return
+        tile_parts[key] = part
+        cols, rows = grid_size(tile_grids[idx])
+        if col >= cols or row >= rows:
+            raise TileError(f"tile {col},{row} is outside layer {idx}'s grid")
+        data = part.read_bytes()
+        w, h, _bpp = png_header(data)
+        if w > tile_grids[idx]["size"] or h > tile_grids[idx]["size"]:
+            raise TileError(f"tile {col},{row} of layer {idx} is larger than the tile size")
+        if is_blank(data):
+            blank_tiles.add(key)
+        elif _OPTIMIZE_POOL is None:
+            _store_tile(key, part)
+        else:
+            stored_as = _optimized_as.get(part.sha1)
+            if stored_as is not None and (stored_as[0] in stored_tiles or stored_as[0] in staged):
+                tile_refs[key] = stored_as[0]
+                skipped += 1
+            else:
+                optimizing[_OPTIMIZE_POOL.submit(_optimize_part, part, False)] = (idx, key)
+
+    def _store_tile(key: Tuple[int, str], part: SpooledPart):
+        nonlocal skipped
+        tile_refs[key] = part.sha1
+        if part.sha1 in stored_tiles or part.sha1 in staged:
+            skipped += 1  # same pixels already stored (or sent twice): nothing to upload
+        elif _save_queue is not None:
+            staged[part.sha1] = part
+        else:
+            stored_tiles.add(part.sha1)
+            batch.submit(key[0], tile_object_path(design_id, part.sha1), part.open)
+
+    def _settle_optimized(wait: bool = False):
+        """Store the layers/tiles _OPTIMIZE_POOL has finished (all of them with wait)."""
+        done = list(as_completed(optimizing)) if wait else [f for f in optimizing if f.done()]
+        for fut in done:
+            idx, key = optimizing.pop(fut)
+            sent = tile_parts[key] if key is not None else parts[idx]
+            part, offset, canvas = fut.result()
+            if part is not sent:
+                before_after = optimized.setdefault(idx, [0, 0])
+                before_after[0] += sent.size
+                before_after[1] += part.size
+                sent.close()
+            if key is not None:
+                tile_parts[key] = part
+                _store_tile(key, part)
+            else:
+                parts[idx] = part
+                _store_layer(idx, part, offset, canvas)
+
+    def _route(name: str, part: SpooledPart):
+        m = _LAYER_FIELD_RE.match(name)
+        if m and int(m.group(1)) in wanted:
+            return _take(int(m.group(1)), part)
+        t = _TILE_FIELD_RE.match(name)
+        if t and int(t.group(1)) in tile_grids:
+            return _take_tile(int(t.group(1)), int(t.group(2)), int(t.group(3)), part)
+        part.close()
+
+    def _tile_bases(layers_meta: list) -> Tuple[Dict[int, dict], List[int]]:
+        """Starting manifest per tiled layer, and layers whose stored grid doesn't match."""
+        bases, conflicts = {}, []
+        for lm in layers_meta:
+            spec = lm.get("tiles")
+            if not spec:
+                continue
+            idx = int(lm.get("layer_index"))
+            base = parse_grid(spec)
+            prev = prev_rows.get(idx) or {}
+            prev_manifest = _row_manifest(prev)
+            if not spec.get("reset"):
+                if same_grid(prev_manifest, base):
+                    base["tiles"] = dict(prev_manifest["tiles"])
+                elif prev_manifest is not None or prev.get("png_path"):
+                    conflicts.append(idx)
+            for key in spec.get("clear") or []:
+                base["tiles"].pop(tile_key(*parse_key(key)), None)
+            bases[idx] = base
+        return bases, conflicts
+
     try:
-        meta_raw = request.form.get("meta", "")
-        meta = json.loads(meta_raw) if meta_raw else {}
-    except Exception:
-        return jsonify({"error": "invalid meta json"}), 400
-
-    layers_meta = meta.get("layers") or []
-    stamps = meta.get("stamps") or []
-    bucket = _bucket()
-
-    uploaded_rows = []
-
-    for lm in layers_meta:
-        idx = int(lm.get("layer_index"))
-        f = request.files.get(f"layer_{idx}")
-        png_path = f"layers/{design_id}/layer_{idx}.png"
-
-        if f:
-            # Read once; upload through SESSION (connection reuse)
-            blob = f.read()
-            r = storage_put_object(bucket, png_path, data=blob, content_type="image/png")
-            if not r.ok:
-                return jsonify(
-                    {
-                        "error": "storage upload failed",
-                        "status": r.status_code,
-                        "details": r.text,
-                    }
-                ), 500
-
-        # Invalidate RAM cache for that layer
-        _layer_png_cache.pop((design_id, idx), None)
-
-        uploaded_rows.append(
+        try:
+            for kind, name, value in iter_multipart(
+                request.stream,
+                request.content_type,
+                max_part_bytes=_SAVE_MAX_PART_BYTES,
+                max_total_bytes=_SAVE_MAX_TOTAL_BYTES,
+                max_field_bytes=_SAVE_MAX_META_BYTES,
+                spool_threshold=_SAVE_SPOOL_BYTES,
+                spool_dir=_save_queue.spool_dir if _save_queue is not None else None,
+            ):
+                if kind == "field":
+                    if name == "meta" and meta is None:
+                        meta = json.loads(value) if value else {}
+                        tile_grids, conflicts = _tile_bases(meta.get("layers") or [])
+                        if conflicts:
+                            return jsonify({
+                                "error": "stored tile grid differs; resend every tile with reset",
+                                "layers": conflicts,
+                            }), 409
+                        wanted = {
+                            int(lm.get("layer_index")) for lm in (meta.get("layers") or [])
+                        } - set(tile_grids)
+                        for fname, part in deferred:
+                            _route(fname, part)
+                        deferred = []
+                    continue
+
+                if not (_LAYER_FIELD_RE.match(name) or _TILE_FIELD_RE.match(name)):
+                    value.close()
+                elif wanted is None:
+                    deferred.append((name, value))
+                else:
+                    _route(name, value)
+                _settle_optimized()
+
+                if batch.failed:
+                    break  # an upload already failed; don't read the rest
+        except IngestError as e:
+            batch.cancel()
+            return jsonify({"error": str(e)}), e.status
+        except TileError as e:
+            batch.cancel()
+            return jsonify({"error": str(e)}), 400
+        except (ValueError, TypeError, AttributeError):
+            batch.cancel()
+            return jsonify({"error": "invalid meta json"}), 400
+        _settle_optimized(wait=True)
+
+        meta = meta or {}
+        layers_meta = meta.get("layers") or []
+        stamps = meta.get("stamps") or []
+        for _name, part in deferred:  # no meta at all: nothing to attach them to
+            part.close()
+        deferred = []
+
+        # Custom stamp images go to storage once; stamps_json only keeps references
+        try:
+            stamps, stamp_srcs = extract_stamp_assets(stamps)
+        except RuntimeError as e:
+            batch.cancel()
+            return jsonify({"error": "stamp asset upload failed", "details": str(e)}), 500
+
+        uploaded_rows = []
+        for lm in layers_meta:
+            idx = int(lm.get("layer_index"))
+            prev = prev_rows.get(idx) or {}
+            offset, canvas = (0, 0), None
+
+            if idx in tile_grids:
+                manifest = tile_grids[idx]
+                for tidx, key in tile_parts:
+                    if tidx != idx:
+                        continue
+                    if (tidx, key) in blank_tiles:
+                        manifest["tiles"].pop(key, None)
+                    else:
+                        manifest["tiles"][key] = tile_refs[(tidx, key)]
+                png_path, png_hash, tiles_json = None, manifest_digest(manifest), manifest
+            elif idx in layer_refs:
+                png_hash, offset, canvas = layer_refs[idx]
+                png_path, tiles_json = layer_object_path(design_id, idx, png_hash), None
+            elif prev.get("png_path") or prev.get("tiles_json"):
+                # Not re-sent: keep pointing at whatever is stored now
+                png_path, png_hash, tiles_json = prev.get("png_path"), prev.get("png_hash"), prev.get("tiles_json")
+                offset, canvas = _row_offset(prev), _row_canvas(prev)
+            else:
+                png_path, png_hash, tiles_json = layer_object_path(design_id, idx), None, None
+
+            uploaded_rows.append(
+                {
+                    "design_id": design_id,
+                    "layer_index": idx,
+                    "name": lm.get("name") or f"Layer {idx + 1}",
+                    "visible": bool(lm.get("visible", True)),
+                    "png_path": png_path,
+                    "png_hash": png_hash,
+                    "tiles_json": tiles_json,
+                    "offset_x": offset[0],
+                    "offset_y": offset[1],
+                    "canvas_width": canvas[0] if canvas else None,
+                    "canvas_height": canvas[1] if canvas else None,
+                }
+            )
+
+        # Tiled layers whose picture changed (cleared tiles don't upload anything)
+        retiled = {
+            r["layer_index"] for r in uploaded_rows
+            if r["tiles_json"] is not None and r["png_hash"] != (prev_rows.get(r["layer_index"]) or {}).get("png_hash")
+        }
+
+        if _save_queue is not None:
+            touched = retiled | {idx for idx, p in parts.items() if p.sha1 in staged}
+            return _queue_save(design_id, uploaded_rows, stamps, staged, touched, skipped, stamp_srcs,
+                               _optimized_report(optimized))
+
+        # All blobs must land before any metadata changes
+        ok, upload_results = batch.wait()
+    finally:
+        # Uploads and optimizers read straight from the spooled parts, so let them settle first
+        batch.cancel()
+        batch.wait()
+        for fut in optimizing:
+            fut.cancel()
+        for fut in as_completed(optimizing):
+            if not fut.cancelled() and fut.exception() is None:
+                fut.result()[0].close()
+        for part in list(parts.values()) + list(tile_parts.values()) + [p for _, p in deferred]:
+            part.close()
+
+    # Invalidate RAM + disk cache even on failure: some uploads may have landed
+    for idx in retiled | {res["layer_index"] for res in upload_results}:
+        _invalidate_layer_cache(design_id, idx)
+
+    if not ok:
+        _design_meta_cache.pop(design_id)
+        first = next(x for x in upload_results if not x["ok"] and not x.get("cancelled"))
+        return jsonify(
             {
-                "design_id": design_id,
-                "layer_index": idx,
-                "name": lm.get("name") or f"Layer {idx + 1}",
-                "visible": bool(lm.get("visible", True)),
-                "png_path": png_path,
+                "error": "storage upload failed",
+                "layer_index": first["layer_index"],
+                "status": first.get("status"),
+                "details": first.get("details"),
+                "layers": upload_results,
             }
-        )
+        ), 500
 
-    # Upsert layers table
-    def _upsert_layers():
-        headers = dict(sb_headers_json_cached())
-        headers["Prefer"] = "resolution=merge-duplicates,return=minimal"
-        r = SESSION.post(
-            rest_url("layers"),
-            headers=headers,
-            params={"on_conflict": "design_id,layer_index"},
-            data=json.dumps(uploaded_rows),
-            timeout=(5, 25),
-        )
-        return r
-
-    r = timed("REST POST layers upsert", _upsert_layers)
-    if not r.ok:
-        return jsonify({"error": "layers upsert failed", "status": r.status_code, "details": r.text}), 500
+    try:
+        backend.upsert_layers(uploaded_rows)
+    except BackendError as e:
+        _design_meta_cache.pop(design_id)
+        return jsonify({"error": "layers upsert failed", "status": e.status, "details": e.details}), 500
 
     # Update design stamps_json + updated_at
-    rest_patch(
-        "designs",
-        payload={"stamps_json": stamps, "updated_at": _now_iso()},
-        params={"id": f"eq.{design_id}"},
+    now = _now_iso()
+    try:
+        backend.update_design(design_id, {"stamps_json": stamps, "updated_at": now})
+    except Exception:
+        _design_meta_cache.pop(design_id)
+        raise
+
+    _saved_rows_stored(design_id, prev_rows, uploaded_rows, stamps, now)
+
+    return jsonify(
+        {"ok": True, "uploaded": len(upload_results), "unchanged": skipped, "stamp_srcs": stamp_srcs,
+         "optimized": _optimized_report(optimized)}
     )
 
-    return jsonify({"ok": True})
+def _optimized_report(optimized: Dict[int, List[int]]) -> List[dict]:
+    """Per-layer bytes saved by _optimize_part, for the save response."""
+    return [
+        {"layer_index": idx, "before": before, "after": after, "saved": before - after}
+        for idx, (before, after) in sorted(optimized.items())
+    ]
+
+def _delete_superseded_objects(design_id: str, paths: set):
+    """Delete replaced objects, minus any the design's stored (or queued) rows point at again."""
+    lock = None
+    try:
+        if _SAVE_LOCK_DIR is not None:
+            lock = _design_save_lock(design_id)
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # A save of the design is in flight (in some worker); look again later
+                retry = threading.Timer(
+                    _SUPERSEDED_RETRY_S, _FETCH_POOL.submit, (_delete_superseded_objects, design_id, paths),
+                )
+                retry.daemon = True
+                retry.start()
+                return
+        rows = backend.get_layers(design_id)
+        pending = _save_queue.pending(design_id) if _save_queue is not None else None
+        if pending is not None:
+            rows = rows + list(pending.rows.values())
+        paths = set(paths) - set().union(*(_row_blob_paths(design_id, r) for r in rows))
+        if paths:
+            backend.delete_blobs(sorted(paths))
+    except Exception as e:
+        print("superseded layer cleanup failed:", e)
+    finally:
+        if lock is not None:
+            lock.close()
+
+# ============================================================
+# Write-behind saves (opt-in)
+#   Autosave fires about every 500 ms while drawing. With this on, a save
+#   is fsync'd to a local queue and acknowledged straight away; workers
+#   push it to Supabase afterwards, and when several saves of one design
+#   are waiting, only the newest bytes per layer get uploaded. Loads, the
+#   bundle and layer PNG requests read through the queue, so pending state
+#   is visible immediately. Queued saves survive a restart.
+#
+#   SAVE_WRITE_BEHIND     1 to enable (default off)
+#   SAVE_QUEUE_DIR        where the queue lives (default ./.cache/save_queue)
+#   SAVE_FLUSH_WORKERS    designs flushed concurrently (default 2)
+#   SAVE_FLUSH_DELAY_S    how long a design's first queued save waits, so a
+#                         burst of autosaves becomes one write (default 1.0)
+# ============================================================
+def _queue_save(design_id: str, rows: List[dict], stamps: list, staged: Dict[str, SpooledPart],
+                touched: set, skipped: int, stamp_srcs: Dict[str, str], optimized: List[dict]):
+    now = _now_iso()
+    try:
+        seq = _save_queue.enqueue(design_id, rows, stamps, now, staged)
+    except OSError as e:
+        return jsonify({"error": "save queue write failed", "details": str(e)}), 500
+
+    for idx in touched:
+        _invalidate_layer_cache(design_id, idx)
+    _list_touch_entry(design_id, _iso_to_ms(now))
+    return jsonify(
+        {"ok": True, "queued": len(staged), "seq": seq, "unchanged": skipped, "stamp_srcs": stamp_srcs,
+         "optimized": optimized}
+    ), 202
+
+def _flush_queued_save(design_id: str, save: PendingSave):
+    """SaveQueue worker: write one design's coalesced pending state to the backend."""
+    current = load_design_meta(design_id)
+    if current is None:
+        print("save queue: design", design_id, "is gone; dropping", save.count, "queued save(s)")
+        return
+    prev_rows = {r.get("layer_index"): r for r in current[1]}
+
+    rows_by_index = dict(save.rows)
+    batch = LayerUploadBatch()
+    for row in save.staged_rows():
+        idx = row["layer_index"]
+        prev = prev_rows.get(idx) or {}
+        if prev.get("png_hash") == row["png_hash"] and prev.get("png_path") == row["png_path"]:
+            continue
+        path = save.blob_path(row["png_hash"])
+        if not os.path.exists(path):
+            # Retrying can't bring the bytes back; keep the stored layer instead
+            print("save queue: bytes for layer", idx, "of", design_id, "are missing; keeping the stored layer")
+            rows_by_index.pop(idx, None)
+            continue
+        batch.submit(idx, row["png_path"], lambda path=path: open(path, "rb"))
+
+    # Tiles: upload the staged ones the backend doesn't have yet
+    stored_tiles = _stored_tiles(prev_rows.values())
+    for idx, row in sorted(rows_by_index.items()):
+        manifest = _row_manifest(row)
+        if manifest is None:
+            continue
+        todo = {d for d in manifest["tiles"].values() if d in save.blobs and d not in stored_tiles}
+        paths = {d: save.blob_path(d) for d in todo}
+        if not all(os.path.exists(p) for p in paths.values()):
+            print("save queue: tiles for layer", idx, "of", design_id, "are missing; keeping the stored layer")
+            rows_by_index.pop(idx)
+            continue
+        for digest, path in sorted(paths.items()):
+            batch.submit(idx, tile_object_path(design_id, digest), lambda path=path: open(path, "rb"))
+        stored_tiles |= todo
+    ok, upload_results = batch.wait()
+    if not ok:
+        first = next(x for x in upload_results if not x["ok"] and not x.get("cancelled"))
+        raise RuntimeError(f"layer {first['layer_index']} upload failed: {first.get('status')} {first.get('details')}")
+
+    rows = [rows_by_index[k] for k in sorted(rows_by_index)]
+    backend.upsert_layers(rows)
+    backend.update_design(design_id, {"stamps_json": save.stamps, "updated_at": save.updated_at})
+    _saved_rows_stored(design_id, prev_rows, rows, save.stamps, save.updated_at)
+
+_save_queue: Optional[SaveQueue] = None
+
+@_builds_state
+def _build_save_queue():
+    global _save_queue
+    if os.getenv("SAVE_WRITE_BEHIND", "").strip() == "1":
+        _save_queue = SaveQueue(
+            os.getenv("SAVE_QUEUE_DIR", "").strip()
+            or os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "save_queue"),
+            flush=_flush_queued_save,
+            workers=_env_int("SAVE_FLUSH_WORKERS", 2),
+            delay_s=_env_float("SAVE_FLUSH_DELAY_S", 1.0),
+        )
+
+@bp.get("/api/saves/status")
+def api_save_queue_status():
+    """Write-behind queue depth and flush lag (enabled: false when saves are synchronous)."""
+    if _save_queue is None:
+        return jsonify({"enabled": False})
+    return jsonify(dict(_save_queue.stats(), enabled=True))
 
 # ============================================================
 # Run
+#   python app.py                   one process (waitress)
+#   python serve.py --workers 4     one process per worker, see serve.py
 # ============================================================
+def create_app() -> Flask:
+    """
+    Build this process's state (see "Process state") and a Flask app on it.
+
+    Call it in the process that serves the requests, i.e. in each worker
+    after a fork. The state is built by the first call; later calls in
+    the same process get a new app around that same state.
+    """
+    global _state_pid
+    with _state_lock:
+        if _state_pid is None:
+            for build in _state_builders:
+                build()
+            _state_pid = os.getpid()
+        elif _state_pid != os.getpid():
+            # The threads and locks built there didn't come along
+            raise RuntimeError("create_app() ran before the fork; call it in each worker process")
+
+    # Static/ is served by static_file(); the folder names are capitalized, which
+    # Flask's defaults only find on case-insensitive filesystems
+    app = Flask(__name__, static_folder=None, template_folder="Templates")
+    # IMPORTANT: set this in .env as a long random string
+    secret = os.getenv("FLASK_SECRET_KEY", "").strip()
+    if not secret:
+        if SERVER_WORKERS > 1:
+            # Each worker would sign cookies with its own key and reject the others'
+            raise RuntimeError("FLASK_SECRET_KEY must be set when running several workers")
+        print("WARNING: FLASK_SECRET_KEY is not set; using a random key, so sessions end on every restart")
+        secret = secrets.token_hex(32)
+    app.secret_key = secret
+    # Harden cookies
+    app.config.update(
+        SESSION_COOKIE_HTTPONLY=True,
+        SESSION_COOKIE_SAMESITE="Lax",   # "Strict" is safer but can annoy some flows
+        SESSION_COOKIE_SECURE=False,     # set True when behind HTTPS / reverse proxy
+        USE_X_SENDFILE=os.getenv("USE_X_SENDFILE", "").strip() == "1",
+    )
+    app.register_blueprint(bp)
+    return app
+
 if __name__ == "__main__":
     # If you want to run under waitress, do:
     #   python app.py
     # (waitress is embedded below)
     from waitress import serve
-    # serve(app, host="127.0.0.1", port=8080)
-    serve(app, host="0.0.0.0", port=8080)
\ No newline at end of file
+    # serve(create_app(), host="127.0.0.1", port=8080)
+    serve(create_app(), host="0.0.0.0", port=8080, threads=SERVER_THREADS)
\ No newline at end of file
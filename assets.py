@@ -0,0 +1,346 @@
+"""
+Front-end build: fingerprinted, precompressed copies of Static/.
+
+    python -m assets build [--out DIR] [--atlas]
+
+Every file under Static/ is written to DIR with a content hash in its name
+(app/appController.js -> app/appController.1a2b3c4d5e.js), so browsers
+can cache it forever and a deploy still takes effect on the next page
+load. manifest.json maps source paths to built ones; app.py serves DIR
+and the templates ask it for URLs.
+
+  - Relative module imports ("./x.js", "../y.js") and "/static/..." string
+    literals are rewritten to the hashed names, dependencies first, so
+    editing one module renames it and every module that imports it.
+  - Stamps are recompressed losslessly (pngopt.optimize_png) and get a
+    THUMB_PX thumbnail for the palette; with atlas=True the thumbnails
+    are also packed into one sprite sheet.
+  - Text files get a .gz sibling, and a .br one when the brotli package
+    is installed.
+
+Pure Python (NumPy only makes the thumbnails smoother, see composite.py);
+a full build takes seconds, so app.py runs it once per change of Static/.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import posixpath
+import re
+import sys
+import tempfile
+from typing import Dict, List, Optional, Tuple
+
+from composite import composite
+from pngopt import optimize_png
+from tiles import TileError, decode_rgba, encode_png
+
+try:
+    import brotli
+except ImportError:  # optional; gzip alone still covers every browser
+    brotli = None
+
+MANIFEST = "manifest.json"
+_VERSION = 1  # bump when the output for unchanged sources changes
+
+THUMB_PX = 88  # palette thumbnails are 44 css px (styles.css .stamp-thumb); 2x for HiDPI
+_ATLAS_WIDTH = 8 * THUMB_PX
+_HASH_LEN = 10
+_COMPRESSIBLE = {".js", ".mjs", ".css", ".html", ".svg", ".json", ".txt", ".map"}
+_STAMP_DIR = "stamps"  # compared case-insensitively
+
+# Module specifiers and root-relative URLs worth rewriting
+_IMPORT_RE = re.compile(r"""(\b(?:from|import)\s*\(?\s*)(["'])(\.{1,2}/[^"'\s]+)\2""")
+_STATIC_RE = re.compile(r"""(["'])/static/([^"'\s?#]+)""")
+_CSS_URL_RE = re.compile(r"""(url\()/static/([^"'()\s?#]+)""")
+
+
+def _commented(text: str, pos: int) -> bool:
+    """Whether pos is on a // or block-comment line (usage examples mention imports too)."""
+    line = text[text.rfind("\n", 0, pos) + 1:pos].lstrip()
+    return line.startswith(("//", "/*", "*"))
+
+
+class AssetError(Exception):
+    """Static/ can't be built (e.g. an import cycle)."""
+
+
+def source_files(src_dir: str) -> List[str]:
+    """Every file under src_dir as a "/"-separated relative path, dot-files skipped."""
+    out = []
+    for root, dirs, files in os.walk(src_dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        for name in sorted(files):
+            if not name.startswith("."):
+                out.append(os.path.relpath(os.path.join(root, name), src_dir).replace(os.sep, "/"))
+    return out
+
+
+def signature(src_dir: str, atlas: bool = False) -> str:
+    """Cheap fingerprint of src_dir (paths, sizes, mtimes) and the build options."""
+    h = hashlib.sha256(f"v{_VERSION} atlas={int(atlas)} brotli={int(brotli is not None)}".encode())
+    for rel in source_files(src_dir):
+        st = os.stat(os.path.join(src_dir, rel))
+        h.update(f"\0{rel}\0{st.st_size}\0{st.st_mtime_ns}".encode())
+    return h.hexdigest()
+
+
+def hashed_name(rel: str, data: bytes, tag: str = "") -> str:
+    stem, ext = posixpath.splitext(rel)
+    return f"{stem}{tag}.{hashlib.sha256(data).hexdigest()[:_HASH_LEN]}{ext}"
+
+
+def _is_stamp(rel: str) -> bool:
+    parts = rel.lower().split("/")
+    return len(parts) > 1 and parts[-2] == _STAMP_DIR and rel.lower().endswith(".png")
+
+
+def _stamp_variants(data: bytes) -> Tuple[bytes, bytes]:
+    """(recompressed original, thumbnail); the input twice if it can't be decoded."""
+    try:
+        width, height, _ = decode_rgba(data)
+        opt = optimize_png(data, trim=False)
+        full = opt.data if opt is not None else data
+        if max(width, height) <= THUMB_PX:
+            return full, full
+        thumb = composite(width, height, [[(0, 0, data)]], size=THUMB_PX, level=9)
+        opt = optimize_png(thumb, trim=False)
+        return full, opt.data if opt is not None else thumb
+    except TileError:
+        return data, data
+
+
+def _atlas(thumbs: Dict[str, bytes]) -> Tuple[bytes, int, int, Dict[str, List[int]]]:
+    """Thumbnails packed into rows ("shelves") of one PNG: (png, width, height, {key: [x, y, w, h]})."""
+    placed = []
+    x = y = shelf = width = 0
+    for key, data in thumbs.items():
+        w, h, rows = decode_rgba(data)
+        if x and x + w > _ATLAS_WIDTH:
+            x, y, shelf = 0, y + shelf + 2, 0
+        placed.append((key, x, y, w, h, rows))
+        x += w + 2  # gap, so scaled-down cells don't bleed into each other
+        shelf = max(shelf, h)
+        width = max(width, x - 2)
+    height = y + shelf
+    canvas = [bytearray(width * 4) for _ in range(height)]
+    cells = {}
+    for key, cx, cy, w, h, rows in placed:
+        for r, row in enumerate(rows):
+            canvas[cy + r][cx * 4:(cx + w) * 4] = row
+        cells[key] = [cx, cy, w, h]
+    png = encode_png(width, height, [bytes(r) for r in canvas], 9)
+    opt = optimize_png(png, trim=False)
+    return (opt.data if opt is not None else png), width, height, cells
+
+
+def _compressed(data: bytes) -> Dict[str, bytes]:
+    """Precompressed variants by Content-Encoding, only those that are smaller."""
+    out = {}
+    gz = gzip.compress(data, 9, mtime=0)
+    if len(gz) < len(data):
+        out["gzip"] = gz
+    if brotli is not None:
+        br = brotli.compress(data, quality=11)
+        if len(br) < len(data):
+            out["br"] = br
+    return out
+
+
+_SUFFIX = {"gzip": ".gz", "br": ".br"}
+
+
+def encoded_path(rel: str, encoding: str) -> str:
+    return rel + _SUFFIX[encoding]
+
+
+def build(src_dir: str, out_dir: str, atlas: bool = False) -> dict:
+    """Build src_dir into out_dir and return the manifest (also written to out_dir)."""
+    sig = signature(src_dir, atlas)
+    rels = source_files(src_dir)
+    by_lower = {rel.lower(): rel for rel in rels}
+    outputs: Dict[str, bytes] = {}
+    files: Dict[str, str] = {}
+    thumbs: Dict[str, str] = {}
+    thumb_data: Dict[str, bytes] = {}
+
+    def emit(rel: str, data: bytes, tag: str = "") -> str:
+        name = hashed_name(rel, data, tag)
+        outputs[name] = data
+        return name
+
+    def read(rel: str) -> bytes:
+        with open(os.path.join(src_dir, rel), "rb") as f:
+            return f.read()
+
+    def deps(rel: str, text: str) -> List[str]:
+        found = []
+        base = posixpath.dirname(rel)
+        for m in _IMPORT_RE.finditer(text):
+            if not _commented(text, m.start()):
+                found.append(posixpath.normpath(posixpath.join(base, m.group(3))))
+        for m in (*_STATIC_RE.finditer(text), *_CSS_URL_RE.finditer(text)):
+            if not _commented(text, m.start()):
+                found.append(by_lower.get(m.group(2).lower(), m.group(2)))
+        return [d for d in found if d in text_rels]
+
+    text_rels = {rel for rel in rels if posixpath.splitext(rel)[1].lower() in _COMPRESSIBLE}
+
+    # Binary files first: they reference nothing
+    for rel in rels:
+        if rel in text_rels:
+            continue
+        data = read(rel)
+        if _is_stamp(rel):
+            data, thumb = _stamp_variants(data)
+            thumbs[rel] = emit(rel, thumb, ".thumb")
+            thumb_data[rel] = thumb
+        files[rel] = emit(rel, data)
+
+    # Text files, each after everything it references
+    sources = {rel: read(rel).decode("utf-8") for rel in text_rels}
+    state: Dict[str, int] = {}  # 1 = in progress, 2 = done
+
+    def visit(rel: str, chain: Tuple[str, ...]):
+        if state.get(rel) == 2:
+            return
+        if state.get(rel) == 1:
+            raise AssetError("import cycle: " + " -> ".join(chain[chain.index(rel):] + (rel,)))
+        state[rel] = 1
+        for dep in deps(rel, sources[rel]):
+            visit(dep, chain + (rel,))
+        files[rel] = emit(rel, _rewrite(rel, sources[rel], files, by_lower).encode("utf-8"))
+        state[rel] = 2
+
+    for rel in sorted(text_rels):
+        visit(rel, ())
+
+    manifest = {"version": _VERSION, "signature": sig, "files": files, "thumbs": thumbs, "encodings": {}}
+    if atlas and thumb_data:
+        png, w, h, cells = _atlas(thumb_data)
+        manifest["atlas"] = {"file": emit(f"{posixpath.dirname(next(iter(thumb_data)))}/atlas.png", png),
+                             "width": w, "height": h, "cells": cells}
+
+    for name, data in list(outputs.items()):
+        if posixpath.splitext(name)[1].lower() in _COMPRESSIBLE:
+            variants = _compressed(data)
+            for enc, blob in variants.items():
+                outputs[encoded_path(name, enc)] = blob
+            if variants:
+                manifest["encodings"][name] = sorted(variants)
+
+    previous = load_manifest(out_dir)
+    for name, data in outputs.items():
+        path = os.path.join(out_dir, name)
+        if not os.path.exists(path):  # hashed names: same name, same bytes
+            _write_atomic(path, data)
+    _write_atomic(os.path.join(out_dir, MANIFEST), json.dumps(manifest, indent=1, sort_keys=True).encode())
+    # Keep the previous build too: pages rendered before this one still point at it
+    _prune(out_dir, set(outputs) | _outputs_of(previous))
+    return manifest
+
+
+def _rewrite(rel: str, text: str, files: Dict[str, str], by_lower: Dict[str, str]) -> str:
+    base = posixpath.dirname(rel)
+
+    def relative(m):
+        target = posixpath.normpath(posixpath.join(base, m.group(3)))
+        if target not in files or _commented(m.string, m.start()):
+            return m.group(0)
+        spec = posixpath.relpath(files[target], base or ".")
+        if not spec.startswith("../"):
+            spec = "./" + spec
+        return f"{m.group(1)}{m.group(2)}{spec}{m.group(2)}"
+
+    def rooted(m):
+        target = by_lower.get(m.group(2).lower())
+        if target is None or target not in files or _commented(m.string, m.start()):
+            return m.group(0)
+        return f"{m.group(1)}/static/{files[target]}"
+
+    text = _IMPORT_RE.sub(relative, text)
+    return _CSS_URL_RE.sub(rooted, _STATIC_RE.sub(rooted, text))
+
+
+def _outputs_of(manifest: Optional[dict]) -> set:
+    if not manifest:
+        return set()
+    names = set(manifest.get("files", {}).values()) | set(manifest.get("thumbs", {}).values())
+    if "atlas" in manifest:
+        names.add(manifest["atlas"]["file"])
+    for name, encs in manifest.get("encodings", {}).items():
+        names.update(encoded_path(name, enc) for enc in encs)
+    return names
+
+
+def _prune(out_dir: str, keep: set):
+    for rel in source_files(out_dir):
+        if rel != MANIFEST and rel not in keep:
+            try:
+                os.remove(os.path.join(out_dir, rel))
+            except OSError:
+                pass
+
+
+def _write_atomic(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def load_manifest(out_dir: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(out_dir, MANIFEST), "rb") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if isinstance(manifest, dict) and manifest.get("version") == _VERSION else None
+
+
+def current_manifest(src_dir: str, out_dir: str, atlas: bool = False) -> Optional[dict]:
+    """The manifest in out_dir if it was built from src_dir as it is now, else None."""
+    manifest = load_manifest(out_dir)
+    if manifest is not None and manifest.get("signature") == signature(src_dir, atlas):
+        return manifest
+    return None
+
+
+def load_or_build(src_dir: str, out_dir: str, atlas: bool = False) -> dict:
+    return current_manifest(src_dir, out_dir, atlas) or build(src_dir, out_dir, atlas)
+
+
+def main(argv=None) -> int:
+    root = os.path.dirname(os.path.abspath(__file__))
+    p = argparse.ArgumentParser(prog="python -m assets", description=__doc__.split("\n\n")[0].strip())
+    sub = p.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="build Static/ into the asset dir")
+    b.add_argument("--src", default=os.path.join(root, "Static"))
+    b.add_argument("--out", default=os.getenv("ASSET_DIR", "").strip() or os.path.join(root, ".cache", "assets"))
+    b.add_argument("--atlas", action="store_true", default=os.getenv("STAMP_ATLAS", "").strip() == "1",
+                   help="also pack stamp thumbnails into a sprite sheet (STAMP_ATLAS=1)")
+    args = p.parse_args(argv)
+
+    try:
+        manifest = build(args.src, args.out, args.atlas)
+    except AssetError as e:
+        print(f"assets: {e}", file=sys.stderr)
+        return 1
+    before = sum(os.path.getsize(os.path.join(args.src, rel)) for rel in manifest["files"])
+    after = sum(os.path.getsize(os.path.join(args.out, name)) for name in manifest["files"].values())
+    print(f"{len(manifest['files'])} files, {before / 1024:.0f} KB -> {after / 1024:.0f} KB "
+          f"(+{len(manifest['thumbs'])} thumbnails) in {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
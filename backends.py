@@ -0,0 +1,786 @@
+"""
+Where designs, layer rows and blobs (layer PNGs, stamp assets) are stored.
+
+app.py talks to one Backend and never to Supabase or SQLite directly:
+  SupabaseBackend  PostgREST + Storage over HTTPS (the default)
+  LocalBackend     SQLite (WAL) for rows, a plain directory tree for blobs
+
+Rows are plain dicts with the Supabase column names, so everything above
+this layer (caches, payloads, the save queue) is backend-agnostic. Failures
+raise BackendError with the upstream status when there is one.
+"""
+import json
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import IO, Callable, Iterator, List, Optional, Tuple, Union
+
+import requests
+
+
+class BackendError(RuntimeError):
+    def __init__(self, status: Optional[int], details: str, op: str = "backend call"):
+        super().__init__(f"{op} failed: {status} {details}")
+        self.status = status
+        self.details = details
+
+
+class CircuitOpen(BackendError):
+    """Raised instead of calling upstream while the circuit breaker is open."""
+
+    def __init__(self, retry_after_s: float):
+        super().__init__(503, "upstream marked unhealthy, not calling it", "circuit breaker")
+        self.retry_after_s = retry_after_s
+
+
+# ============================================================
+# Upstream resilience: jittered retries + circuit breaker
+# ============================================================
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter: sleep U(0, min(cap, base * 2**n)).
+
+    With deadline_s, one logical call (every attempt and pause) is bounded:
+    each attempt's timeouts are cut to the time left, and no retry starts
+    unless at least min_attempt_s would remain after the pause. The read
+    timeout is per socket read, so a body that keeps trickling in can still
+    run over.
+    """
+
+    # 5xx from a proxy or an overloaded PostgREST, and rate limiting
+    RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+    def __init__(self, attempts: int = 3, base_s: float = 0.1, cap_s: float = 2.0,
+                 deadline_s: Optional[float] = None, min_attempt_s: float = 0.5):
+        self.attempts = max(1, int(attempts))
+        self.base_s = base_s
+        self.cap_s = cap_s
+        self.deadline_s = deadline_s if deadline_s and deadline_s > 0 else None
+        self.min_attempt_s = min_attempt_s
+
+    def delay(self, attempt: int) -> float:
+        return random.uniform(0.0, min(self.cap_s, self.base_s * (2 ** attempt)))
+
+    def deadline(self) -> Optional[float]:
+        """monotonic() time a call starting now has to finish by (None: unbounded)."""
+        return time.monotonic() + self.deadline_s if self.deadline_s else None
+
+    def timeout(self, timeout, deadline: Optional[float]):
+        """requests timeout(s) cut down to what's left before deadline."""
+        if deadline is None:
+            return timeout
+        left = max(0.05, deadline - time.monotonic())
+        if isinstance(timeout, tuple):
+            return tuple(left if t is None else min(t, left) for t in timeout)
+        return left if timeout is None else min(timeout, left)
+
+    def time_for_another(self, deadline: Optional[float], pause: float) -> bool:
+        return deadline is None or deadline - time.monotonic() - pause >= self.min_attempt_s
+
+
+class CircuitBreaker:
+    """
+    closed     calls go through; `failures` consecutive failures open it
+    open       calls raise CircuitOpen right away for `reset_s` seconds
+    half-open  one trial call goes through: success closes, failure re-opens
+
+    Only transport errors and 5xx count as failures; a 404 is an answer.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failures: int = 5, reset_s: float = 15.0):
+        self.threshold = max(1, int(failures))
+        self.reset_s = float(reset_s)
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+
+        self.opened = 0          # closed/half-open -> open transitions
+        self.short_circuited = 0  # calls refused while open
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def before(self):
+        """Call before each upstream attempt; raises CircuitOpen to fail fast."""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return
+            waited = time.monotonic() - self._opened_at
+            if self._state == self.OPEN and waited >= self.reset_s:
+                self._state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self._state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+            self.short_circuited += 1
+            raise CircuitOpen(max(0.0, self.reset_s - waited))
+
+    def success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def release(self):
+        """The call ended without saying anything about upstream health."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or (
+                self._state == self.CLOSED and self._failures >= self.threshold
+            ):
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+                self.opened += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "state": self._state,
+                "consecutive_failures": self._failures,
+                "opened": self.opened,
+                "short_circuited": self.short_circuited,
+            }
+
+
+class BlobStream:
+    """An open blob: iterate for chunks as they arrive, then close()."""
+
+    def __init__(self, chunks: Iterator[bytes], length: Optional[int], close: Callable[[], None]):
+        self._chunks = chunks
+        self.length = length
+        self._close = close
+
+    def __iter__(self) -> Iterator[bytes]:
+        return self._chunks
+
+    def close(self):
+        self._close()
+
+
+BlobData = Union[bytes, IO[bytes]]
+_CHUNK = 64 * 1024
+
+
+def _untimed(op: str, fn):
+    # Backends report every upstream call as timed(op, fn). op is a short,
+    # fixed label ("REST GET designs", "STORAGE PUT") - never ids or paths,
+    # since app.py uses it as a metrics label.
+    return fn()
+
+
+class Backend(ABC):
+    """
+    Storage interface used by app.py.
+
+    Design rows: id, name, updated_at (ISO 8601), stamps_json (list).
+    Layer rows:  design_id, layer_index, name, visible, png_path, png_hash,
+                 tiles_json (tile manifest dict for tiled layers, else None),
+                 offset_x, offset_y (where a trimmed layer PNG goes, else 0),
+                 canvas_width, canvas_height (the layer's size before it was
+                 trimmed, else None).
+    Blob paths are bucket-relative, e.g. layers/<design_id>/<sha1>.png.
+    A backend missing any of the abstract methods can't be constructed.
+    """
+
+    name = "base"
+
+    # ---------- designs ----------
+    @abstractmethod
+    def list_designs(self) -> List[dict]:
+        """[{id, name, updated_at}], newest first."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def create_design(self, name: str, updated_at: str) -> dict:
+        """Insert a design with no stamps; returns {id, name, updated_at}."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_design(self, design_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_design(self, design_id: str, fields: dict):
+        """Set any of name / stamps_json / updated_at."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_design_rows(self, design_ids: List[str]):
+        """Delete the designs and their layer rows (not their blobs)."""
+        raise NotImplementedError
+
+    # ---------- layers ----------
+    @abstractmethod
+    def get_layers(self, design_id: str) -> List[dict]:
+        """Layer rows of one design (without design_id), by layer_index."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def layer_refs(self, design_ids: List[str]) -> List[dict]:
+        """{design_id, png_path, tiles_json} for every layer row of these designs."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def upsert_layers(self, rows: List[dict]):
+        raise NotImplementedError
+
+    # ---------- blobs ----------
+    @abstractmethod
+    def get_blob(self, path: str) -> bytes:
+        raise NotImplementedError
+
+    @abstractmethod
+    def open_blob(self, path: str) -> BlobStream:
+        raise NotImplementedError
+
+    @abstractmethod
+    def put_blob(self, path: str, data: BlobData, content_type: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_blobs(self, paths: List[str]) -> List[str]:
+        """Remove blobs; returns the paths that existed and are now gone."""
+        raise NotImplementedError
+
+    def describe(self) -> dict:
+        return {"name": self.name}
+
+    def health(self) -> dict:
+        """Retry / circuit breaker counters (empty for backends without them)."""
+        return {}
+
+
+# ============================================================
+# Supabase (PostgREST + Storage)
+# ============================================================
+def pg_in(values) -> str:
+    """PostgREST `in.(...)` filter with every value quoted."""
+    quoted = []
+    for v in values:
+        v = str(v).replace("\\", "\\\\").replace('"', '\\"')
+        quoted.append(f'"{v}"')
+    return f"in.({','.join(quoted)})"
+
+
+def iter_response(r: requests.Response, chunk_size: int = _CHUNK) -> Iterator[bytes]:
+    """Body chunks as they arrive; iter_content() blocks until a full chunk is read."""
+    read1 = getattr(r.raw, "read1", None)  # urllib3 >= 2
+    if read1 is None:
+        yield from r.iter_content(chunk_size=chunk_size)
+        return
+    while True:
+        chunk = read1(chunk_size, decode_content=True)
+        if not chunk:
+            return
+        yield chunk
+
+
+class SupabaseBackend(Backend):
+    """
+    Supabase over one shared requests.Session.
+
+    URL and service key are only checked when first used, so the app can
+    start (and serve static files) before .env is filled in.
+
+    Every HTTP call goes through _send(): idempotent calls (everything but
+    creating a design) are retried with jittered backoff on transport
+    errors and 429/5xx, and a circuit breaker fails calls fast once
+    Supabase keeps failing.
+    """
+
+    name = "supabase"
+
+    def __init__(self, url: str, service_key: str, bucket: str,
+                 session: Optional[requests.Session] = None, timed=_untimed,
+                 timeout: Tuple[float, float] = (5, 25),
+                 retry: Optional[RetryPolicy] = None,
+                 breaker: Optional[CircuitBreaker] = None):
+        self._url = (url or "").strip()
+        self._key = (service_key or "").strip()
+        self.bucket = (bucket or "ShieldBucket").strip()
+        self.session = session or requests.Session()
+        self._timed = timed
+        self.timeout = timeout
+        self.retry = retry or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self.retries = 0
+        self._retries_lock = threading.Lock()
+        self._json_headers: Optional[dict] = None
+        self._storage_headers: dict = {}
+
+    # ---------- plumbing ----------
+    def _base(self) -> str:
+        if not self._url.startswith("http"):
+            raise RuntimeError("SUPABASE_URL missing/invalid in .env")
+        return self._url
+
+    def _service_key(self) -> str:
+        if not self._key:
+            raise RuntimeError("SUPABASE_SERVICE_ROLE_KEY missing in .env (server-only key)")
+        return self._key
+
+    def headers_json(self) -> dict:
+        if self._json_headers is None:
+            key = self._service_key()
+            self._json_headers = {
+                "apikey": key,
+                "Authorization": f"Bearer {key}",
+                "Content-Type": "application/json",
+            }
+        return self._json_headers
+
+    def headers_storage(self, content_type: str = "application/octet-stream") -> dict:
+        # Cached per content type
+        h = self._storage_headers.get(content_type)
+        if h is None:
+            key = self._service_key()
+            h = self._storage_headers[content_type] = {
+                "apikey": key,
+                "Authorization": f"Bearer {key}",
+                "Content-Type": content_type,
+                "x-upsert": "true",
+            }
+        return h
+
+    def rest_url(self, path: str) -> str:
+        return f"{self._base()}/rest/v1/{path.lstrip('/')}"
+
+    def object_url(self, object_path: str) -> str:
+        return f"{self._base()}/storage/v1/object/{self.bucket}/{object_path}"
+
+    def _send(self, method: str, url: str, idempotent: bool = True, **kwargs) -> requests.Response:
+        """
+        One logical upstream call. Returns the final response (which may still
+        be an error the caller turns into BackendError); raises BackendError
+        when no response came back, CircuitOpen when the breaker refuses.
+        """
+        body = kwargs.get("data")
+        rewind = getattr(body, "seek", None)
+        attempts = self.retry.attempts if idempotent else 1
+        if body is not None and not isinstance(body, (bytes, str)) and rewind is None:
+            attempts = 1  # a one-shot stream can't be sent twice
+
+        deadline = self.retry.deadline()
+        for attempt in range(attempts):
+            self.breaker.before()
+            if attempt and rewind is not None:
+                rewind(0)
+            r, error = None, None
+            try:
+                r = self.session.request(method, url, timeout=self.retry.timeout(self.timeout, deadline), **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.breaker.failure()
+                error = e
+            except BaseException:
+                self.breaker.release()
+                raise
+            else:
+                if r.status_code >= 500:
+                    self.breaker.failure()
+                else:
+                    self.breaker.success()
+                if r.status_code not in self.retry.RETRY_STATUSES:
+                    return r
+            pause = self.retry.delay(attempt)
+            if attempt + 1 == attempts or not self.retry.time_for_another(deadline, pause):
+                if r is not None:
+                    return r
+                raise BackendError(None, str(error), f"Supabase {method}") from None
+            if r is not None:
+                r.close()
+            with self._retries_lock:
+                self.retries += 1
+            time.sleep(pause)
+        raise AssertionError("unreachable")
+
+    def _rest(self, method: str, path: str, params=None, payload=None, prefer: Optional[str] = None):
+        def _do():
+            headers = self.headers_json()
+            if prefer:
+                headers = dict(headers, Prefer=prefer)
+            r = self._send(
+                method,
+                self.rest_url(path),
+                # A retried insert could create the design twice
+                idempotent=not (method == "POST" and path == "designs"),
+                headers=headers,
+                params=params,
+                data=json.dumps(payload) if payload is not None else None,
+            )
+            if not r.ok:
+                raise BackendError(r.status_code, r.text, f"Supabase REST {method}")
+            return r.json() if method == "GET" or (prefer or "").endswith("representation") else None
+        return self._timed(f"REST {method} {path}", _do)
+
+    # ---------- designs ----------
+    def list_designs(self) -> List[dict]:
+        return self._rest("GET", "designs", params={"select": "id,name,updated_at", "order": "updated_at.desc"})
+
+    def create_design(self, name: str, updated_at: str) -> dict:
+        rows = self._rest(
+            "POST", "designs",
+            payload={"name": name, "stamps_json": [], "updated_at": updated_at},
+            prefer="return=representation",
+        )
+        if not rows:
+            raise BackendError(None, "no row returned", "Supabase REST POST")
+        return rows[0]
+
+    def get_design(self, design_id: str) -> Optional[dict]:
+        rows = self._rest(
+            "GET", "designs",
+            params={"select": "id,name,updated_at,stamps_json", "id": f"eq.{design_id}"},
+        )
+        return rows[0] if rows else None
+
+    def update_design(self, design_id: str, fields: dict):
+        self._rest("PATCH", "designs", params={"id": f"eq.{design_id}"}, payload=fields, prefer="return=minimal")
+
+    def delete_design_rows(self, design_ids: List[str]):
+        self._rest("DELETE", "layers", params={"design_id": pg_in(design_ids)}, prefer="return=minimal")
+        self._rest("DELETE", "designs", params={"id": pg_in(design_ids)}, prefer="return=minimal")
+
+    # ---------- layers ----------
+    def get_layers(self, design_id: str) -> List[dict]:
+        return self._rest(
+            "GET", "layers",
+            params={
+                "select": "layer_index,name,visible,png_path,png_hash,tiles_json,offset_x,offset_y,"
+                          "canvas_width,canvas_height",
+                "design_id": f"eq.{design_id}",
+                "order": "layer_index.asc",
+            },
+        ) or []
+
+    def layer_refs(self, design_ids: List[str]) -> List[dict]:
+        return self._rest(
+            "GET", "layers",
+            params={"select": "design_id,png_path,tiles_json", "design_id": pg_in(design_ids)},
+        ) or []
+
+    def upsert_layers(self, rows: List[dict]):
+        self._rest(
+            "POST", "layers",
+            params={"on_conflict": "design_id,layer_index"},
+            payload=rows,
+            prefer="resolution=merge-duplicates,return=minimal",
+        )
+
+    # ---------- blobs ----------
+    def _get(self, path: str, stream: bool) -> requests.Response:
+        def _do():
+            r = self._send(
+                "GET",
+                self.object_url(path),
+                headers=self.headers_storage(),
+                stream=stream,
+            )
+            if not r.ok:
+                text = r.text
+                r.close()
+                raise BackendError(r.status_code, text, "Supabase Storage GET")
+            return r
+        return self._timed("STORAGE GET", _do)
+
+    def get_blob(self, path: str) -> bytes:
+        return self._get(path, stream=False).content
+
+    def open_blob(self, path: str) -> BlobStream:
+        r = self._get(path, stream=True)
+        length = r.headers.get("Content-Length")
+        if r.headers.get("Content-Encoding"):
+            length = None  # decoded size differs from the header
+        return BlobStream(iter_response(r), int(length) if length else None, r.close)
+
+    def put_blob(self, path: str, data: BlobData, content_type: str):
+        def _do():
+            # x-upsert + content-addressed paths make re-sending harmless
+            r = self._send(
+                "PUT",
+                self.object_url(path),
+                headers=self.headers_storage(content_type),
+                data=data,
+            )
+            if not r.ok:
+                raise BackendError(r.status_code, r.text, "Supabase Storage PUT")
+        self._timed("STORAGE PUT", _do)
+
+    def delete_blobs(self, paths: List[str]) -> List[str]:
+        """Bulk remove, one request per 1000 paths."""
+        removed: List[str] = []
+        for i in range(0, len(paths), 1000):
+            chunk = paths[i:i + 1000]
+
+            def _do():
+                key = self._service_key()
+                r = self._send(
+                    "DELETE",
+                    f"{self._base()}/storage/v1/object/{self.bucket}",
+                    headers={"apikey": key, "Authorization": f"Bearer {key}", "Content-Type": "application/json"},
+                    data=json.dumps({"prefixes": chunk}),
+                )
+                if not r.ok:
+                    raise BackendError(r.status_code, r.text, "Supabase Storage bulk DELETE")
+                return r
+            r = self._timed("STORAGE DELETE", _do)
+            removed.extend(o.get("name") for o in (r.json() or []) if isinstance(o, dict))
+        return removed
+
+    def describe(self) -> dict:
+        return {"name": self.name, "bucket": self.bucket}
+
+    def health(self) -> dict:
+        return dict(self.breaker.stats(), retries=self.retries)
+
+
+# ============================================================
+# Local (SQLite + filesystem)
+# ============================================================
+_SCHEMA = """
+create table if not exists designs (
+    id          text primary key,
+    name        text not null,
+    stamps_json text not null default '[]',
+    updated_at  text not null
+);
+create index if not exists designs_updated_at on designs (updated_at desc);
+create table if not exists layers (
+    design_id   text not null references designs (id) on delete cascade,
+    layer_index integer not null,
+    name        text,
+    visible     integer not null default 1,
+    png_path    text,
+    png_hash    text,
+    tiles_json  text,
+    offset_x    integer not null default 0,
+    offset_y    integer not null default 0,
+    canvas_width  integer,
+    canvas_height integer,
+    primary key (design_id, layer_index)
+);
+"""
+
+_DESIGN_COLUMNS = ("name", "stamps_json", "updated_at")
+
+
+class LocalBackend(Backend):
+    """
+    Everything on this machine: <root>/shield.db and <root>/blobs/<path>.
+
+    WAL mode lets loads run while a save commits. Each thread gets its own
+    connection; statements are short, so there is no pool to tune.
+    """
+
+    name = "local"
+
+    def __init__(self, root: str, timed=_untimed):
+        self.root = os.path.abspath(root)
+        self.db_path = os.path.join(self.root, "shield.db")
+        self._blobs = os.path.join(self.root, "blobs")
+        os.makedirs(self._blobs, exist_ok=True)
+        self._timed = timed
+        self._local = threading.local()
+        with self._db() as db:
+            db.executescript(_SCHEMA)
+            # Databases created before tiled layers
+            cols = {r["name"] for r in db.execute("pragma table_info(layers)")}
+            if "tiles_json" not in cols:
+                db.execute("alter table layers add column tiles_json text")
+            # ...and before trimmed (optimized) layers
+            for col in ("offset_x", "offset_y"):
+                if col not in cols:
+                    db.execute(f"alter table layers add column {col} integer not null default 0")
+            for col in ("canvas_width", "canvas_height"):
+                if col not in cols:
+                    db.execute(f"alter table layers add column {col} integer")
+
+    # ---------- plumbing ----------
+    def _db(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            db.row_factory = sqlite3.Row
+            db.execute("pragma journal_mode=wal")
+            db.execute("pragma synchronous=normal")
+            db.execute("pragma foreign_keys=on")
+            self._local.db = db
+        return db
+
+    def _query(self, label: str, sql: str, args=()) -> List[dict]:
+        def _do():
+            try:
+                return [dict(r) for r in self._db().execute(sql, args).fetchall()]
+            except sqlite3.Error as e:
+                raise BackendError(None, str(e), f"SQLite {label}") from None
+        return self._timed(f"SQLITE {label}", _do)
+
+    def _write(self, label: str, statements: List[Tuple[str, tuple]]):
+        """Run statements in one transaction."""
+        def _do():
+            db = self._db()
+            try:
+                db.execute("begin immediate")
+                for sql, args in statements:
+                    db.execute(sql, args)
+                db.execute("commit")
+            except sqlite3.Error as e:
+                if db.in_transaction:
+                    db.execute("rollback")
+                raise BackendError(None, str(e), f"SQLite {label}") from None
+        return self._timed(f"SQLITE {label}", _do)
+
+    def blob_file(self, path: str) -> str:
+        """Filesystem path of a blob; rejects anything that would escape the blob dir."""
+        parts = [p for p in str(path).replace("\\", "/").split("/") if p]
+        if not parts or any(p in (".", "..") for p in parts):
+            raise BackendError(400, f"invalid blob path {path!r}", "local blob")
+        return os.path.join(self._blobs, *parts)
+
+    # ---------- designs ----------
+    def list_designs(self) -> List[dict]:
+        return self._query("list designs", "select id, name, updated_at from designs order by updated_at desc")
+
+    def create_design(self, name: str, updated_at: str) -> dict:
+        row = {"id": str(uuid.uuid4()), "name": name, "updated_at": updated_at}
+        self._write("create design", [(
+            "insert into designs (id, name, stamps_json, updated_at) values (?, ?, '[]', ?)",
+            (row["id"], name, updated_at),
+        )])
+        return row
+
+    def get_design(self, design_id: str) -> Optional[dict]:
+        rows = self._query(
+            "get design",
+            "select id, name, updated_at, stamps_json from designs where id = ?",
+            (design_id,),
+        )
+        if not rows:
+            return None
+        row = rows[0]
+        row["stamps_json"] = json.loads(row["stamps_json"] or "[]")
+        return row
+
+    def update_design(self, design_id: str, fields: dict):
+        cols = [c for c in _DESIGN_COLUMNS if c in fields]
+        if not cols:
+            return
+        args = [json.dumps(fields[c]) if c == "stamps_json" else fields[c] for c in cols]
+        self._write("update design", [(
+            f"update designs set {', '.join(c + ' = ?' for c in cols)} where id = ?",
+            (*args, design_id),
+        )])
+
+    def delete_design_rows(self, design_ids: List[str]):
+        marks = ",".join("?" * len(design_ids))
+        self._write("delete designs", [
+            (f"delete from layers where design_id in ({marks})", tuple(design_ids)),
+            (f"delete from designs where id in ({marks})", tuple(design_ids)),
+        ])
+
+    # ---------- layers ----------
+    def get_layers(self, design_id: str) -> List[dict]:
+        rows = self._query(
+            "get layers",
+            "select layer_index, name, visible, png_path, png_hash, tiles_json, offset_x, offset_y, "
+            "canvas_width, canvas_height from layers "
+            "where design_id = ? order by layer_index",
+            (design_id,),
+        )
+        for r in rows:
+            r["visible"] = bool(r["visible"])
+            r["tiles_json"] = json.loads(r["tiles_json"]) if r["tiles_json"] else None
+        return rows
+
+    def layer_refs(self, design_ids: List[str]) -> List[dict]:
+        rows = self._query(
+            "layer refs",
+            "select design_id, png_path, tiles_json from layers "
+            f"where design_id in ({','.join('?' * len(design_ids))})",
+            tuple(design_ids),
+        )
+        for r in rows:
+            r["tiles_json"] = json.loads(r["tiles_json"]) if r["tiles_json"] else None
+        return rows
+
+    def upsert_layers(self, rows: List[dict]):
+        sql = (
+            "insert into layers (design_id, layer_index, name, visible, png_path, png_hash, tiles_json, "
+            "offset_x, offset_y, canvas_width, canvas_height) values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "on conflict (design_id, layer_index) do update set "
+            "name = excluded.name, visible = excluded.visible, "
+            "png_path = excluded.png_path, png_hash = excluded.png_hash, tiles_json = excluded.tiles_json, "
+            "offset_x = excluded.offset_x, offset_y = excluded.offset_y, "
+            "canvas_width = excluded.canvas_width, canvas_height = excluded.canvas_height"
+        )
+        self._write("upsert layers", [
+            (sql, (r["design_id"], int(r["layer_index"]), r.get("name"), 1 if r.get("visible", True) else 0,
+                   r.get("png_path"), r.get("png_hash"),
+                   json.dumps(r["tiles_json"]) if r.get("tiles_json") else None,
+                   int(r.get("offset_x") or 0), int(r.get("offset_y") or 0),
+                   r.get("canvas_width"), r.get("canvas_height")))
+            for r in rows
+        ])
+
+    # ---------- blobs ----------
+    def get_blob(self, path: str) -> bytes:
+        try:
+            with open(self.blob_file(path), "rb") as fh:
+                return fh.read()
+        except FileNotFoundError:
+            raise BackendError(404, "Object not found", "local blob GET") from None
+
+    def open_blob(self, path: str) -> BlobStream:
+        try:
+            fh = open(self.blob_file(path), "rb")
+        except FileNotFoundError:
+            raise BackendError(404, "Object not found", "local blob GET") from None
+        length = os.fstat(fh.fileno()).st_size
+        return BlobStream(iter(lambda: fh.read(_CHUNK), b""), length, fh.close)
+
+    def put_blob(self, path: str, data: BlobData, content_type: str):
+        dest = self.blob_file(path)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dest), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                if isinstance(data, (bytes, bytearray, memoryview)):
+                    fh.write(data)
+                else:
+                    shutil.copyfileobj(data, fh, _CHUNK)
+            os.replace(tmp, dest)
+        except OSError as e:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise BackendError(None, str(e), "local blob PUT") from None
+
+    def delete_blobs(self, paths: List[str]) -> List[str]:
+        removed = []
+        for p in paths:
+            try:
+                os.remove(self.blob_file(p))
+                removed.append(p)
+            except (OSError, BackendError):
+                pass
+        return removed
+
+    def describe(self) -> dict:
+        return {"name": self.name, "root": self.root}
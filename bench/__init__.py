@@ -0,0 +1 @@
+"""Server benchmarks: python -m bench run / python -m bench compare (see __main__.py)."""
@@ -0,0 +1,228 @@
+"""
+python -m bench run      [options]  -> JSON results (stdout or --out)
+python -m bench compare  OLD NEW    -> side-by-side table, exit 1 on regressions
+
+The server is imported in-process and served by waitress on a free port,
+pointed at a MockSupabase (or STORAGE_BACKEND=local). Caches, the local
+data dir and the save queue live in a throwaway temp dir, so runs never
+touch a real project and start from the same state.
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from bench import workloads  # noqa: E402
+from bench.mock_supabase import MockSupabase  # noqa: E402
+
+SCENARIOS = ("autosave", "projector", "list")
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=10,
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def cmd_run(args) -> int:
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        print(f"unknown scenario(s): {', '.join(sorted(unknown))}", file=sys.stderr)
+        return 2
+
+    work = tempfile.mkdtemp(prefix="shield-bench-")
+    mock = None
+    env = {
+        "STORAGE_BACKEND": args.backend,
+        "LOCAL_DATA_DIR": os.path.join(work, "data"),
+        "LAYER_DISK_CACHE_DIR": os.path.join(work, "layer_png"),
+        "SAVE_QUEUE_DIR": os.path.join(work, "save_queue"),
+        "ASSET_BUILD": "0",  # the scenarios are API-only; keep the build off the CPU
+    }
+    if args.backend == "supabase":
+        mock = MockSupabase(args.latency_ms, args.jitter_ms, args.bandwidth_mbps, args.seed).start()
+        env.update({"SUPABASE_URL": mock.url, "SUPABASE_SERVICE_ROLE_KEY": "bench", "SUPABASE_BUCKET": "bench"})
+    overrides = dict(kv.split("=", 1) for kv in args.env)
+    env.update(overrides)
+    os.environ.update(env)
+
+    quiet = contextlib.nullcontext()
+    if not args.verbose:
+        quiet = contextlib.redirect_stdout(open(os.devnull, "w"))
+        logging.getLogger("waitress.queue").setLevel(logging.ERROR)  # "Task queue depth is N"
+    with quiet:
+        import app as server  # noqa: E402  (reads the environment above at import)
+        from waitress import create_server
+
+        httpd = create_server(server.create_app(), host="127.0.0.1", port=0, threads=args.threads)
+        threading.Thread(target=httpd.run, name="bench-waitress", daemon=True).start()
+        client = workloads.Client(f"http://127.0.0.1:{httpd.effective_port}")
+
+        def after_saves():
+            if server._save_queue is None:
+                return None
+            t0 = time.perf_counter()
+            server._save_queue.drain(timeout=600)
+            return time.perf_counter() - t0
+
+        def make_cold(ids):
+            server._layer_png_cache.purge_designs(ids)
+            if server._layer_disk_cache is not None:
+                server._layer_disk_cache.purge_designs(ids)
+            for design_id in ids:
+                server._design_meta_cache.pop(design_id)
+
+        def seeded():
+            # Setup traffic (creating the designs a scenario reads) is not part of its counts
+            if mock is not None:
+                mock.reset_counts()
+
+        cfg = dict(vars(args), _created=[], _seeded=seeded)
+        results = {}
+        try:
+            for name in scenarios:
+                if mock is not None:
+                    mock.reset_counts()
+                print(f"bench: {name} ...", file=sys.stderr)
+                if name == "autosave":
+                    out = workloads.autosave_storm(client, cfg, after_saves)
+                elif name == "projector":
+                    out = workloads.projector_cold_open(client, cfg, make_cold)
+                else:
+                    out = workloads.list_polling(client, cfg)
+                if mock is not None:
+                    out["upstream_requests"] = mock.reset_counts()
+                results[name] = out
+            if cfg["_created"]:
+                out = workloads.cleanup(client, cfg)
+                if mock is not None:
+                    out["upstream_requests"] = mock.reset_counts()
+                results["cleanup"] = out
+        finally:
+            # waitress is left running on its daemon thread; closing it from
+            # here races its select loop, and the process is about to exit.
+            if mock is not None:
+                mock.stop()
+            shutil.rmtree(work, ignore_errors=True)
+
+    report = {
+        "schema": 1,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("func", "out", "verbose", "env")},
+        "env": overrides,
+        "scenarios": results,
+    }
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            fh.write(text + "\n")
+        print(f"bench: wrote {args.out}", file=sys.stderr)
+    else:
+        print(text)
+    return 0
+
+
+def _pct(old: float, new: float) -> str:
+    if not old:
+        return "   n/a"
+    return f"{(new - old) / old * 100:+6.1f}%"
+
+
+def cmd_compare(args) -> int:
+    with open(args.old, encoding="utf-8") as fh:
+        old = json.load(fh)
+    with open(args.new, encoding="utf-8") as fh:
+        new = json.load(fh)
+
+    regressions = []
+    header = f"{'scenario/op':34} {'metric':16} {'old':>10} {'new':>10} {'change':>8}"
+    print(header)
+    print("-" * len(header))
+    for scenario, new_sc in new.get("scenarios", {}).items():
+        old_sc = old.get("scenarios", {}).get(scenario)
+        if not old_sc:
+            continue
+        for op, n in new_sc.get("ops", {}).items():
+            o = old_sc.get("ops", {}).get(op)
+            if not o:
+                continue
+            for metric in ("p50_ms", "p95_ms", "p99_ms", "throughput_per_s"):
+                change = _pct(o[metric], n[metric])
+                flag = ""
+                if metric == "p95_ms" and o[metric] and (n[metric] - o[metric]) / o[metric] * 100 > args.threshold:
+                    flag = "  <-- slower"
+                    regressions.append(f"{scenario}/{op}")
+                print(f"{scenario + '/' + op:34} {metric:16} {o[metric]:10.2f} {n[metric]:10.2f} {change:>8}{flag}")
+            if n["errors"] != o["errors"]:
+                print(f"{scenario + '/' + op:34} {'errors':16} {o['errors']:10d} {n['errors']:10d}")
+    if regressions:
+        print(f"\np95 regressed more than {args.threshold:g}%: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(prog="python -m bench", description="ShieldDesigner server benchmarks")
+    sub = p.add_subparsers(dest="command", required=True)
+
+    r = sub.add_parser("run", help="run scenarios and print JSON results")
+    r.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma list of: " + ", ".join(SCENARIOS))
+    r.add_argument("--backend", choices=("supabase", "local"), default="supabase",
+                   help="supabase = mock Supabase server, local = STORAGE_BACKEND=local")
+    r.add_argument("--latency-ms", type=float, default=30.0, help="mock round trip added to every request")
+    r.add_argument("--jitter-ms", type=float, default=10.0, help="uniform jitter on top of --latency-ms")
+    r.add_argument("--bandwidth-mbps", type=float, default=0.0, help="mock link speed for bodies (0 = unlimited)")
+    r.add_argument("--threads", type=int, default=4, help="waitress worker threads (waitress default: 4)")
+    r.add_argument("--clients", type=int, default=8, help="concurrent clients for autosave and list polling")
+    r.add_argument("--viewers", type=int, default=8, help="concurrent viewers opening one design")
+    r.add_argument("--layers", type=int, default=6, help="layers per design")
+    r.add_argument("--layer-px", type=int, default=1024, help="layer canvas width/height in pixels")
+    r.add_argument("--layer-kb", type=int, default=200, help="approximate encoded size of a layer PNG")
+    r.add_argument("--dirty-layers", type=int, default=1, help="changed layers per autosave")
+    r.add_argument("--saves-per-client", type=int, default=10)
+    r.add_argument("--autosave-interval-ms", type=float, default=0.0, help="pause between a client's saves")
+    r.add_argument("--projector-designs", type=int, default=3, help="designs opened cold, one after another")
+    r.add_argument("--list-designs", type=int, default=50, help="designs in the list being polled")
+    r.add_argument("--duration-s", type=float, default=5.0, help="how long list polling runs")
+    r.add_argument("--poll-interval-ms", type=float, default=0.0, help="pause between a client's list polls")
+    r.add_argument("--rename-interval-ms", type=float, default=500.0,
+                   help="one extra client renames a design this often during polling (0 = off)")
+    r.add_argument("--seed", type=int, default=1, help="payload and jitter seed")
+    r.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                   help="extra server environment, e.g. --env SAVE_WRITE_BEHIND=1 (repeatable)")
+    r.add_argument("--out", help="write JSON here instead of stdout")
+    r.add_argument("--verbose", action="store_true", help="keep the server's request log on stdout")
+    r.set_defaults(func=cmd_run)
+
+    c = sub.add_parser("compare", help="compare two result files")
+    c.add_argument("old")
+    c.add_argument("new")
+    c.add_argument("--threshold", type=float, default=10.0, help="p95 slowdown (%%) that counts as a regression")
+    c.set_defaults(func=cmd_compare)
+
+    args = p.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,267 @@
+"""
+In-process stand-in for the parts of Supabase the server talks to:
+PostgREST for the `designs` / `layers` tables and Storage for one bucket.
+
+Only the query shapes SupabaseBackend sends are understood (eq./in.
+filters, select, order, limit, on_conflict upserts, Prefer return=...).
+Every request is delayed by a configurable round trip plus a bandwidth
+term, so the numbers look like a real project instead of a loopback.
+"""
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qsl, unquote, urlparse
+
+
+def _split_list(inner: str) -> List[str]:
+    """Split `a,"b,c",d` (the inside of in.(...)) on unquoted commas."""
+    out, cur, quoted, escaped = [], "", False, False
+    for ch in inner:
+        if escaped:
+            cur += ch
+            escaped = False
+        elif ch == "\\":
+            escaped = True
+        elif ch == '"':
+            quoted = not quoted
+        elif ch == "," and not quoted:
+            out.append(cur)
+            cur = ""
+        else:
+            cur += ch
+    out.append(cur)
+    return out
+
+
+def _matches(row: dict, column: str, cond: str) -> bool:
+    op, _, value = cond.partition(".")
+    have = "" if row.get(column) is None else str(row.get(column))
+    if op == "eq":
+        return have == value
+    if op == "in":
+        return have in _split_list(value[1:-1])
+    raise ValueError(f"unsupported filter {cond!r}")
+
+
+def _sort_key(value):
+    return (0, value, "") if isinstance(value, (int, float)) else (1, 0, str(value))
+
+
+class MockSupabase:
+    """
+    Threaded HTTP server holding the tables and the bucket in memory.
+
+    latency_ms / jitter_ms: added to every request (uniform jitter).
+    bandwidth_mbps: request + response bodies are charged at this rate;
+    0 means unlimited.
+    """
+
+    _REST_KEYWORDS = {"select", "order", "limit", "offset", "on_conflict"}
+
+    def __init__(self, latency_ms: float = 30.0, jitter_ms: float = 10.0,
+                 bandwidth_mbps: float = 0.0, seed: int = 0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.bandwidth_mbps = bandwidth_mbps
+        self.tables: Dict[str, List[dict]] = {"designs": [], "layers": []}
+        self.blobs: Dict[str, bytes] = {}
+        self.requests: Counter = Counter()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    # ---------- lifecycle ----------
+    def start(self) -> "MockSupabase":
+        mock = self
+
+        class Handler(_Handler):
+            pass
+
+        Handler.mock = mock
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="mock-supabase", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def count(self, key: str):
+        with self._lock:
+            self.requests[key] += 1
+
+    def reset_counts(self) -> Dict[str, int]:
+        """Request counts since the last reset, keyed like 'GET designs'."""
+        with self._lock:
+            counts = dict(self.requests)
+            self.requests.clear()
+        return dict(sorted(counts.items()))
+
+    # ---------- simulated network ----------
+    def delay(self, nbytes: int):
+        with self._lock:
+            jitter = self._rng.uniform(0, self.jitter_ms) if self.jitter_ms else 0.0
+        seconds = (self.latency_ms + jitter) / 1000.0
+        if self.bandwidth_mbps > 0:
+            seconds += nbytes * 8 / (self.bandwidth_mbps * 1_000_000)
+        if seconds > 0:
+            time.sleep(seconds)
+
+    # ---------- PostgREST ----------
+    def rest(self, method: str, table: str, query: List[tuple], prefer: str, body: bytes):
+        if table not in self.tables:
+            return 404, {"message": f"relation {table} does not exist"}
+        params = dict(query)
+        filters = [(k, v) for k, v in query if k not in self._REST_KEYWORDS]
+        with self._lock:
+            rows = self.tables[table]
+            hit = [r for r in rows if all(_matches(r, k, v) for k, v in filters)]
+
+            if method == "GET":
+                for part in reversed((params.get("order") or "").split(",")):
+                    if part:
+                        column, _, direction = part.partition(".")
+                        hit.sort(key=lambda r: _sort_key(r.get(column)), reverse=direction == "desc")
+                if "limit" in params:
+                    hit = hit[: int(params["limit"])]
+                select = params.get("select", "*")
+                if select != "*":
+                    columns = select.split(",")
+                    hit = [{c: r.get(c) for c in columns} for r in hit]
+                return 200, json.loads(json.dumps(hit))
+
+            if method == "POST":
+                payload = json.loads(body or b"null")
+                payload = payload if isinstance(payload, list) else [payload]
+                keys = params["on_conflict"].split(",") if "on_conflict" in params else None
+                out = []
+                for new in payload:
+                    new = dict(new)
+                    if table == "designs":
+                        new.setdefault("id", str(uuid.uuid4()))
+                        new.setdefault("updated_at", datetime.now(timezone.utc).isoformat())
+                    existing = None
+                    if keys:
+                        existing = next((r for r in rows if all(r.get(k) == new.get(k) for k in keys)), None)
+                    if existing is not None:
+                        existing.update(new)
+                        out.append(existing)
+                    else:
+                        rows.append(new)
+                        out.append(new)
+                if "return=representation" in prefer:
+                    return 201, json.loads(json.dumps(out))
+                return 201, None
+
+            if method == "PATCH":
+                payload = json.loads(body or b"{}")
+                for r in hit:
+                    r.update(payload)
+                return 204, None
+
+            if method == "DELETE":
+                gone = {id(r) for r in hit}
+                self.tables[table] = [r for r in rows if id(r) not in gone]
+                return 204, None
+
+        return 405, {"message": f"{method} not supported"}
+
+    # ---------- Storage ----------
+    def storage(self, method: str, rest: str, body: bytes):
+        bucket, _, path = rest.partition("/")
+        with self._lock:
+            if method == "GET":
+                data = self.blobs.get(path)
+                if data is None:
+                    return 400, {"statusCode": "404", "error": "not_found", "message": "Object not found"}
+                return 200, data
+            if method in ("PUT", "POST"):
+                self.blobs[path] = body
+                return 200, {"Key": f"{bucket}/{path}"}
+            if method == "DELETE" and not path:
+                removed = []
+                for p in json.loads(body or b"{}").get("prefixes", []):
+                    if self.blobs.pop(p, None) is not None:
+                        removed.append({"name": p})
+                return 200, removed
+        return 405, {"message": f"{method} not supported"}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    mock: MockSupabase
+
+    def log_message(self, *args):
+        pass
+
+    def _read_body(self) -> bytes:
+        n = int(self.headers.get("Content-Length") or 0)
+        if n:
+            return self.rfile.read(n)
+        if "chunked" in (self.headers.get("Transfer-Encoding") or ""):
+            out = bytearray()
+            while True:
+                size = int(self.rfile.readline().split(b";")[0].strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return bytes(out)
+                out += self.rfile.read(size)
+                self.rfile.readline()
+        return b""
+
+    def _handle(self, method: str):
+        url = urlparse(self.path)
+        body = self._read_body()
+
+        if url.path.startswith("/rest/v1/"):
+            table = url.path[len("/rest/v1/"):]
+            self.mock.count(f"{method} {table}")
+            query = parse_qsl(url.query, keep_blank_values=True)
+            status, payload = self.mock.rest(method, table, query, self.headers.get("Prefer") or "", body)
+        elif url.path.startswith("/storage/v1/object/"):
+            self.mock.count(f"{method} storage")
+            status, payload = self.mock.storage(method, unquote(url.path[len("/storage/v1/object/"):]), body)
+        else:
+            status, payload = 404, {"message": "not found"}
+
+        if isinstance(payload, bytes):
+            data, ctype = payload, "image/png"
+        elif payload is None:
+            data, ctype = b"", "application/json"
+        else:
+            data, ctype = json.dumps(payload).encode(), "application/json"
+
+        self.mock.delay(len(body) + len(data))
+        self.send_response(status)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+    def do_PATCH(self):
+        self._handle("PATCH")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
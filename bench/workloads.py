@@ -0,0 +1,306 @@
+"""
+Benchmark workloads. Each one talks to the server over real HTTP, the way
+the browser does, and records per-operation latencies in a Recorder.
+"""
+import json
+import math
+import random
+import struct
+import threading
+import time
+import zlib
+from typing import Callable, Dict, List, Optional
+
+import requests
+
+
+# ============================================================
+# Payloads
+# ============================================================
+def make_png(rng: random.Random, size_px: int, payload_kb: int) -> bytes:
+    """
+    A size_px x size_px RGBA PNG that compresses to roughly payload_kb.
+
+    Like a real layer it is mostly transparent; the top rows are random
+    noise (incompressible), so the encoded size is easy to control.
+    """
+    row_bytes = size_px * 4
+    noise_rows = min(size_px, max(1, math.ceil(payload_kb * 1024 / row_bytes)))
+    blank = b"\x00" * (row_bytes + 1)  # filter byte + transparent pixels
+    raw = b"".join(b"\x00" + rng.randbytes(row_bytes) for _ in range(noise_rows))
+    raw += blank * (size_px - noise_rows)
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+    ihdr = struct.pack(">IIBBBBB", size_px, size_px, 8, 6, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", ihdr)
+            + chunk(b"IDAT", zlib.compress(raw, 1)) + chunk(b"IEND", b""))
+
+
+# ============================================================
+# Measurement
+# ============================================================
+def percentile(sorted_ms: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_ms:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_ms)))
+    return sorted_ms[rank - 1]
+
+
+class Recorder:
+    """Thread-safe latency samples per operation name."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples: Dict[str, List[float]] = {}
+        self._errors: Dict[str, int] = {}
+        self._started = time.perf_counter()
+        self._wall_s: Optional[float] = None
+
+    def timed(self, op: str, fn: Callable[[], requests.Response], ok_status=(200,)) -> Optional[requests.Response]:
+        t0 = time.perf_counter()
+        try:
+            r = fn()
+            ok = r.status_code in ok_status
+        except requests.RequestException:
+            r, ok = None, False
+        ms = (time.perf_counter() - t0) * 1000.0
+        with self._lock:
+            self._samples.setdefault(op, []).append(ms)
+            if not ok:
+                self._errors[op] = self._errors.get(op, 0) + 1
+        return r if ok else None
+
+    def add(self, op: str, ms: float):
+        with self._lock:
+            self._samples.setdefault(op, []).append(ms)
+
+    def stop(self):
+        self._wall_s = time.perf_counter() - self._started
+
+    def summary(self) -> dict:
+        wall = self._wall_s if self._wall_s is not None else time.perf_counter() - self._started
+        ops = {}
+        with self._lock:
+            for op, samples in sorted(self._samples.items()):
+                s = sorted(samples)
+                ops[op] = {
+                    "count": len(s),
+                    "errors": self._errors.get(op, 0),
+                    "throughput_per_s": round(len(s) / wall, 2) if wall > 0 else 0.0,
+                    "mean_ms": round(sum(s) / len(s), 2),
+                    "p50_ms": round(percentile(s, 50), 2),
+                    "p95_ms": round(percentile(s, 95), 2),
+                    "p99_ms": round(percentile(s, 99), 2),
+                    "max_ms": round(s[-1], 2),
+                }
+        return {"wall_s": round(wall, 3), "ops": ops}
+
+
+def run_clients(n: int, fn: Callable[[int, requests.Session], None]):
+    """Run fn(client_index, session) on n threads that start together."""
+    barrier = threading.Barrier(n)
+    errors: List[BaseException] = []
+
+    def _client(i: int):
+        with requests.Session() as session:
+            barrier.wait()
+            try:
+                fn(i, session)
+            except BaseException as e:  # surfaced after join
+                errors.append(e)
+
+    threads = [threading.Thread(target=_client, args=(i,), name=f"bench-client-{i}") for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if errors:
+        raise errors[0]
+
+
+# ============================================================
+# API helpers
+# ============================================================
+class Client:
+    """The handful of API calls the workloads need (mirrors Static/Storage/repo.js)."""
+
+    def __init__(self, base_url: str):
+        self.base = base_url.rstrip("/")
+
+    def create(self, session: requests.Session, name: str) -> str:
+        r = session.post(f"{self.base}/api/designs", json={"name": name}, timeout=60)
+        r.raise_for_status()
+        return r.json()["id"]
+
+    def save(self, session: requests.Session, design_id: str, layer_count: int,
+             dirty: Dict[int, bytes]) -> requests.Response:
+        meta = {
+            "layers": [{"layer_index": i, "name": f"Layer {i}", "visible": True} for i in range(layer_count)],
+            "stamps": [],
+        }
+        files = [("meta", (None, json.dumps(meta)))]
+        files += [(f"layer_{i}", (f"layer_{i}.png", png, "image/png")) for i, png in sorted(dirty.items())]
+        return session.post(f"{self.base}/api/designs/{design_id}/save", files=files, timeout=120)
+
+    def load(self, session: requests.Session, design_id: str) -> requests.Response:
+        return session.get(f"{self.base}/api/designs/{design_id}", timeout=60)
+
+    def bundle(self, session: requests.Session, design_id: str) -> requests.Response:
+        r = session.get(f"{self.base}/api/designs/{design_id}/bundle?all=1", timeout=120)
+        r.content  # read the whole body inside the timing
+        return r
+
+    def layer_png(self, session: requests.Session, url: str) -> requests.Response:
+        r = session.get(f"{self.base}{url}", timeout=60)
+        r.content
+        return r
+
+    def list(self, session: requests.Session) -> requests.Response:
+        return session.get(f"{self.base}/api/designs", timeout=60)
+
+    def rename(self, session: requests.Session, design_id: str, name: str) -> requests.Response:
+        return session.patch(f"{self.base}/api/designs/{design_id}", json={"name": name}, timeout=60)
+
+    def bulk_delete(self, session: requests.Session, ids: List[str]) -> requests.Response:
+        return session.post(f"{self.base}/api/designs/bulk-delete", json={"ids": ids}, timeout=300)
+
+
+def seed_design(client: Client, session: requests.Session, rng: random.Random, name: str,
+                layers: int, size_px: int, layer_kb: int) -> str:
+    design_id = client.create(session, name)
+    pngs = {i: make_png(rng, size_px, layer_kb) for i in range(layers)}
+    r = client.save(session, design_id, layers, pngs)
+    if r.status_code not in (200, 202):
+        raise RuntimeError(f"seeding {name} failed: {r.status_code} {r.text[:200]}")
+    return design_id
+
+
+# ============================================================
+# Scenarios
+# ============================================================
+def autosave_storm(client: Client, cfg: dict, after_saves: Callable[[], Optional[float]]) -> dict:
+    """
+    Every client edits its own design and autosaves back to back: each save
+    carries `dirty_layers` changed layer PNGs out of `layers`.
+
+    after_saves() runs once the storm is over (e.g. waits for a write-behind
+    queue to drain) and its duration in seconds, if any, is reported.
+    """
+    clients, layers, saves = cfg["clients"], cfg["layers"], cfg["saves_per_client"]
+    dirty_n = min(cfg["dirty_layers"], layers)
+    think_s = cfg["autosave_interval_ms"] / 1000.0
+    rec = Recorder()
+
+    def _client(i: int, session: requests.Session):
+        rng = random.Random(cfg["seed"] * 1000 + i)
+        design_id = client.create(session, f"bench-autosave-{i}")
+        full = {j: make_png(rng, cfg["layer_px"], cfg["layer_kb"]) for j in range(layers)}
+        rec.timed("save_full", lambda: client.save(session, design_id, layers, full), (200, 202))
+        for n in range(saves):
+            picks = [(n * dirty_n + k) % layers for k in range(dirty_n)]
+            dirty = {j: make_png(rng, cfg["layer_px"], cfg["layer_kb"]) for j in picks}
+            rec.timed("save", lambda: client.save(session, design_id, layers, dirty), (200, 202))
+            if think_s:
+                time.sleep(think_s)
+        cfg["_created"].append(design_id)
+
+    run_clients(clients, _client)
+    rec.stop()
+    out = rec.summary()
+    drained_s = after_saves()
+    if drained_s is not None:
+        out["drain_s"] = round(drained_s, 3)
+    return out
+
+
+def projector_cold_open(client: Client, cfg: dict, make_cold: Callable[[List[str]], None]) -> dict:
+    """
+    A room full of viewers opens the same design at once, the way the
+    projector page and the designer tabs do: design JSON, then the layer
+    bundle. Each design is opened once cold (make_cold() drops it from
+    every server cache first) and once warm.
+    """
+    rng = random.Random(cfg["seed"])
+    with requests.Session() as session:
+        ids = [
+            seed_design(client, session, rng, f"bench-projector-{k}", cfg["layers"], cfg["layer_px"], cfg["layer_kb"])
+            for k in range(cfg["projector_designs"])
+        ]
+    cfg["_created"].extend(ids)
+    make_cold(ids)
+    cfg["_seeded"]()
+    rec = Recorder()
+
+    for phase in ("cold", "warm"):
+        for design_id in ids:
+            def _viewer(i: int, session: requests.Session, design_id=design_id, phase=phase):
+                t0 = time.perf_counter()
+                if rec.timed(f"{phase}_meta", lambda: client.load(session, design_id)) is None:
+                    return
+                if rec.timed(f"{phase}_bundle", lambda: client.bundle(session, design_id)) is None:
+                    return
+                rec.add(f"{phase}_open", (time.perf_counter() - t0) * 1000.0)
+
+            run_clients(cfg["viewers"], _viewer)
+
+    # Per-layer PNG path too (what the designer falls back to without bundles)
+    with requests.Session() as session:
+        make_cold(ids[:1])
+        r = client.load(session, ids[0])
+        urls = [l["png_url"] for l in r.json().get("layers", []) if l.get("png_url")]
+    for phase in ("cold", "warm"):
+        def _png_viewer(i: int, session: requests.Session, phase=phase):
+            for url in urls:
+                rec.timed(f"{phase}_layer_png", lambda: client.layer_png(session, url))
+
+        run_clients(cfg["viewers"], _png_viewer)
+
+    rec.stop()
+    return rec.summary()
+
+
+def list_polling(client: Client, cfg: dict) -> dict:
+    """
+    `clients` open design pickers poll the list while one user renames a
+    design every `rename_interval_ms` (which invalidates the list cache).
+    """
+    with requests.Session() as session:
+        ids = [client.create(session, f"bench-list-{k}") for k in range(cfg["list_designs"])]
+    cfg["_created"].extend(ids)
+    cfg["_seeded"]()
+    rec = Recorder()
+
+    stop_at = time.perf_counter() + cfg["duration_s"]
+    poll_s = cfg["poll_interval_ms"] / 1000.0
+    rename_s = cfg["rename_interval_ms"] / 1000.0
+
+    def _client(i: int, session: requests.Session):
+        n = 0
+        while time.perf_counter() < stop_at:
+            if i == 0 and rename_s:
+                rec.timed("rename", lambda: client.rename(session, ids[n % len(ids)], f"bench-list-{n}-renamed"))
+                n += 1
+                time.sleep(rename_s)
+                continue
+            rec.timed("list", lambda: client.list(session))
+            if poll_s:
+                time.sleep(poll_s)
+
+    run_clients(cfg["clients"] + (1 if rename_s else 0), _client)
+    rec.stop()
+    return rec.summary()
+
+
+def cleanup(client: Client, cfg: dict) -> dict:
+    """Bulk-delete everything the other scenarios created (timed)."""
+    rec = Recorder()
+    ids = list(cfg["_created"])
+    with requests.Session() as session:
+        for i in range(0, len(ids), 100):
+            batch = ids[i:i + 100]
+            rec.timed("bulk_delete", lambda: client.bulk_delete(session, batch))
+    rec.stop()
+    return rec.summary()
@@ -0,0 +1,782 @@
+"""
+Server-side caches used by app.py.
+
+Kept out of app.py so the Flask routes stay readable; nothing in here knows
+about Flask or Supabase.
+"""
+import hashlib
+import mmap
+import os
+import re
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional, Set, Tuple
+
+
+# ============================================================
+# Layer PNG RAM cache
+#   key: (design_id, layer_index)
+#   value: (png_bytes, etag)
+# ============================================================
+LayerKey = Tuple[str, int]
+
+
+class LayerPngCache:
+    """
+    Thread-safe LRU cache for layer PNG bytes with a byte budget.
+
+    Eviction happens on insert, oldest-used first, until both the byte
+    budget and the entry cap are satisfied. Entries older than ``ttl_s``
+    (when set) are treated as misses and dropped on access.
+
+    A single entry larger than ``max_entry_bytes`` is never stored; serving
+    it from upstream once is cheaper than flushing the whole cache for it.
+
+    pop() and purge_designs() bump the layer (or the whole design) in a
+    table of change stamps; entries stored before their last bump count as
+    misses. Writers that fetched the bytes upstream should grab
+    ``generation()`` before the fetch and pass it to ``put``, which drops
+    the bytes if the layer was invalidated meanwhile. With `shared` (see
+    SharedGenerations) that table is seen by every worker process.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 256 * 1024 * 1024,
+        max_entries: int = 2048,
+        ttl_s: Optional[float] = None,
+        max_entry_bytes: Optional[int] = None,
+        shared: Optional["SharedGenerations"] = None,
+    ):
+        self.max_bytes = max(0, int(max_bytes))
+        self.max_entries = max(0, int(max_entries))
+        self.ttl_s = ttl_s if ttl_s and ttl_s > 0 else None
+        self.max_entry_bytes = int(max_entry_bytes) if max_entry_bytes else self.max_bytes
+
+        self._gens = shared if shared is not None else SharedGenerations(None, slots=4096)
+        self._lock = threading.Lock()
+        # key -> (data, etag, stored_at, stamps of the layer and its design when stored)
+        self._entries: "OrderedDict[LayerKey, Tuple[bytes, str, float, tuple]]" = OrderedDict()
+        # design_id -> set of layer keys (so a design purge doesn't scan everything)
+        self._by_design: Dict[str, Set[LayerKey]] = {}
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.rejected = 0
+        self.stale_puts = 0
+
+    # ---------- internals (call with lock held) ----------
+    def _stamps(self, key: LayerKey) -> tuple:
+        return self._gens.get(key), self._gens.get(("design", key[0]))
+
+    def _unlink(self, key: LayerKey) -> Optional[Tuple[bytes, str, float, tuple]]:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        self._bytes -= len(entry[0])
+        keys = self._by_design.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_design[key[0]]
+        return entry
+
+    def _evict_to_budget(self):
+        while self._entries and (
+            self._bytes > self.max_bytes or len(self._entries) > self.max_entries
+        ):
+            oldest = next(iter(self._entries))
+            self._unlink(oldest)
+            self.evictions += 1
+
+    # ---------- public API ----------
+    def get(self, key: LayerKey) -> Optional[Tuple[bytes, str]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            data, etag, stored_at, stamp = entry
+            if (self.ttl_s is not None and time.monotonic() - stored_at > self.ttl_s) or stamp != self._stamps(key):
+                self._unlink(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data, etag
+
+    def generation(self) -> int:
+        """Token to take before fetching a layer; see put() and changed_since()."""
+        return self._gens.now()
+
+    def changed_since(self, key: LayerKey, generation: int) -> bool:
+        """True if key (or its design) was invalidated after generation() returned that token."""
+        return max(self._stamps(key)) >= generation
+
+    def put(self, key: LayerKey, data: bytes, etag: str, generation: Optional[int] = None) -> bool:
+        """Store an entry. Returns False if it was too large to cache or went stale."""
+        size = len(data)
+        if size > self.max_entry_bytes or size > self.max_bytes or self.max_entries == 0:
+            with self._lock:
+                self.rejected += 1
+                self._unlink(key)  # don't keep serving an older version
+            return False
+
+        with self._lock:
+            stamps = self._stamps(key)
+            if generation is not None and max(stamps) >= generation:
+                self.stale_puts += 1  # invalidated while these bytes were being fetched
+                return False
+            self._unlink(key)
+            self._entries[key] = (data, etag, time.monotonic(), stamps)
+            self._by_design.setdefault(key[0], set()).add(key)
+            self._bytes += size
+            self._evict_to_budget()
+        return True
+
+    def pop(self, key: LayerKey, default=None):
+        self._gens.bump(key)
+        with self._lock:
+            entry = self._unlink(key)
+        if entry is None:
+            return default
+        return entry[0], entry[1]
+
+    def purge_design(self, design_id: str) -> int:
+        """Drop every cached layer of one design. Returns number of entries removed."""
+        return self.purge_designs([design_id])
+
+    def purge_designs(self, design_ids) -> int:
+        """Drop every cached layer of several designs in one pass."""
+        removed = 0
+        design_ids = list(design_ids)
+        for design_id in design_ids:
+            self._gens.bump(("design", design_id))
+        with self._lock:
+            for design_id in design_ids:
+                for k in list(self._by_design.get(design_id, ())):
+                    self._unlink(k)
+                    removed += 1
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_design.clear()
+            self._bytes = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "max_entries": self.max_entries,
+                "ttl_s": self.ttl_s,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "rejected": self.rejected,
+                "stale_puts": self.stale_puts,
+            }
+
+
+# ============================================================
+# Change stamps shared between worker processes
+#   One small file, mmap'd by every process: a fixed table of 64-bit
+#   slots, a key hashes to one slot. Reads are plain memory reads.
+# ============================================================
+class SharedGenerations:
+    """
+    When each key last changed, as seen by every process on the host.
+
+    bump(key) stores the current time (ns) in the key's slot; a TTLCache
+    given this object drops entries whose slot moved after they were
+    stored. Keys sharing a slot only cost each other extra misses. Writes
+    from different processes aren't locked against each other, so this is
+    best-effort: the TTLs still bound how long anything stays stale.
+
+    path=None keeps the table in anonymous memory, private to this process.
+    """
+
+    def __init__(self, path: Optional[str], slots: int = 65536):
+        self.slots = max(1, int(slots))
+        if path is None:
+            self._map = mmap.mmap(-1, self.slots * 8)
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                if os.fstat(fd).st_size < self.slots * 8:
+                    os.ftruncate(fd, self.slots * 8)
+                self._map = mmap.mmap(fd, self.slots * 8)
+            finally:
+                os.close(fd)  # the mapping keeps the file open
+        self._lock = threading.Lock()
+
+    def _offset(self, key: Hashable) -> int:
+        # crc32 of repr, not hash(): it has to agree across processes
+        return zlib.crc32(repr(key).encode("utf-8")) % self.slots * 8
+
+    def get(self, key: Hashable) -> int:
+        return struct.unpack_from("<q", self._map, self._offset(key))[0]
+
+    def bump(self, key: Hashable) -> int:
+        off = self._offset(key)
+        with self._lock:
+            stamp = max(time.time_ns(), struct.unpack_from("<q", self._map, off)[0] + 1)
+            struct.pack_into("<q", self._map, off, stamp)
+        return stamp
+
+    @staticmethod
+    def now() -> int:
+        return time.time_ns()
+
+
+# ============================================================
+# Small TTL cache for JSON-ish metadata (design list, design rows)
+# ============================================================
+class TTLCache:
+    """
+    Thread-safe key/value cache with a per-entry TTL and an LRU entry cap.
+
+    Writers that fetched a value upstream should grab ``generation()``
+    before the fetch and pass it to ``put``; if anything was invalidated
+    in the meantime the put is dropped instead of caching stale data.
+    Cached values are shared between callers and must not be mutated.
+
+    Expired entries are kept (until evicted by the entry cap or popped) so
+    get_stale() can still serve them while upstream is unavailable.
+
+    With `shared`, update() and pop() also bump the key in every other
+    process, and entries another process changed since they were stored
+    count as gone. generation() then returns an opaque token that also
+    remembers when the fetch started. clear() only affects this process.
+    """
+
+    def __init__(self, ttl_s: float, max_entries: int = 1024, shared: Optional[SharedGenerations] = None):
+        self.ttl_s = float(ttl_s)
+        self.max_entries = max(1, int(max_entries))
+        self._shared = shared
+        self._lock = threading.Lock()
+        # key -> (value, stored_at, shared stamp when stored)
+        self._entries: "OrderedDict[Hashable, Tuple[object, float, int]]" = OrderedDict()
+        self._generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.stale_hits = 0
+
+    def generation(self):
+        with self._lock:
+            if self._shared is not None:
+                return self._generation, self._shared.now()
+            return self._generation
+
+    def _current(self, key: Hashable):
+        """The entry for key unless another process changed the key since (lock held)."""
+        entry = self._entries.get(key)
+        if entry is not None and self._shared is not None and self._shared.get(key) != entry[2]:
+            del self._entries[key]
+            self.invalidations += 1
+            return None
+        return entry
+
+    def get(self, key: Hashable):
+        with self._lock:
+            entry = self._current(key)
+            if entry is None or time.monotonic() - entry[1] > self.ttl_s:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def get_stale(self, key: Hashable):
+        """The cached value however old it is (None if never cached or invalidated)."""
+        with self._lock:
+            entry = self._current(key)
+            if entry is None:
+                return None
+            self.stale_hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value, generation=None) -> bool:
+        if self.ttl_s <= 0:
+            return False
+        with self._lock:
+            stamp = self._shared.get(key) if self._shared is not None else 0
+            if generation is not None:
+                started = None
+                if isinstance(generation, tuple):
+                    generation, started = generation
+                if generation != self._generation or (started is not None and stamp > started):
+                    return False  # invalidated here, or changed elsewhere, during the fetch
+            self._entries[key] = (value, time.monotonic(), stamp)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return True
+
+    def update(self, key: Hashable, fn) -> bool:
+        """Write-through: replace a cached value with fn(value), keeping its age."""
+        with self._lock:
+            self._generation += 1
+            entry = self._current(key)
+            stamp = self._shared.bump(key) if self._shared is not None else 0
+            if entry is None:
+                return False
+            self._entries[key] = (fn(entry[0]), entry[1], stamp)
+        return True
+
+    def pop(self, key: Hashable):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            if self._shared is not None:
+                self._shared.bump(key)
+            entry = self._entries.pop(key, None)
+        return entry[0] if entry else None
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "ttl_s": self.ttl_s,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "stale_hits": self.stale_hits,
+            }
+
+
+# ============================================================
+# Single-flight: coalesce concurrent work for the same key
+# ============================================================
+class _Flight:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Run at most one ``fn()`` per key at a time.
+
+    The first caller for a key (the leader) runs ``fn``; callers that arrive
+    while it is running block and receive the same result, or the same
+    exception. The flight is forgotten as soon as it finishes, so a failure
+    is never remembered and the next caller simply tries again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[Hashable, _Flight] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def do(self, key: Hashable, fn):
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                self.leaders += 1
+                leader = True
+            else:
+                self.followers += 1
+                leader = False
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def claim(self, key: Hashable) -> Optional[_Flight]:
+        """
+        Become the leader for key without running anything yet.
+
+        For work that finishes outside a single call (a streamed response).
+        Returns None if someone else already leads; otherwise the caller
+        must settle() the returned flight.
+        """
+        with self._lock:
+            if key in self._flights:
+                return None
+            flight = self._flights[key] = _Flight()
+            self.leaders += 1
+            return flight
+
+    def settle(self, key: Hashable, flight: _Flight, result=None, error: Optional[BaseException] = None):
+        """Finish a claimed flight and wake its waiters. Later calls are no-ops."""
+        if flight.done.is_set():
+            return
+        flight.result = result
+        flight.error = error
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.done.set()
+
+    def in_flight(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._flights
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": len(self._flights),
+                "leaders": self.leaders,
+                "followers": self.followers,
+            }
+
+
+# ============================================================
+# Layer PNG disk cache (second tier, survives restarts)
+#
+# Layout under root:
+#   blobs/<hh>/<sha1>.png     content-addressed PNG bytes (sha1 == ETag body)
+#   refs/<design>/<index>     tiny file holding the sha1 of that layer
+#   tmp/                      blobs being written (same filesystem as blobs/)
+#
+# Blobs are written to a temp file and os.replace()d into place, so a
+# reader never sees a half-written file and several processes can share
+# one directory. Blob mtime doubles as the LRU clock.
+# ============================================================
+_SAFE_NAME = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+_HEX40 = re.compile(r"^[0-9a-f]{40}$")
+_STALE_TMP_S = 3600  # temp files older than this were left by a crash
+
+
+class LayerDiskCache:
+    """Content-addressed on-disk cache for layer PNGs with a size cap."""
+
+    def __init__(self, root: str, max_bytes: int = 1024 * 1024 * 1024, rescan_s: float = 0.0):
+        """
+        rescan_s > 0 re-counts the blobs at most that often before deciding
+        whether to evict: for a directory shared by several processes, each
+        of which only sees its own writes otherwise.
+        """
+        self.root = os.path.abspath(root)
+        self.max_bytes = max(0, int(max_bytes))
+        self.rescan_s = float(rescan_s)
+        self._blobs = os.path.join(self.root, "blobs")
+        self._refs = os.path.join(self.root, "refs")
+        self._tmp = os.path.join(self.root, "tmp")
+        for d in (self._blobs, self._refs, self._tmp):
+            os.makedirs(d, exist_ok=True)
+
+        self._sweep_tmp(self._blobs)  # written there before tmp/ existed
+        self._sweep_tmp(self._tmp)
+        self._lock = threading.Lock()
+        self._bytes = self._scan_bytes()
+        self._scanned_at = time.monotonic()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # ---------- paths ----------
+    def _design_dir(self, design_id: str) -> str:
+        # design ids come from the URL; never let them escape the cache dir
+        name = design_id if _SAFE_NAME.match(design_id or "") else \
+            hashlib.sha1(str(design_id).encode("utf-8")).hexdigest()
+        return os.path.join(self._refs, name)
+
+    def _ref_path(self, key: LayerKey) -> str:
+        return os.path.join(self._design_dir(key[0]), str(int(key[1])))
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self._blobs, digest[:2], digest + ".png")
+
+    def _blob_files(self):
+        """(mtime, size, path) of every published blob; temp files in flight are not blobs."""
+        for dirpath, _, names in os.walk(self._blobs):
+            for n in names:
+                if not n.endswith(".png"):
+                    continue
+                p = os.path.join(dirpath, n)
+                try:
+                    st = os.stat(p)
+                except OSError:
+                    continue
+                yield st.st_mtime, st.st_size, p
+
+    def _scan_bytes(self) -> int:
+        return sum(f[1] for f in self._blob_files())
+
+    @staticmethod
+    def _sweep_tmp(top: str):
+        """Remove temp files a crashed process left behind (other processes' recent ones stay)."""
+        cutoff = time.time() - _STALE_TMP_S
+        for dirpath, _, names in os.walk(top):
+            for n in names:
+                p = os.path.join(dirpath, n)
+                try:
+                    if n.endswith(".tmp") and os.stat(p).st_mtime < cutoff:
+                        os.remove(p)
+                except OSError:
+                    pass
+
+    # ---------- public API ----------
+    def get(self, key: LayerKey) -> Optional[Tuple[str, str, int]]:
+        """Return (file_path, etag, size) or None."""
+        ref = self._ref_path(key)
+        try:
+            with open(ref, "r", encoding="ascii") as fh:
+                digest = fh.read().strip()
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        path = self.blob_path(digest) if _HEX40.match(digest) else ""
+        try:
+            size = os.path.getsize(path)
+            os.utime(path, None)  # bump LRU clock
+        except OSError:
+            # blob was evicted underneath the ref
+            self._remove(ref)
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return path, '"' + digest + '"', size
+
+    def put(
+        self, key: LayerKey, data: bytes, digest: Optional[str] = None,
+        current: Optional[Callable[[], bool]] = None,
+    ) -> Optional[str]:
+        """
+        Store bytes for key. Returns the blob path, or None if not cached.
+
+        current, when given, says whether data is still what key should
+        point at; the ref isn't written (or is taken back) once it says no,
+        so a fetch that raced an invalidation can't leave its bytes behind.
+        """
+        if not self.max_bytes or len(data) > self.max_bytes:
+            return None
+        digest = digest or hashlib.sha1(data).hexdigest()
+        path = self.blob_path(digest)
+        if os.path.exists(path):
+            return path if self._write_ref(key, digest, current) else None
+
+        writer = self.writer(key, current)
+        writer.write(data)
+        return writer.commit(digest)
+
+    def writer(self, key: LayerKey, current: Optional[Callable[[], bool]] = None) -> "_BlobWriter":
+        """Incremental put() for bytes that arrive in chunks (digest known at the end)."""
+        return _BlobWriter(self, key, current)
+
+    def _adopt(
+        self, key: LayerKey, tmp: str, digest: str, size: int, current: Optional[Callable[[], bool]],
+    ) -> Optional[str]:
+        path = self.blob_path(digest)
+        try:
+            if os.path.exists(path):
+                self._remove(tmp)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp, path)
+                with self._lock:
+                    self._bytes += size
+        except OSError:
+            self._remove(tmp)
+            return None
+
+        # The blob stays either way: it's content-addressed and ages out via LRU
+        ok = self._write_ref(key, digest, current)
+        self._evict_if_needed()
+        return path if ok else None
+
+    def _write_ref(self, key: LayerKey, digest: str, current: Optional[Callable[[], bool]] = None) -> bool:
+        if current is not None and not current():
+            return False
+        ref = self._ref_path(key)
+        try:
+            os.makedirs(os.path.dirname(ref), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(ref), suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="ascii") as fh:
+                fh.write(digest)
+            os.replace(tmp, ref)
+        except OSError:
+            return False  # e.g. the design was purged underneath us
+        if current is not None and not current():
+            # Invalidated between the check and the replace: take it back
+            # unless someone has already pointed the ref elsewhere.
+            try:
+                with open(ref, "r", encoding="ascii") as fh:
+                    if fh.read().strip() == digest:
+                        os.remove(ref)
+            except OSError:
+                pass
+            return False
+        return True
+
+    def __contains__(self, key: LayerKey) -> bool:
+        return os.path.exists(self._ref_path(key))
+
+    def invalidate(self, key: LayerKey):
+        # Only the ref goes; the blob may be shared and ages out via LRU.
+        self._remove(self._ref_path(key))
+
+    def purge_design(self, design_id: str):
+        shutil.rmtree(self._design_dir(design_id), ignore_errors=True)
+
+    def purge_designs(self, design_ids):
+        for design_id in design_ids:
+            self.purge_design(design_id)
+
+    def _evict_if_needed(self):
+        if self.rescan_s > 0 and time.monotonic() - self._scanned_at > self.rescan_s:
+            total = self._scan_bytes()
+            with self._lock:
+                self._bytes, self._scanned_at = total, time.monotonic()
+        with self._lock:
+            if self._bytes <= self.max_bytes:
+                return
+        # Evict down to 90% so we don't rescan on every insert.
+        target = int(self.max_bytes * 0.9)
+        files = sorted(self._blob_files())
+
+        total = sum(f[1] for f in files)
+        evicted = 0
+        for _, size, p in files:
+            if total <= target:
+                break
+            if self._remove(p):
+                total -= size
+                evicted += 1
+        with self._lock:
+            self._bytes = total
+            self.evictions += evicted
+
+    @staticmethod
+    def _remove(path: str) -> bool:
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "root": self.root,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+class _BlobWriter:
+    """
+    One blob being streamed into a LayerDiskCache.
+
+    Chunks go to a temp file; nothing is visible to readers until commit()
+    moves it into place under its digest. Going past the cache's size cap
+    or a write error quietly turns the writer into a no-op.
+    """
+
+    def __init__(self, cache: LayerDiskCache, key: LayerKey, current: Optional[Callable[[], bool]] = None):
+        self._cache = cache
+        self._key = key
+        self._current = current
+        self.size = 0
+        self._tmp: Optional[str] = None
+        self._fh = None
+        try:
+            fd, self._tmp = tempfile.mkstemp(dir=cache._tmp, suffix=".tmp")
+            self._fh = os.fdopen(fd, "wb")
+        except OSError:
+            self.abort()
+
+    @property
+    def active(self) -> bool:
+        return self._fh is not None
+
+    def write(self, chunk: bytes):
+        if self._fh is None:
+            return
+        self.size += len(chunk)
+        if not self._cache.max_bytes or self.size > self._cache.max_bytes:
+            self.abort()
+            return
+        try:
+            self._fh.write(chunk)
+        except OSError:
+            self.abort()
+
+    def commit(self, digest: str) -> Optional[str]:
+        """Publish the blob under digest and point key at it. Returns the blob path or None."""
+        if self._fh is None:
+            return None
+        try:
+            self._fh.close()
+        except OSError:
+            self.abort()
+            return None
+        self._fh = None
+        tmp, self._tmp = self._tmp, None
+        return self._cache._adopt(self._key, tmp, digest, self.size, self._current)
+
+    def abort(self):
+        if self._fh is not None:
+            try:
+                self._fh.close()
+            except OSError:
+                pass
+            self._fh = None
+        if self._tmp is not None:
+            LayerDiskCache._remove(self._tmp)
+            self._tmp = None
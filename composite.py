@@ -0,0 +1,160 @@
+"""
+Flattened previews: a design's visible layers composited into one PNG.
+
+The browser flattens layers on a <canvas> (export, the 128px thumbnail);
+this does the same source-over blend of the layer bitmaps on the server,
+so the design list and other devices get a picture without downloading
+every layer. Only layer pixels: the shield background, clip path and
+stamps are drawn by the client and are not reproduced here.
+
+A layer is a list of pieces, (x, y, png_bytes) placed on the canvas: one
+piece for a plain layer (at its offset), one per tile for a tiled one.
+Pieces of one layer never overlap.
+
+With NumPy, each layer is box-filtered to the output size in premultiplied
+float32 and blended there. Without it, a pure-Python path picks the nearest
+source pixel instead: identical at full size, blockier when shrinking, and
+much slower, so NumPy is recommended for anything but small designs.
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from tiles import decode_rgba, encode_png
+
+try:
+    import numpy as np
+except ImportError:  # optional; see module docstring
+    np = None
+
+Piece = Tuple[int, int, bytes]
+
+_STRIP_ROWS = 256  # source rows box-filtered at once (bounds memory on big layers)
+
+
+def output_size(width: int, height: int, size: Optional[int] = None) -> Tuple[int, int]:
+    """(w, h) with the longest side at most `size` px. Never upscales."""
+    if not size or size >= max(width, height):
+        return width, height
+    scale = size / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def composite(width: int, height: int, layers: Iterable[List[Piece]],
+              size: Optional[int] = None, level: int = 6) -> bytes:
+    """
+    One RGBA PNG of a width x height canvas with `layers` drawn bottom to
+    top, scaled so its longest side is at most `size`. `layers` is consumed
+    lazily, so only one layer's PNGs need to be in memory at a time.
+    """
+    out_w, out_h = output_size(width, height, size)
+    if np is not None:
+        rows = _composite_np(width, height, out_w, out_h, layers)
+    else:
+        rows = _composite_py(width, height, out_w, out_h, layers)
+    return encode_png(out_w, out_h, rows, level)
+
+
+# ============================================================
+# NumPy: box filter + premultiplied blend
+# ============================================================
+def _composite_np(width: int, height: int, out_w: int, out_h: int, layers) -> List[bytes]:
+    # Canvas pixels [xe[X], xe[X+1]) x [ye[Y], ye[Y+1]) land in output pixel (X, Y)
+    xe = np.arange(out_w + 1) * width // out_w
+    ye = np.arange(out_h + 1) * height // out_h
+    # Sums below are of a*rgb and 255*a (both 0..65025 per pixel)
+    norm = (np.outer(np.diff(ye), np.diff(xe)) * 65025.0).astype(np.float32)[..., None]
+
+    dst = np.zeros((out_h, out_w, 4), np.float32)  # premultiplied, 0..1
+    for pieces in layers:
+        acc = np.zeros((out_h, out_w, 4), np.float32)
+        for x, y, data in pieces:
+            pw, ph, rows = decode_rgba(data)
+            px = np.frombuffer(b"".join(rows), np.uint8).reshape(ph, pw, 4)
+            _add_binned(acc, px, np.clip(xe - x, 0, pw), np.clip(ye - y, 0, ph))
+        layer = acc / norm
+        dst = layer + dst * (1.0 - layer[..., 3:4])
+
+    alpha = dst[..., 3:4]
+    out = np.empty((out_h, out_w, 4), np.uint8)
+    rgb = np.divide(dst[..., :3], alpha, out=np.zeros_like(dst[..., :3]), where=alpha > 0)
+    out[..., :3] = np.clip(np.rint(rgb * 255.0), 0, 255)
+    out[..., 3] = np.clip(np.rint(alpha[..., 0] * 255.0), 0, 255)
+    return [r.tobytes() for r in out]
+
+
+def _add_binned(acc, px, lx, ly):
+    """Add px's premultiplied pixel sums into acc; lx/ly are the bin edges in px's coordinates."""
+    cols = np.flatnonzero(lx[1:] > lx[:-1])  # output columns this piece reaches
+    if not len(cols):
+        return
+    x_end, y_end = lx[cols[-1] + 1], ly[-1]
+    # Output row of every source row that reaches the canvas
+    row_bin = np.searchsorted(ly, np.arange(y_end), side="right") - 1
+
+    for r0 in range(0, y_end, _STRIP_ROWS):
+        strip = px[r0:min(r0 + _STRIP_ROWS, y_end), :x_end]
+        a = strip[..., 3].astype(np.uint32)
+        pm = np.empty(strip.shape, np.uint32)
+        pm[..., :3] = strip[..., :3] * a[..., None]
+        pm[..., 3] = a * 255
+        pm = np.add.reduceat(pm, lx[cols], axis=1).astype(np.float64)
+
+        bins = row_bin[r0:r0 + len(strip)]
+        starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+        acc[bins[starts][:, None], cols[None, :]] += np.add.reduceat(pm, starts, axis=0)
+
+
+# ============================================================
+# Pure Python: nearest pixel + integer blend
+# ============================================================
+def _composite_py(width: int, height: int, out_w: int, out_h: int, layers) -> List[bytes]:
+    scaled = (out_w, out_h) != (width, height)
+    xs = [(2 * X + 1) * width // (2 * out_w) for X in range(out_w)]  # canvas column sampled
+    ys = [(2 * Y + 1) * height // (2 * out_h) for Y in range(out_h)]
+    dst = [bytearray(out_w * 4) for _ in range(out_h)]
+
+    for pieces in layers:
+        buf: Dict[int, bytearray] = {}  # output row -> this layer's pixels
+
+        def line(Y: int) -> bytearray:
+            if Y not in buf:
+                buf[Y] = bytearray(out_w * 4)
+            return buf[Y]
+
+        for x, y, data in pieces:
+            pw, ph, rows = decode_rgba(data)
+            if not scaled:
+                seg_w = max(0, min(pw, width - x)) * 4
+                for r in range(max(0, min(ph, height - y))):
+                    line(y + r)[x * 4:x * 4 + seg_w] = rows[r][:seg_w]
+                continue
+            cols = [(X * 4, (cx - x) * 4) for X, cx in enumerate(xs) if x <= cx < x + pw]
+            if not cols:
+                continue
+            for Y, cy in enumerate(ys):
+                if y <= cy < y + ph:
+                    src, out = rows[cy - y], line(Y)
+                    for o, i in cols:
+                        out[o:o + 4] = src[i:i + 4]
+
+        for Y, src in buf.items():
+            _over(dst[Y], src)
+    return [bytes(r) for r in dst]
+
+
+def _over(dst: bytearray, src: bytearray):
+    """src drawn over dst in place (straight alpha, like canvas source-over)."""
+    start = (len(src) - len(src.lstrip(b"\x00"))) // 4 * 4
+    end = -(-len(src.rstrip(b"\x00")) // 4) * 4
+    for i in range(start, end, 4):
+        a = src[i + 3]
+        if a == 0:
+            continue
+        da = dst[i + 3]
+        if a == 255 or da == 0:
+            dst[i:i + 4] = src[i:i + 4]
+            continue
+        keep = da * (255 - a)  # dst's weight, x255
+        oa = a * 255 + keep
+        for c in range(i, i + 3):
+            dst[c] = (src[c] * a * 255 + dst[c] * keep + oa // 2) // oa
+        dst[i + 3] = (oa + 127) // 255
@@ -0,0 +1,188 @@
+"""
+Streaming multipart/form-data ingest for design saves.
+
+Flask's request.form / request.files parse the whole body before the view
+runs. For saves we read request.stream ourselves instead: each file part
+is hashed while it arrives and spooled (RAM below a threshold, a temp file
+above it), size limits are enforced as bytes come in, and parts are handed
+to the caller the moment they are complete.
+"""
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+from typing import IO, Iterator, Optional, Tuple, Union
+
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import (
+    Data,
+    Epilogue,
+    Field,
+    File,
+    MultipartDecoder,
+    NeedData,
+)
+
+
+class IngestError(Exception):
+    status = 400
+
+
+class IngestTooLarge(IngestError):
+    status = 413
+
+
+class SpooledPart:
+    """One received file part: sha1 + size up front, bytes in RAM or a temp file."""
+
+    def __init__(self, name: str, filename: Optional[str], spool_threshold: int, spool_dir: Optional[str]):
+        self.name = name
+        self.filename = filename
+        self.size = 0
+        self._sha1 = hashlib.sha1()
+        self.sha1 = ""  # hexdigest, set by finish()
+        self._threshold = spool_threshold
+        self._dir = spool_dir
+        self._buf: Optional[bytearray] = bytearray()
+        self._fh: Optional[IO[bytes]] = None
+        self.path: Optional[str] = None
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        self._sha1.update(chunk)
+        if self._buf is not None and len(self._buf) + len(chunk) <= self._threshold:
+            self._buf.extend(chunk)
+            return
+        if self._fh is None:
+            if self._dir:
+                os.makedirs(self._dir, exist_ok=True)
+            fd, self.path = tempfile.mkstemp(dir=self._dir, prefix="part-", suffix=".tmp")
+            self._fh = os.fdopen(fd, "wb")
+            self._fh.write(self._buf)
+            self._buf = None
+        self._fh.write(chunk)
+
+    def finish(self):
+        self.sha1 = self._sha1.hexdigest()
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    def open(self) -> IO[bytes]:
+        """A fresh, independent read handle (safe to use from another thread)."""
+        if self.path is not None:
+            return open(self.path, "rb")
+        return io.BytesIO(bytes(self._buf or b""))
+
+    def read_bytes(self) -> bytes:
+        with self.open() as fh:
+            return fh.read()
+
+    def save_to(self, dest: str):
+        """Move/copy the part's bytes to dest (atomically replacing it)."""
+        tmp = f"{dest}.{threading.get_ident()}.tmp"
+        if self.path is not None:
+            shutil.move(self.path, tmp)
+            self.path = None
+            fd = os.open(tmp, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        else:
+            with open(tmp, "wb") as fh:
+                fh.write(self._buf or b"")
+                fh.flush()
+                os.fsync(fh.fileno())
+        os.replace(tmp, dest)
+        self.path = dest
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+        if self.path is not None and os.path.basename(self.path).startswith("part-"):
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            self.path = None
+        self._buf = None
+
+
+Event = Tuple[str, str, Union[str, SpooledPart]]
+
+
+def iter_multipart(
+    stream: IO[bytes],
+    content_type: str,
+    *,
+    max_part_bytes: int,
+    max_total_bytes: int,
+    max_field_bytes: int,
+    spool_threshold: int = 1024 * 1024,
+    spool_dir: Optional[str] = None,
+    chunk_size: int = 64 * 1024,
+) -> Iterator[Event]:
+    """
+    Yield ("field", name, str) and ("file", name, SpooledPart) as parts complete.
+
+    Raises IngestTooLarge as soon as a limit is crossed (the rest of the body
+    is never read) and IngestError for malformed bodies. Parts already
+    yielded belong to the caller; the one being received is cleaned up.
+    """
+    mimetype, options = parse_options_header(content_type or "")
+    boundary = options.get("boundary")
+    if mimetype != "multipart/form-data" or not boundary:
+        raise IngestError("expected multipart/form-data")
+
+    decoder = MultipartDecoder(boundary.encode("latin-1"))
+    total = 0
+    current: Optional[Union[Field, File]] = None
+    field_buf = bytearray()
+    part: Optional[SpooledPart] = None
+
+    try:
+        while True:
+            chunk = stream.read(chunk_size)
+            total += len(chunk)
+            if total > max_total_bytes:
+                raise IngestTooLarge(f"request body exceeds {max_total_bytes} bytes")
+            try:
+                decoder.receive_data(chunk or None)
+                event = decoder.next_event()
+                while not isinstance(event, (NeedData, Epilogue)):
+                    if isinstance(event, File):
+                        current, part = event, SpooledPart(event.name, event.filename, spool_threshold, spool_dir)
+                    elif isinstance(event, Field):
+                        current, part = event, None
+                        field_buf = bytearray()
+                    elif isinstance(event, Data):
+                        if part is not None:
+                            part.write(event.data)
+                            if part.size > max_part_bytes:
+                                raise IngestTooLarge(f"part {part.name!r} exceeds {max_part_bytes} bytes")
+                        else:
+                            field_buf.extend(event.data)
+                            if len(field_buf) > max_field_bytes:
+                                raise IngestTooLarge(f"field {current.name!r} exceeds {max_field_bytes} bytes")
+                        if not event.more_data:
+                            if part is not None:
+                                part.finish()
+                                done, part = part, None
+                                yield "file", done.name, done
+                            else:
+                                yield "field", current.name, field_buf.decode("utf-8", "replace")
+                    event = decoder.next_event()
+            except ValueError as e:
+                raise IngestError(f"malformed multipart body: {e}") from None
+
+            if isinstance(event, Epilogue) or not chunk:
+                if not isinstance(event, Epilogue):
+                    raise IngestError("multipart body ended early")
+                return
+    finally:
+        if part is not None:
+            part.close()
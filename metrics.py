@@ -0,0 +1,237 @@
+"""
+Small in-process metrics registry with Prometheus text exposition.
+
+Counters, gauges and fixed-bucket histograms keyed by label values. The
+hot path is a dict lookup, a bisect and one short lock per observation.
+Numbers other objects already keep (cache stats, save queue depth) are
+read at scrape time through collectors instead of being mirrored here.
+
+Several processes serving one app each have a registry; snapshot() gives
+one process's numbers as JSON-able data and merge() adds them up, so a
+scrape of any of them can show the totals (see render_families()).
+"""
+import bisect
+import math
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+Labels = Tuple[str, ...]
+# (name, type, help, [(labels, value)]) as yielded by a collector
+Family = Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]
+# {"name", "type", "help", "buckets"?, "samples": [[{label: value}, value]]} from snapshot();
+# a histogram's value is [per-bucket counts (non-cumulative, last = +Inf), sum, count]
+Snapshot = List[dict]
+
+# Seconds; covers a cache hit (sub-ms) up to a slow multi-layer save
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _label_str(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _check(self, labels: Labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {labels}")
+
+    def samples(self) -> list:
+        """[[{label: value}, value], ...] for snapshot()."""
+        with self._lock:
+            items = sorted(self._values.items())
+        return [[dict(zip(self.labelnames, k)), self._copy(v)] for k, v in items]
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        self._check(labels)
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        with self._lock:
+            return self._values.get(labels, 0.0)
+
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1.0):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value: float, *labels: str):
+        self._check(labels)
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (non-cumulative, last = +Inf), sum, count]
+        self._values: Dict[Labels, list] = {}
+
+    def observe(self, value: float, *labels: str):
+        self._check(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            v = self._values.get(labels)
+            if v is None:
+                v = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            v[0][i] += 1
+            v[1] += value
+            v[2] += 1
+
+    @staticmethod
+    def _copy(value):
+        return [list(value[0]), value[1], value[2]]
+
+    def snapshot(self, *labels: str) -> Optional[dict]:
+        """{count, sum} for one label set (None if never observed)."""
+        with self._lock:
+            v = self._values.get(labels)
+            return None if v is None else {"count": v[2], "sum": v[1]}
+
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], Iterable[Family]]] = []
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            if any(m.name == metric.name for m in self._metrics):
+                raise ValueError(f"metric {metric.name} already registered")
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def collector(self, fn: Callable[[], Iterable[Family]]):
+        """fn() is called on every scrape and yields (name, type, help, samples)."""
+        with self._lock:
+            self._collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        """Prometheus text exposition format 0.0.4."""
+        return render_families(self.snapshot())
+
+    def snapshot(self) -> Snapshot:
+        """Everything render() shows, as data another process can merge()."""
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+        out: Snapshot = []
+        for m in metrics:
+            family = {"name": m.name, "type": m.kind, "help": m.help, "samples": m.samples()}
+            if isinstance(m, Histogram):
+                family["buckets"] = list(m.buckets)
+            out.append(family)
+        for fn in collectors:
+            for name, kind, help, samples in fn():
+                out.append({"name": name, "type": kind, "help": help,
+                            "samples": [[dict(labels), value] for labels, value in samples]})
+        return out
+
+
+def merge(snapshots: Iterable[Snapshot], gauges_from: Optional[Iterable[int]] = None) -> Snapshot:
+    """
+    Add up several processes' snapshots: counters and histograms are summed,
+    and so are gauges, but only from the snapshots whose position is in
+    gauges_from (default: all), so processes that are gone don't count.
+    """
+    live = None if gauges_from is None else set(gauges_from)
+    merged: Dict[str, dict] = {}
+    for i, snap in enumerate(snapshots):
+        for family in snap:
+            if family["type"] == "gauge" and live is not None and i not in live:
+                continue
+            into = merged.setdefault(family["name"], dict(family, samples={}))
+            if family["type"] != into["type"] or family.get("buckets") != into.get("buckets"):
+                continue  # a process running different code; skip rather than add up the wrong things
+            for labels, value in family["samples"]:
+                key = tuple(labels.items())
+                have = into["samples"].get(key)
+                if have is None:
+                    into["samples"][key] = Histogram._copy(value) if into["type"] == "histogram" else value
+                elif into["type"] == "histogram":
+                    have[0] = [a + b for a, b in zip(have[0], value[0])]
+                    have[1] += value[1]
+                    have[2] += value[2]
+                else:
+                    into["samples"][key] = have + value
+    return [dict(f, samples=[[dict(k), v] for k, v in f["samples"].items()]) for f in merged.values()]
+
+
+def render_families(families: Snapshot) -> str:
+    """Prometheus text for snapshot() / merge() output."""
+    out: List[str] = []
+    for family in families:
+        name = family["name"]
+        out.append(f"# HELP {name} {family['help']}")
+        out.append(f"# TYPE {name} {family['type']}")
+        if family["type"] != "histogram":
+            for labels, value in family["samples"]:
+                out.append(f"{name}{_label_str(list(labels), list(labels.values()))} {_fmt(value)}")
+            continue
+        bounds = tuple(family["buckets"]) + (math.inf,)
+        for labels, (counts, total, count) in family["samples"]:
+            names, values = list(labels), list(labels.values())
+            running = 0
+            for bound, n in zip(bounds, counts):
+                running += n
+                le = f'le="{_fmt(bound)}"'
+                out.append(f"{name}_bucket{_label_str(names, values, le)} {running}")
+            out.append(f"{name}_sum{_label_str(names, values)} {_fmt(total)}")
+            out.append(f"{name}_count{_label_str(names, values)} {count}")
+    return "\n".join(out) + "\n"
@@ -0,0 +1,155 @@
+"""
+Lossless re-encoding of layer PNGs on ingest.
+
+canvas.toBlob() writes a full-canvas RGBA PNG at a fast compression
+level, even when the layer is a small mark in a sea of transparency.
+optimize_png() decodes it (see tiles.decode_rgba) and, without changing a
+single pixel:
+  - trims it to the bounding box of non-zero pixels (the offset and the
+    original size are returned so the caller can record where the box
+    goes; pad_png() puts it back),
+  - writes an indexed PNG when there are at most 256 distinct colors,
+    or drops the alpha channel when everything is opaque,
+  - tries a few row filters at zlib level 9 and keeps the smallest.
+
+Pure Python plus zlib, so it is CPU-bound; app.py runs it on a worker pool.
+"""
+import struct
+import sys
+import zlib
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from tiles import PNG_SIGNATURE, decode_rgba, encode_png, png_chunk
+
+# Pixels are compared as native 32-bit words (memoryview.cast("I"))
+_ORDER = sys.byteorder
+
+
+class Optimized(NamedTuple):
+    data: bytes
+    offset: Tuple[int, int]
+    size: Tuple[int, int]
+    canvas: Tuple[int, int]  # size before trimming
+    palette: bool
+
+
+def _sub_bytes(a: int, b: int, n: int) -> int:
+    """Bytewise (a - b) mod 256 of two n-byte big-endian ints, without borrows between bytes."""
+    full = (1 << (8 * n)) - 1
+    high = int.from_bytes(b"\x80" * n, "big")
+    return (((a | high) - (b & (full ^ high))) ^ ((a ^ b ^ full) & high)) & full
+
+
+def _filtered(rows: List[bytes], bpp: int, ftype: int) -> bytes:
+    """Scanlines with one filter type on every row (0 None, 1 Sub, 2 Up)."""
+    out = []
+    prev = 0
+    for row in rows:
+        n = len(row)
+        cur = int.from_bytes(row, "big")
+        if ftype == 1:
+            line = _sub_bytes(cur, cur >> (8 * bpp), n).to_bytes(n, "big")
+        elif ftype == 2:
+            line = _sub_bytes(cur, prev, n).to_bytes(n, "big")
+        else:
+            line = row
+        out.append(bytes((ftype,)) + line)
+        prev = cur
+    return b"".join(out)
+
+
+def _bbox(rows: List[bytes]) -> Optional[Tuple[int, int, int, int]]:
+    """(x0, y0, x1, y1) in pixels around every non-zero byte, or None if all zero."""
+    x0 = y0 = None
+    x1 = y1 = 0
+    for y, row in enumerate(rows):
+        stripped = row.lstrip(b"\x00")
+        if not stripped:
+            continue
+        left = (len(row) - len(stripped)) // 4
+        right = -(-len(row.rstrip(b"\x00")) // 4)
+        if y0 is None:
+            y0, x0 = y, left
+        x0 = min(x0, left)
+        x1 = max(x1, right)
+        y1 = y + 1
+    if y0 is None:
+        return None
+    return x0, y0, x1, y1
+
+
+def _palette(rows: List[bytes], limit: int = 256) -> Optional[Dict[int, int]]:
+    """RGBA word -> palette index if there are at most `limit` colors, else None."""
+    colors = set()
+    for row in rows:
+        colors.update(memoryview(row).cast("I"))
+        if len(colors) > limit:
+            return None
+    # Transparent entries first keeps tRNS short
+    ordered = sorted(colors, key=lambda c: (c.to_bytes(4, _ORDER)[3] == 255, c))
+    return {c: i for i, c in enumerate(ordered)}
+
+
+def _encode(width: int, height: int, color: int, scanlines: List[bytes], bpp: int,
+            extra: List[bytes], filters: Tuple[int, ...]) -> bytes:
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, color, 0, 0, 0)
+    best = None
+    for ftype in filters:
+        idat = zlib.compress(_filtered(scanlines, bpp, ftype), 9)
+        if best is None or len(idat) < len(best):
+            best = idat
+    return (PNG_SIGNATURE + png_chunk(b"IHDR", ihdr) + b"".join(extra)
+            + png_chunk(b"IDAT", best) + png_chunk(b"IEND", b""))
+
+
+def optimize_png(data: bytes, trim: bool = True) -> Optional[Optimized]:
+    """
+    Smallest lossless encoding found, or None if it wouldn't be smaller
+    than data (and nothing was trimmed). Raises TileError for PNGs that
+    tiles.decode_rgba can't read.
+    """
+    width, height, rows = decode_rgba(data)
+    x0, y0, x1, y1 = 0, 0, width, height
+    if trim:
+        box = _bbox(rows)
+        x0, y0, x1, y1 = box if box is not None else (0, 0, 1, 1)
+        rows = [r[x0 * 4:x1 * 4] for r in rows[y0:y1]]
+    w, h = x1 - x0, y1 - y0
+    trimmed = (w, h) != (width, height)
+
+    lut = _palette(rows)
+    if lut is not None:
+        plte = b"".join(c.to_bytes(4, _ORDER)[:3] for c in lut)
+        alphas = bytes(c.to_bytes(4, _ORDER)[3] for c in lut).rstrip(b"\xff")
+        extra = [png_chunk(b"PLTE", plte)] + ([png_chunk(b"tRNS", alphas)] if alphas else [])
+        indexed = [bytes(map(lut.__getitem__, memoryview(r).cast("I"))) for r in rows]
+        out = _encode(w, h, 3, indexed, 1, extra, (0,))
+    elif all(r[3::4].count(255) == w for r in rows):
+        rgb = []
+        for r in rows:
+            b = bytearray(w * 3)
+            b[0::3], b[1::3], b[2::3] = r[0::4], r[1::4], r[2::4]
+            rgb.append(bytes(b))
+        out = _encode(w, h, 2, rgb, 3, [], (0, 1, 2))
+    else:
+        out = _encode(w, h, 6, rows, 4, [], (0, 1, 2))
+
+    if len(out) >= len(data) and not trimmed:
+        return None
+    return Optimized(out, (x0, y0), (w, h), (width, height), lut is not None)
+
+
+def pad_png(data: bytes, offset: Tuple[int, int], canvas: Tuple[int, int], level: int = 6) -> bytes:
+    """
+    The reverse of trimming: an RGBA PNG canvas-sized, transparent except
+    for data placed at offset (anything reaching past the canvas is cut off).
+    """
+    w, h, rows = decode_rgba(data)
+    (ox, oy), (cw, ch) = offset, canvas
+    blank = bytes(cw * 4)
+    left, right = bytes(min(ox, cw) * 4), bytes(max(0, cw - ox - w) * 4)
+    out = [blank] * min(oy, ch)
+    out += [(left + r + right)[:cw * 4] for r in rows[:max(0, ch - oy)]]
+    out += [blank] * (ch - len(out))
+    return encode_png(cw, ch, out, level)
+
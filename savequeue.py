@@ -0,0 +1,441 @@
+"""
+Write-behind queue for design saves.
+
+A queued save is durable as soon as enqueue() returns: its new layer PNGs
+are in the spool's blob store and a small JSON record describing the save
+(layer rows, stamps) is fsync'd next to them. Background workers then hand
+each design's pending saves to a flush callback, merged so that only the
+newest state per layer is written. Nothing in here knows about Flask or
+Supabase; app.py supplies the flush function.
+
+Layout under root:
+  blobs/<sha1>.png              layer / tile bytes referenced by pending saves
+  saves/<design>/<seq>.json     one record per acknowledged save
+  spool/                        temp files for parts still being received
+  lock                          held by the one process that owns the queue
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+
+_SAFE_NAME = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+_HEX40 = re.compile(r"^[0-9a-f]{40}$")
+
+
+class PendingSave:
+    """The merged view of one design's queued saves, oldest to newest."""
+
+    def __init__(self, design_id: str, records: List[dict], blob_path: Callable[[str], str]):
+        self.design_id = design_id
+        self.rows: Dict[int, dict] = {}
+        self.blobs: Set[str] = set()
+        self.stamps: list = []
+        self.updated_at: Optional[str] = None
+        self.count = len(records)
+        self.max_seq = records[-1]["seq"] if records else 0
+        self.received_at = records[0]["received_at"] if records else time.time()
+        self._blob_path = blob_path
+
+        for rec in records:
+            for row in rec["rows"]:
+                self.rows[int(row["layer_index"])] = row
+            self.blobs.update(rec["blobs"])
+            self.stamps = rec["stamps"]
+            self.updated_at = rec["updated_at"]
+
+    def staged_rows(self) -> List[dict]:
+        """Rows whose bytes are only in the spool so far (newest state per layer)."""
+        return [r for _, r in sorted(self.rows.items()) if r.get("png_hash") in self.blobs]
+
+    def blob_path(self, digest: str) -> str:
+        return self._blob_path(digest)
+
+
+class _DesignQueue:
+    __slots__ = ("records", "due", "flushing", "retries", "last_error")
+
+    def __init__(self):
+        self.records: List[dict] = []
+        self.due = 0.0
+        self.flushing = False
+        self.retries = 0
+        self.last_error: Optional[str] = None
+
+
+class SaveQueue:
+    """
+    Durable, per-design coalescing write-behind queue.
+
+    ``flush(design_id, PendingSave)`` runs on a worker thread; returning
+    means the state is stored upstream and the records can go, raising
+    keeps them and retries with exponential backoff (capped at
+    ``max_retry_s``). A design's first pending save waits ``delay_s`` before
+    flushing so an autosave burst turns into one write.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        flush: Callable[[str, PendingSave], None],
+        workers: int = 2,
+        delay_s: float = 1.0,
+        max_retry_s: float = 60.0,
+    ):
+        self.root = os.path.abspath(root)
+        self._flush = flush
+        self.delay_s = max(0.0, float(delay_s))
+        self.max_retry_s = max(1.0, float(max_retry_s))
+
+        self._blobs = os.path.join(self.root, "blobs")
+        self._saves = os.path.join(self.root, "saves")
+        self.spool_dir = os.path.join(self.root, "spool")
+        for d in (self._blobs, self._saves, self.spool_dir):
+            os.makedirs(d, exist_ok=True)
+        # Two processes flushing (and garbage-collecting) one queue would
+        # delete each other's blobs; refuse to share.
+        self._lock_fh = _lock_file(os.path.join(self.root, "lock"))
+
+        self._cond = threading.Condition()
+        self._designs: Dict[str, _DesignQueue] = {}
+        self._refs: Dict[str, int] = {}  # blob sha1 -> number of records using it
+        self._enqueue_locks: Dict[str, threading.Lock] = {}  # one per design, kept for good
+        self._last_seq = 0
+
+        self.enqueued = 0
+        self.flushes = 0
+        self.flushed_saves = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self.last_flush_lag_s: Optional[float] = None
+
+        self._load()
+        for i in range(max(1, int(workers))):
+            threading.Thread(target=self._worker, name=f"save-flush-{i}", daemon=True).start()
+
+    # ---------- paths ----------
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self._blobs, digest + ".png")
+
+    def _design_dir(self, design_id: str) -> str:
+        name = design_id if _SAFE_NAME.match(design_id or "") else \
+            hashlib.sha1(str(design_id).encode("utf-8")).hexdigest()
+        return os.path.join(self._saves, name)
+
+    def _record_path(self, design_id: str, seq: int) -> str:
+        return os.path.join(self._design_dir(design_id), f"{seq:020d}.json")
+
+    # ---------- startup ----------
+    def _load(self):
+        """Re-queue records left by a previous process; drop orphaned spool files."""
+        for f in os.listdir(self.spool_dir):
+            _remove(os.path.join(self.spool_dir, f))
+
+        records: List[dict] = []
+        for name in os.listdir(self._saves):
+            ddir = os.path.join(self._saves, name)
+            for f in sorted(os.listdir(ddir)):
+                path = os.path.join(ddir, f)
+                if not f.endswith(".json"):
+                    _remove(path)
+                    continue
+                try:
+                    with open(path, "r", encoding="utf-8") as fh:
+                        records.append(json.load(fh))
+                except (OSError, ValueError):
+                    print("save queue: unreadable record skipped:", path)
+
+        records.sort(key=lambda r: r["seq"])
+        now = time.monotonic()
+        for rec in records:
+            q = self._designs.setdefault(rec["design_id"], _DesignQueue())
+            q.records.append(rec)
+            q.due = now
+            for h in rec["blobs"]:
+                self._refs[h] = self._refs.get(h, 0) + 1
+            self._last_seq = max(self._last_seq, rec["seq"])
+
+        for f in os.listdir(self._blobs):
+            if f[:-4] not in self._refs or not f.endswith(".png"):
+                _remove(os.path.join(self._blobs, f))
+
+    # ---------- producer side ----------
+    def _next_seq(self) -> int:
+        # Wall-clock based so sequence numbers keep increasing across restarts
+        self._last_seq = max(self._last_seq + 1, time.time_ns() // 1000)
+        return self._last_seq
+
+    def enqueue(self, design_id: str, rows: List[dict], stamps: list, updated_at: str, blobs: Dict[str, object]) -> int:
+        """
+        Durably queue one save and return its sequence number.
+
+        blobs maps sha1 -> an object with save_to(dest) (ingest.SpooledPart);
+        each one is moved into the blob store unless it is already there.
+        """
+        # Saves of one design are queued strictly one after another, so
+        # records are appended in sequence order.
+        with self._cond:
+            lock = self._enqueue_locks.setdefault(design_id, threading.Lock())
+
+        with lock:
+            with self._cond:
+                seq = self._next_seq()
+                for h in blobs:
+                    self._refs[h] = self._refs.get(h, 0) + 1
+
+            record = {
+                "design_id": design_id,
+                "seq": seq,
+                "received_at": time.time(),
+                "updated_at": updated_at,
+                "rows": rows,
+                "stamps": stamps,
+                "blobs": sorted(blobs),
+            }
+            try:
+                for h, part in blobs.items():
+                    dest = self.blob_path(h)
+                    if not os.path.exists(dest):
+                        part.save_to(dest)
+                path = self._record_path(design_id, seq)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                _write_json_durable(path, record)
+            except BaseException:
+                with self._cond:
+                    self._unref(blobs)
+                raise
+
+            with self._cond:
+                q = self._designs.setdefault(design_id, _DesignQueue())
+                if not q.records and not q.flushing:
+                    q.due = time.monotonic() + self.delay_s
+                q.records.append(record)
+                self.enqueued += 1
+                self._cond.notify_all()
+        return seq
+
+    def discard(self, design_ids) -> int:
+        """Drop everything queued for these designs (they were deleted). Returns records dropped."""
+        dropped = 0
+        with self._cond:
+            for design_id in design_ids:
+                q = self._designs.pop(design_id, None)
+                if q is None:
+                    continue
+                for rec in q.records:
+                    _remove(self._record_path(design_id, rec["seq"]))
+                    self._unref(rec["blobs"])
+                    dropped += 1
+                _remove_dir(self._design_dir(design_id))
+        return dropped
+
+    # ---------- read side ----------
+    def pending(self, design_id: str) -> Optional[PendingSave]:
+        with self._cond:
+            q = self._designs.get(design_id)
+            if q is None or not q.records:
+                return None
+            records = list(q.records)
+        return PendingSave(design_id, records, self.blob_path)
+
+    def pending_blob(self, design_id: str, layer_index: int, png_hash: Optional[str] = None) -> Optional[Tuple[str, str]]:
+        """
+        (file_path, etag) of a queued layer's bytes, or None if upstream has them.
+
+        Without png_hash, only the newest queued state of the layer counts.
+        """
+        with self._cond:
+            q = self._designs.get(design_id)
+            if q is None:
+                return None
+            staged = set()
+            for rec in q.records:
+                staged.update(rec["blobs"])
+            for rec in reversed(q.records):
+                for row in rec["rows"]:
+                    if int(row["layer_index"]) != int(layer_index):
+                        continue
+                    h = row.get("png_hash")
+                    if png_hash and h != png_hash:
+                        continue
+                    if h in staged and _HEX40.match(h):
+                        return self.blob_path(h), '"' + h + '"'
+                    if not png_hash:
+                        return None
+        return None
+
+    def staged_blob(self, digest: str) -> Optional[str]:
+        """File path of bytes some queued save still references, or None."""
+        with self._cond:
+            if digest not in self._refs:
+                return None
+        return self.blob_path(digest)
+
+    # ---------- workers ----------
+    def _next_due(self) -> str:
+        while True:
+            now = time.monotonic()
+            ready = [(q.due, d) for d, q in self._designs.items() if q.records and not q.flushing]
+            if ready:
+                due, design_id = min(ready)
+                if due <= now:
+                    return design_id
+                self._cond.wait(due - now)
+            else:
+                self._cond.wait()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                design_id = self._next_due()
+                q = self._designs[design_id]
+                q.flushing = True
+                records = list(q.records)
+
+            save = PendingSave(design_id, records, self.blob_path)
+            error: Optional[BaseException] = None
+            try:
+                self._flush(design_id, save)
+            except Exception as e:
+                error = e
+
+            with self._cond:
+                q.flushing = False
+                if self._designs.get(design_id) is not q:
+                    pass  # discarded while flushing; discard() cleaned up
+                elif error is not None:
+                    q.retries += 1
+                    q.last_error = self.last_error = str(error)
+                    q.due = time.monotonic() + min(self.max_retry_s, max(1.0, self.delay_s) * 2 ** q.retries)
+                    self.failures += 1
+                    print("save queue: flush failed for", design_id, "-", error)
+                else:
+                    done = [r for r in q.records if r["seq"] <= save.max_seq]
+                    q.records = [r for r in q.records if r["seq"] > save.max_seq]
+                    for rec in done:
+                        _remove(self._record_path(design_id, rec["seq"]))
+                        self._unref(rec["blobs"])
+                    q.retries = 0
+                    q.last_error = None
+                    self.flushes += 1
+                    self.flushed_saves += len(done)
+                    self.last_flush_lag_s = time.time() - save.received_at
+                    if q.records:
+                        q.due = time.monotonic() + self.delay_s
+                    else:
+                        del self._designs[design_id]
+                self._cond.notify_all()
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """Flush everything now and wait for it. Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            for q in self._designs.values():
+                q.due = 0.0
+            self._cond.notify_all()
+            while any(q.records for q in self._designs.values()):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    # ---------- bookkeeping (call with _cond held) ----------
+    def _unref(self, digests):
+        for h in digests:
+            n = self._refs.get(h, 0) - 1
+            if n > 0:
+                self._refs[h] = n
+            else:
+                self._refs.pop(h, None)
+                _remove(self.blob_path(h))
+
+    def stats(self) -> dict:
+        now = time.time()
+        with self._cond:
+            depth = sum(len(q.records) for q in self._designs.values())
+            oldest = min(
+                (q.records[0]["received_at"] for q in self._designs.values() if q.records),
+                default=None,
+            )
+            designs = [
+                {
+                    "id": d,
+                    "pending": len(q.records),
+                    "age_s": now - q.records[0]["received_at"] if q.records else 0.0,
+                    "flushing": q.flushing,
+                    "retries": q.retries,
+                    "last_error": q.last_error,
+                }
+                for d, q in self._designs.items()
+            ]
+            return {
+                "root": self.root,
+                "depth": depth,
+                "designs_pending": len(designs),
+                "blobs": len(self._refs),
+                "oldest_pending_age_s": (now - oldest) if oldest is not None else 0.0,
+                "last_flush_lag_s": self.last_flush_lag_s,
+                "enqueued": self.enqueued,
+                "flushes": self.flushes,
+                "flushed_saves": self.flushed_saves,
+                "coalesced": self.flushed_saves - self.flushes,
+                "failures": self.failures,
+                "last_error": self.last_error,
+                "delay_s": self.delay_s,
+                "designs": sorted(designs, key=lambda x: -x["age_s"]),
+            }
+
+
+def _lock_file(path: str):
+    fh = open(path, "a+b")
+    try:
+        if os.name == "nt":
+            import msvcrt
+            fh.seek(0)
+            msvcrt.locking(fh.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        fh.close()
+        raise RuntimeError(f"save queue {os.path.dirname(path)} is in use by another process") from None
+    return fh
+
+
+def _write_json_durable(path: str, obj):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(obj, fh, separators=(",", ":"))
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, path)
+    # make the rename itself durable
+    try:
+        fd = os.open(os.path.dirname(path), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _remove_dir(path: str):
+    try:
+        os.rmdir(path)
+    except OSError:
+        pass
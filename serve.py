@@ -0,0 +1,140 @@
+"""
+Run the app in several worker processes: python serve.py --workers 4
+
+The listening socket is opened and app.py imported here, once; each forked
+worker then builds its own state with create_app() and serves it with
+waitress, so request work scales with cores instead of sharing one GIL.
+Dead workers are replaced; SIGTERM / Ctrl+C stops them all. See "Worker
+processes" in app.py for what the workers share.
+
+Forking needs POSIX. On Windows, or with --workers 1, this just serves
+the app in the current process like `python app.py`.
+"""
+import argparse
+import os
+import secrets
+import shutil
+import signal
+import socket
+import sys
+import time
+
+from dotenv import load_dotenv
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+_MIN_UPTIME_S = 5.0  # a worker failing sooner than this is a startup error, not something to retry
+
+
+def _serve(app_module, sock, threads):
+    from waitress import serve
+    serve(app_module.create_app(), sockets=[sock], threads=threads or app_module.SERVER_THREADS)
+
+
+def _spawn(app_module, sock, threads) -> int:
+    pid = os.fork()
+    if pid:
+        return pid
+    code = 0
+    try:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent stops us with SIGTERM
+        _serve(app_module, sock, threads)
+    except BaseException as e:  # never return into the parent's loop
+        print(f"worker {os.getpid()}: {e!r}", file=sys.stderr)
+        code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+
+def _prebuild_assets():
+    """Build Static/ once here, so the workers find a current manifest instead of each building it."""
+    if os.getenv("ASSET_BUILD", "").strip() == "0":
+        return
+    from assets import AssetError, load_or_build
+    out = os.getenv("ASSET_DIR", "").strip() or os.path.join(ROOT, ".cache", "assets")
+    try:
+        load_or_build(os.path.join(ROOT, "Static"), out, os.getenv("STAMP_ATLAS", "").strip() == "1")
+    except (AssetError, OSError, UnicodeDecodeError) as e:
+        print("asset build failed, workers will retry:", e)
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(prog="python serve.py", description=__doc__.split("\n\n")[0].strip())
+    p.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                   help="worker processes (default: one per CPU)")
+    p.add_argument("--threads", type=int, default=0, help="waitress threads per worker (default SERVER_THREADS)")
+    p.add_argument("--host", default="0.0.0.0")
+    p.add_argument("--port", type=int, default=8080)
+    args = p.parse_args(argv)
+
+    load_dotenv(os.path.join(ROOT, ".env"))
+    workers = max(1, args.workers)
+    if not hasattr(os, "fork"):
+        if workers > 1:
+            print("serve.py: no fork() on this platform; running a single process")
+        workers = 1
+    os.environ["SERVER_WORKERS"] = str(workers)
+    if args.threads:
+        os.environ["SERVER_THREADS"] = str(args.threads)
+    if workers > 1 and not os.getenv("FLASK_SECRET_KEY", "").strip():
+        # Each worker would otherwise pick its own and reject the others' session cookies
+        print("serve.py: FLASK_SECRET_KEY is not set; sessions won't survive a restart")
+        os.environ["FLASK_SECRET_KEY"] = secrets.token_hex(32)
+
+    # Importing builds nothing that a fork would lose (see "Process state" in
+    # app.py); doing it once here saves every worker, and every respawn, the import.
+    import app as app_module  # after the environment above: it reads it at import
+
+    sock = socket.create_server((args.host, args.port), backlog=1024)
+    if workers == 1:
+        _serve(app_module, sock, args.threads)
+        return 0
+
+    _prebuild_assets()
+    # Workers add up each other's metrics from here; a previous run's would count twice
+    shared = os.getenv("SHARED_STATE_DIR", "").strip() or os.path.join(ROOT, ".cache", "workers")
+    shutil.rmtree(os.path.join(shared, "metrics"), ignore_errors=True)
+    children = {}  # pid -> started at
+    stopping = False
+
+    def _stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    for _ in range(workers):
+        children[_spawn(app_module, sock, args.threads)] = time.monotonic()
+    print(f"serve.py: {workers} workers on http://{args.host}:{args.port}")
+
+    code = 0
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        started = children.pop(pid, None)
+        if started is None or stopping:
+            continue
+        exitcode = os.waitstatus_to_exitcode(status)  # negative: killed by that signal
+        print(f"serve.py: worker {pid} exited ({exitcode})")
+        if exitcode > 0 and time.monotonic() - started < _MIN_UPTIME_S:
+            print("serve.py: worker died during startup; stopping", file=sys.stderr)
+            code = 1
+            _stop(None, None)
+            continue
+        children[_spawn(app_module, sock, args.threads)] = time.monotonic()
+    sock.close()
+    return code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
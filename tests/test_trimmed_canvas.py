@@ -0,0 +1,80 @@
+"""
+A layer trimmed on ingest (LAYER_OPTIMIZE=1) still renders at its canvas size.
+
+Runs against the local backend in a temporary directory:
+    python -m unittest discover tests
+"""
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_data = tempfile.TemporaryDirectory()
+os.environ.update({
+    "STORAGE_BACKEND": "local",
+    "LOCAL_DATA_DIR": os.path.join(_data.name, "data"),
+    "LAYER_DISK_CACHE_DIR": os.path.join(_data.name, "cache"),
+    "LAYER_OPTIMIZE": "1",
+    "ASSET_BUILD": "0",
+    "LAYER_PREFETCH": "0",
+})
+
+import app as designer  # noqa: E402
+from tiles import decode_rgba, encode_png, png_header  # noqa: E402
+
+W, H = 800, 600
+MARK = (700, 500, 4, 4)  # x, y, w, h of the only drawn pixels
+
+
+def _layer_png() -> bytes:
+    x, y, w, h = MARK
+    rows = [bytes(W * 4)] * H
+    drawn = bytes(x * 4) + bytes([255, 0, 0, 255]) * w + bytes((W - x - w) * 4)
+    return encode_png(W, H, rows[:y] + [drawn] * h + rows[y + h:])
+
+
+class TrimmedCanvasTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.client = designer.create_app().test_client()
+        cls.design_id = cls.client.post("/api/designs", json={"name": "trimmed"}).json["id"]
+        meta = {"layers": [{"layer_index": 0, "name": "mark", "visible": True}], "stamps": []}
+        r = cls.client.post(
+            f"/api/designs/{cls.design_id}/save",
+            data={"meta": json.dumps(meta), "layer_0": (io.BytesIO(_layer_png()), "layer_0.png")},
+            content_type="multipart/form-data",
+        )
+        assert r.status_code == 200, r.json
+        cls.layer = cls.client.get(f"/api/designs/{cls.design_id}").json["layers"][0]
+
+    def _png(self, url: str) -> bytes:
+        r = self.client.get(url)
+        self.assertEqual(r.status_code, 200, url)
+        return r.data
+
+    def test_stored_trimmed(self):
+        self.assertEqual((self.layer["offset_x"], self.layer["offset_y"]), MARK[:2])
+        self.assertEqual(png_header(self._png(self.layer["trimmed_url"]))[:2], MARK[2:])
+
+    def test_composite_is_canvas_size(self):
+        self.assertEqual(png_header(self._png(f"/api/designs/{self.design_id}/composite.png"))[:2], (W, H))
+
+    def test_thumbnail_keeps_canvas_aspect(self):
+        w, h, _bpp = png_header(self._png(f"/api/designs/{self.design_id}/thumbnail.png"))
+        self.assertEqual(max(w, h), designer.THUMBNAIL_PX)
+        self.assertEqual((w, h), (designer.THUMBNAIL_PX, designer.THUMBNAIL_PX * H // W))
+
+    def test_png_url_is_whole_layer(self):
+        data = self._png(self.layer["png_url"])
+        w, h, rows = decode_rgba(data)
+        self.assertEqual((w, h), (W, H))
+        self.assertEqual(rows, decode_rgba(_layer_png())[2])
+
+
+if __name__ == "__main__":
+    unittest.main()
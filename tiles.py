@@ -0,0 +1,311 @@
+"""
+Tiled layers: a layer stored as a grid of fixed-size PNG tiles.
+
+A tiled layer row carries a manifest in layers.tiles_json:
+
+  {"size": 256, "width": 1024, "height": 1024, "tiles": {"<col>,<row>": "<sha1>", ...}}
+
+Only tiles with something on them are listed; a missing tile is fully
+transparent. Edge tiles may be narrower/shorter than `size`. Each tile is
+its own content-addressed object, so a save only uploads the tiles that
+changed and an untouched tile is never written twice.
+
+The PNG helpers here are just enough for that: read a tile's header,
+tell whether it is blank, and stitch a manifest back into one PNG for
+clients that want the whole layer. 8-bit RGB/RGBA/indexed, non-interlaced
+(what canvas.toBlob and pngopt produce). Nothing in here knows about Flask
+or Supabase.
+"""
+import hashlib
+import json
+import re
+import struct
+import zlib
+from typing import Callable, List, Optional, Tuple
+
+TILE_SIZES = (64, 128, 256, 512)
+MAX_LAYER_PX = 8192
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+_HEX40 = re.compile(r"^[0-9a-f]{40}$")
+_KEY_RE = re.compile(r"^(\d+),(\d+)$")
+
+
+class TileError(ValueError):
+    """A manifest or tile PNG this module can't use."""
+
+
+# ============================================================
+# Manifests
+# ============================================================
+def tile_key(col: int, row: int) -> str:
+    return f"{int(col)},{int(row)}"
+
+
+def parse_key(key: str) -> Tuple[int, int]:
+    m = _KEY_RE.match(str(key))
+    if not m:
+        raise TileError(f"bad tile key {key!r}")
+    return int(m.group(1)), int(m.group(2))
+
+
+def grid_size(manifest: dict) -> Tuple[int, int]:
+    """(cols, rows) of a manifest's tile grid."""
+    size = manifest["size"]
+    return -(-manifest["width"] // size), -(-manifest["height"] // size)
+
+
+def parse_grid(obj) -> dict:
+    """Validate {size, width, height} (from a save's meta); returns an empty manifest."""
+    if not isinstance(obj, dict):
+        raise TileError("tiles must be an object")
+    try:
+        size, width, height = int(obj["size"]), int(obj["width"]), int(obj["height"])
+    except (KeyError, TypeError, ValueError):
+        raise TileError("tiles needs integer size, width and height") from None
+    if size not in TILE_SIZES:
+        raise TileError(f"tile size must be one of {TILE_SIZES}")
+    if not (0 < width <= MAX_LAYER_PX and 0 < height <= MAX_LAYER_PX):
+        raise TileError(f"layer size must be 1..{MAX_LAYER_PX} px")
+    return {"size": size, "width": width, "height": height, "tiles": {}}
+
+
+def parse_manifest(obj) -> Optional[dict]:
+    """A stored tiles_json value as a manifest, or None if it isn't a usable one."""
+    if isinstance(obj, str):
+        try:
+            obj = json.loads(obj)
+        except ValueError:
+            return None
+    if not isinstance(obj, dict):
+        return None
+    try:
+        manifest = parse_grid(obj)
+        cols, rows = grid_size(manifest)
+        for key, digest in (obj.get("tiles") or {}).items():
+            col, row = parse_key(key)
+            if col < cols and row < rows and _HEX40.match(str(digest)):
+                manifest["tiles"][tile_key(col, row)] = digest
+    except TileError:
+        return None
+    return manifest
+
+
+def same_grid(a: Optional[dict], b: Optional[dict]) -> bool:
+    return bool(a and b) and all(a[k] == b[k] for k in ("size", "width", "height"))
+
+
+def manifest_digest(manifest: dict) -> str:
+    """sha1 of the canonical manifest JSON: names exactly one stitched layer."""
+    canon = json.dumps(
+        {k: manifest[k] for k in ("size", "width", "height", "tiles")},
+        sort_keys=True, separators=(",", ":"),
+    )
+    return hashlib.sha1(canon.encode("utf-8")).hexdigest()
+
+
+def tile_bounds(manifest: dict, col: int, row: int) -> Tuple[int, int]:
+    """(width, height) of one grid cell; edge cells are cut at the layer size."""
+    size = manifest["size"]
+    return min(size, manifest["width"] - col * size), min(size, manifest["height"] - row * size)
+
+
+# ============================================================
+# PNG
+# ============================================================
+def _chunks(data: bytes):
+    if not data.startswith(PNG_SIGNATURE):
+        raise TileError("not a PNG")
+    pos = len(PNG_SIGNATURE)
+    while pos + 8 <= len(data):
+        length, tag = struct.unpack(">I4s", data[pos:pos + 8])
+        body = data[pos + 8:pos + 8 + length]
+        if len(body) != length:
+            break
+        yield tag, body
+        if tag == b"IEND":
+            return
+        pos += 12 + length
+    raise TileError("truncated PNG")
+
+
+_BPP = {2: 3, 3: 1, 6: 4}  # color type -> bytes per pixel at depth 8
+
+
+def png_header(data: bytes) -> Tuple[int, int, int]:
+    """(width, height, bytes per pixel) of a PNG this module can decode."""
+    if len(data) < 33 or not data.startswith(PNG_SIGNATURE) or data[12:16] != b"IHDR":
+        raise TileError("not a PNG")
+    width, height, depth, color, _comp, _filt, interlace = struct.unpack(">IIBBBBB", data[16:29])
+    if depth != 8 or color not in _BPP or interlace:
+        raise TileError("tiles must be 8-bit RGB/RGBA/indexed, non-interlaced PNGs")
+    if not (0 < width <= MAX_LAYER_PX and 0 < height <= MAX_LAYER_PX):
+        raise TileError("bad PNG size")
+    return width, height, _BPP[color]
+
+
+def _raw_scanlines(data: bytes) -> Tuple[int, int, int, bytes]:
+    width, height, bpp = png_header(data)
+    try:
+        raw = zlib.decompress(b"".join(body for tag, body in _chunks(data) if tag == b"IDAT"))
+    except zlib.error:
+        raise TileError("corrupt PNG image data") from None
+    if len(raw) < (width * bpp + 1) * height:
+        raise TileError("truncated PNG image data")
+    return width, height, bpp, raw
+
+
+def _palette_tables(data: bytes) -> List[bytes]:
+    """bytes.translate tables mapping a palette index to R, G, B and A."""
+    plte, trns = b"", b""
+    for tag, body in _chunks(data):
+        if tag == b"PLTE":
+            plte = body
+        elif tag == b"tRNS":
+            trns = body
+    if not plte:
+        raise TileError("indexed PNG without a palette")
+    plte = plte.ljust(768, b"\x00")
+    return [plte[0::3][:256], plte[1::3][:256], plte[2::3][:256], trns[:256].ljust(256, b"\xff")]
+
+
+def is_blank(data: bytes) -> bool:
+    """
+    True if every pixel is fully transparent (and black, as canvases export it).
+
+    Every PNG filter maps an all-zero image to all-zero bytes and back, so
+    this only has to count zeros in the decompressed data, filter bytes aside.
+    """
+    width, height, bpp, raw = _raw_scanlines(data)
+    if bpp != 4:
+        return False  # no alpha channel: opaque
+    stride = width * bpp + 1
+    raw = raw[:stride * height]
+    return raw.count(0) - raw[::stride].count(0) == height * (stride - 1)
+
+
+def _lanes(n: int) -> Tuple[int, int]:
+    """(high bits, low bits) masks for n bytes packed into one big int."""
+    high = int.from_bytes(b"\x80" * n, "big")
+    return high, high ^ ((1 << (8 * n)) - 1)
+
+
+def add_bytes(a: int, b: int, n: int) -> int:
+    """Bytewise (a + b) mod 256 of two n-byte big-endian ints, without carries between bytes."""
+    high, low = _lanes(n)
+    return ((a & low) + (b & low)) ^ ((a ^ b) & high)
+
+
+def _unfilter(ftype: int, line: bytes, prev: bytes, bpp: int) -> bytes:
+    if ftype == 0:
+        return line
+    n = len(line)
+    if ftype == 1:  # Sub: running sum per channel, as a log-step scan over the whole row
+        acc = int.from_bytes(line, "big")
+        shift = bpp
+        while shift < n:
+            acc = add_bytes(acc, acc >> (8 * shift), n)
+            shift *= 2
+        return acc.to_bytes(n, "big")
+    if ftype == 2:  # Up
+        return add_bytes(int.from_bytes(line, "big"), int.from_bytes(prev, "big"), n).to_bytes(n, "big")
+    out = bytearray(line)
+    if ftype == 3:  # Average
+        for i in range(n):
+            left = out[i - bpp] if i >= bpp else 0
+            out[i] = (out[i] + ((left + prev[i]) >> 1)) & 0xFF
+    elif ftype == 4:  # Paeth
+        for i in range(n):
+            a = out[i - bpp] if i >= bpp else 0
+            b = prev[i]
+            c = prev[i - bpp] if i >= bpp else 0
+            p = a + b - c
+            pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+            pred = a if pa <= pb and pa <= pc else (b if pb <= pc else c)
+            out[i] = (out[i] + pred) & 0xFF
+    else:
+        raise TileError(f"bad PNG filter type {ftype}")
+    return bytes(out)
+
+
+def decode_rgba(data: bytes) -> Tuple[int, int, List[bytes]]:
+    """(width, height, rows) with each row width*4 bytes of RGBA."""
+    width, height, bpp, raw = _raw_scanlines(data)
+    stride = width * bpp
+    rows: List[bytes] = []
+    prev = bytes(stride)
+    for y in range(height):
+        off = y * (stride + 1)
+        line = _unfilter(raw[off], raw[off + 1:off + 1 + stride], prev, bpp)
+        rows.append(line)
+        prev = line
+    if bpp == 3:
+        rows = [_rgb_to_rgba(r, width) for r in rows]
+    elif bpp == 1:
+        tables = _palette_tables(data)
+        rows = [_indexed_to_rgba(r, width, tables) for r in rows]
+    return width, height, rows
+
+
+def _indexed_to_rgba(row: bytes, width: int, tables: List[bytes]) -> bytes:
+    out = bytearray(width * 4)
+    for channel, table in enumerate(tables):
+        out[channel::4] = row.translate(table)
+    return bytes(out)
+
+
+def _rgb_to_rgba(row: bytes, width: int) -> bytes:
+    out = bytearray(b"\xff" * (width * 4))
+    out[0::4], out[1::4], out[2::4] = row[0::3], row[1::3], row[2::3]
+    return bytes(out)
+
+
+def png_chunk(tag: bytes, body: bytes) -> bytes:
+    return struct.pack(">I", len(body)) + tag + body + struct.pack(">I", zlib.crc32(tag + body))
+
+
+def encode_png(width: int, height: int, rows: List[bytes], level: int = 6) -> bytes:
+    """An RGBA PNG of rows (width*4 bytes each), filter 0."""
+    z = zlib.compressobj(level)
+    idat = [z.compress(b"\x00" + r) for r in rows]
+    idat.append(z.flush())
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)
+    return (PNG_SIGNATURE + png_chunk(b"IHDR", ihdr) + png_chunk(b"IDAT", b"".join(idat))
+            + png_chunk(b"IEND", b""))
+
+
+def stitch(manifest: dict, get_tile: Callable[[str], bytes], level: int = 6) -> bytes:
+    """
+    One RGBA PNG of the whole layer. get_tile(sha1) returns a tile's bytes.
+
+    Works one band of tiles at a time, so memory stays at a band of raw
+    pixels plus the compressed output.
+    """
+    width, height = manifest["width"], manifest["height"]
+    cols, rows = grid_size(manifest)
+    z = zlib.compressobj(level)
+    idat: List[bytes] = []
+
+    for row in range(rows):
+        band_h = tile_bounds(manifest, 0, row)[1]
+        band: List[Optional[List[bytes]]] = []
+        for col in range(cols):
+            digest = manifest["tiles"].get(tile_key(col, row))
+            cell_w = tile_bounds(manifest, col, row)[0] * 4
+            if digest is None:
+                band.append(None)
+                continue
+            _w, _h, tile_rows = decode_rgba(get_tile(digest))
+            band.append([r[:cell_w].ljust(cell_w, b"\x00") for r in tile_rows[:band_h]])
+        blank = [bytes(tile_bounds(manifest, col, row)[0] * 4) for col in range(cols)]
+
+        for y in range(band_h):
+            line = [b"\x00"]
+            for col, cell in enumerate(band):
+                line.append(cell[y] if cell is not None and y < len(cell) else blank[col])
+            idat.append(z.compress(b"".join(line)))
+    idat.append(z.flush())
+
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)
+    return (PNG_SIGNATURE + png_chunk(b"IHDR", ihdr) + png_chunk(b"IDAT", b"".join(idat))
+            + png_chunk(b"IEND", b""))
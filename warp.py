@@ -0,0 +1,128 @@
+"""
+Projector-ready renders: the server-side twin of Static/projector.js.
+
+A design image is pre-warped for the shield's curve (projector.js
+warpCylindrical) and keystoned into the calibrated quad (drawImageToQuad).
+Here every output pixel is mapped back exactly instead: the quad's
+homography takes it to the warped image, the cylinder formula takes that
+to the flat design, and the design is sampled once, bilinearly, in
+premultiplied alpha. The browser resamples twice and approximates the
+keystone with affine triangles, which is where its seams come from.
+
+Needs NumPy; callers check `available()`.
+"""
+import math
+from typing import List, Optional, Sequence, Tuple
+
+from tiles import encode_png
+
+try:
+    import numpy as np
+except ImportError:  # optional; the browser renderer still works without it
+    np = None
+
+Point = Tuple[float, float]
+
+MAX_OUTPUT_PX = 8192
+_CHUNK_ROWS = 128  # output rows mapped at once (bounds the float arrays)
+
+
+class WarpError(ValueError):
+    """Calibration this module can't render."""
+
+
+def available() -> bool:
+    return np is not None
+
+
+def curvature_radius(width_in: float, curve_in: float) -> float:
+    """Radius of the arc with chord width_in and depth curve_in (R = W^2/8d + d/2); inf if flat."""
+    if not (math.isfinite(width_in) and math.isfinite(curve_in)) or width_in <= 0 or curve_in <= 0:
+        return math.inf
+    return width_in * width_in / (8 * curve_in) + curve_in / 2
+
+
+def homography(src: Sequence[Point], dst: Sequence[Point]):
+    """3x3 matrix taking the four src points to the four dst points."""
+    a, b = [], []
+    for (x, y), (u, v) in zip(src, dst):
+        a.append([x, y, 1, 0, 0, 0, -u * x, -u * y])
+        a.append([0, 0, 0, x, y, 1, -v * x, -v * y])
+        b.extend((u, v))
+    try:
+        h = np.linalg.solve(np.array(a, np.float64), np.array(b, np.float64))
+    except np.linalg.LinAlgError:
+        raise WarpError("quad corners are degenerate") from None
+    return np.append(h, 1.0).reshape(3, 3)
+
+
+def render(width: int, height: int, rows: List[bytes], quad: Sequence[Point], out_w: int, out_h: int,
+           width_in: Optional[float] = None, curve_in: Optional[float] = None,
+           background: Tuple[int, int, int, int] = (0, 0, 0, 255), level: int = 6) -> bytes:
+    """
+    PNG of out_w x out_h with the width x height RGBA image (rows) mapped
+    into quad (TL, TR, BR, BL, in output pixels) over background. With
+    width_in and curve_in the image is first pre-warped for a cylinder.
+    """
+    if np is None:
+        raise WarpError("NumPy is required for projector renders")
+    if not (0 < out_w <= MAX_OUTPUT_PX and 0 < out_h <= MAX_OUTPUT_PX):
+        raise WarpError(f"output size must be 1..{MAX_OUTPUT_PX} px")
+    corners = [(0.0, 0.0), (float(width), 0.0), (float(width), float(height)), (0.0, float(height))]
+    inverse = homography(quad, corners)  # output -> warped image
+
+    # Premultiplied source with a transparent 1 px border, so edges fade out like the canvas
+    px = np.frombuffer(b"".join(rows), np.uint8).reshape(height, width, 4).astype(np.float32) / 255.0
+    src = np.zeros((height + 2, width + 2, 4), np.float32)
+    src[1:-1, 1:-1, 3] = px[..., 3]
+    src[1:-1, 1:-1, :3] = px[..., :3] * px[..., 3:4]
+    del px
+
+    bg = np.array(background, np.float32) / 255.0
+    bg[:3] *= bg[3]
+    radius = curvature_radius(width_in or 0.0, curve_in or 0.0)
+    ppi, cx = (width / width_in, width / 2.0) if math.isfinite(radius) else (0.0, 0.0)
+
+    # Only the quad's bounding box needs mapping; the rest is background
+    qx = [p[0] for p in quad]
+    qy = [p[1] for p in quad]
+    x0, x1 = max(0, int(math.floor(min(qx)))), min(out_w, int(math.ceil(max(qx))))
+    y0, y1 = max(0, int(math.floor(min(qy)))), min(out_h, int(math.ceil(max(qy))))
+
+    out = np.empty((out_h, out_w, 4), np.uint8)
+    out[...] = _to_rgba8(bg[None, None, :])
+    xs = np.arange(x0, x1, dtype=np.float64) + 0.5
+    for r0 in range(y0, y1, _CHUNK_ROWS):
+        ys = np.arange(r0, min(r0 + _CHUNK_ROWS, y1), dtype=np.float64)[:, None] + 0.5
+        den = inverse[2, 0] * xs + inverse[2, 1] * ys + inverse[2, 2]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            u = (inverse[0, 0] * xs + inverse[0, 1] * ys + inverse[0, 2]) / den
+            v = (inverse[1, 0] * xs + inverse[1, 1] * ys + inverse[1, 2]) / den
+        if ppi:
+            u = cx + radius * np.sin((u - cx) / ppi / radius) * ppi  # surface -> chord (flat design)
+        sample = _bilinear(src, u, v, den > 0)
+        out[r0:r0 + len(ys), x0:x1] = _to_rgba8(sample + bg * (1.0 - sample[..., 3:4]))
+
+    return encode_png(out_w, out_h, [r.tobytes() for r in out], level)
+
+
+def _bilinear(src, u, v, valid):
+    """Premultiplied samples of src (1 px padded) at image coordinates u, v; zero where not valid."""
+    h, w = src.shape[0] - 2, src.shape[1] - 2
+    fx = np.where(valid, u, -10.0) + 0.5  # pixel centers sit at i + 0.5; +1 for the border
+    fy = np.where(valid, v, -10.0) + 0.5
+    ix, iy = np.floor(fx), np.floor(fy)
+    inside = (ix >= 0) & (ix <= w) & (iy >= 0) & (iy <= h)
+    tx, ty = (fx - ix)[..., None].astype(np.float32), (fy - iy)[..., None].astype(np.float32)
+    ix = np.clip(ix, 0, w).astype(np.intp)
+    iy = np.clip(iy, 0, h).astype(np.intp)
+    top = src[iy, ix] * (1 - tx) + src[iy, ix + 1] * tx
+    bottom = src[iy + 1, ix] * (1 - tx) + src[iy + 1, ix + 1] * tx
+    return np.where(inside[..., None], top * (1 - ty) + bottom * ty, 0.0)
+
+
+def _to_rgba8(pm):
+    """Premultiplied float RGBA (0..1) -> straight uint8 RGBA."""
+    alpha = pm[..., 3:4]
+    rgb = np.divide(pm[..., :3], alpha, out=np.zeros_like(pm[..., :3]), where=alpha > 0)
+    return np.clip(np.rint(np.concatenate([rgb, alpha], axis=-1) * 255.0), 0, 255).astype(np.uint8)